@@ -1,49 +1,359 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import logging
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
-import spacy
-import xml.etree.ElementTree as ET
-import glob
+from response_cache import cache_from_env, cache_bypass, make_key
+from template_registry import TemplateRegistry
+from svg_optimizer import optimize_svg, format_number
+from image_store import ImageStore, MIME_TYPES
+from image_processing import image_variant
+from job_store import Job, JobStore
+from template_classifier import TemplateHistory, load_classifier
+from keywords import KeywordExtractor
+from text_layout import TextLayout, TextBox
+from raster import Rasterizer, RASTER_FORMATS, parse_size, rasterization_available
+from batch import parse_inputs, batch_key
+from http_cache import CompressedResponses
+from image_library import ImageLibrary
+from warm_pool import WarmPool, read_topics
+from providers import provider_from_env
+from scheduler import scheduler_from_env
+from metrics import metrics as pipeline_metrics, trace, span, timed, record_chat, record_image, record_fallback
 import re
+from functools import partial, lru_cache
+import json
+import base64
+import contextvars
+import gc
+import hashlib
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 load_dotenv()
 
 logging.basicConfig(level=logging.DEBUG)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Where chat completions and images come from: OpenAI, or a local stub for load tests (LLM_PROVIDER=stub).
+provider = provider_from_env()
 client_host = f"http://localhost:{os.getenv('CLIENT_PORT', '3000')}"
+response_cache = cache_from_env()
+
+# Concurrency cap and per-call timeout (seconds) for OpenAI calls. A cap of 1 runs the calls sequentially.
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv('LLM_MAX_CONCURRENCY', 8)))
+LLM_CALL_TIMEOUT = float(os.getenv('LLM_CALL_TIMEOUT', 60))
+llm_pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+# Rate limits, retries, deadlines and hedging of every model call; LLM_MAX_CONCURRENCY also caps the calls in flight
+# across all requests and batch items.
+scheduler = scheduler_from_env(LLM_CALL_TIMEOUT, LLM_MAX_CONCURRENCY)
+# Translate all texts to all languages in a single JSON-mode call, falling back to per-text calls.
+BATCH_TRANSLATION = os.getenv('BATCH_TRANSLATION', 'True').lower() in ['true', '1', 't']
+
+LANGUAGES = {"he": "Hebrew", "en": "English", "ar": "Arabic", "ru": "Russian"}
+FOOTER_TEXTS = {
+    "he": "מערך ההסברה של פיקוד העורף",
+    "en": "The IDF's Information and Relief Formation",
+    "ar": "قسم التوعية في الجبهة الداخلية",
+    "ru": "Информационное подразделение Командования тыла",
+}
+
+# The boxes the texts are laid out in, measured with the Rubik glyph widths (see text_layout.py): the header spans
+# the 500px wide templates with a margin, and the subheaders of template 2 the space beside the image.
+# Without the generated glyph tables text_layout is None, and the texts are wrapped at the character limits of their
+# language at the largest font size of their box, and shortened when they are over their word limit.
+text_layout = TextLayout.from_file(os.getenv('LAYOUT_METRICS_PATH', 'rubik_metrics.json'))
+TEXT_BOXES = {
+    "header": TextBox(440, 2, (32, 30, 28, 26, 24), bold=True),
+    "sub_header1": TextBox(230, 2, (20, 19, 18, 17, 16)),
+    "sub_header2": TextBox(230, 2, (20, 19, 18, 17, 16)),
+}
+
+# Different character limits for different languages (wrapping limits without the glyph tables)
+HEADER_CHAR_LIMITS = {
+    "he": 25,
+    "en": 25,
+    "ar": 30,
+    "ru": 25
+}
+
+SUBHEADER_CHAR_LIMITS = {
+    "he": 25,
+    "en": 25,
+    "ar": 27,
+    "ru": 20
+}
+
+# Maximum word counts for header and subheaders, asked for in translations and shortenings
+HEADER_MAX_WORDS = {
+    "he": 10,
+    "en": 10,
+    "ar": 10,
+    "ru": 8
+}
+
+SUBHEADER_MAX_WORDS = {
+    "he": 10,
+    "en": 10,
+    "ar": 10,
+    "ru": 6
+}
+
+# With IMAGE_OUTPUT_MODE=link the generated image is stored once in IMAGE_DIR and the SVGs reference it
+# through the /image endpoint instead of embedding it in every language. /export always returns a self-contained SVG.
+IMAGE_OUTPUT_MODE = os.getenv('IMAGE_OUTPUT_MODE', 'inline').lower()
+image_store = ImageStore(os.getenv('IMAGE_DIR', 'images'))
+# The generated image is resized to its slot in the template (times IMAGE_SCALE, for high-DPI screens)
+# and re-encoded as IMAGE_FORMAT (png, webp or jpeg) before it is embedded or stored.
+IMAGE_RESIZE = os.getenv('IMAGE_RESIZE', 'True').lower() in ['true', '1', 't']
+IMAGE_SCALE = float(os.getenv('IMAGE_SCALE', 2))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'png').lower()
+
+# SVG templates are parsed once at startup. With TEMPLATE_HOT_RELOAD the files are watched and recompiled on change.
+# With SVG_OPTIMIZE each template is first optimized (its logo downscaled, unused definitions, whitespace and
+# redundant attributes removed, numbers shortened), which makes every rendered SVG about 8 times smaller.
+SVG_OPTIMIZE = os.getenv('SVG_OPTIMIZE', 'True').lower() in ['true', '1', 't']
+templates = TemplateRegistry(
+    os.getenv('TEMPLATE_DIR', '.'),
+    ["template1.svg", "template2.svg", "template2_ltr.svg"],
+    hot_reload=os.getenv('TEMPLATE_HOT_RELOAD', 'False').lower() in ['true', '1', 't'],
+    optimize=partial(optimize_svg, image_scale=IMAGE_SCALE) if SVG_OPTIMIZE else None,
+)
+
+# Every generated image is added to a library (in IMAGE_DIR, indexed in IMAGE_LIBRARY_PATH) by its input, prompt and
+# keywords. generate_image reuses a library image as similar as IMAGE_REUSE_THRESHOLD (0 to 1) instead of generating
+# a new one, and editors can search the library at /images and pick an image for an infographic.
+image_library = None
+if os.getenv('IMAGE_LIBRARY', 'True').lower() in ['true', '1', 't']:
+    image_library = ImageLibrary(os.getenv('IMAGE_LIBRARY_PATH', 'image_library.jsonl'), image_store)
+IMAGE_REUSE_THRESHOLD = float(os.getenv('IMAGE_REUSE_THRESHOLD', 0.8))
+
+# Results are kept per job (one per /infographic request) in an in-memory LRU of JOB_STORE_SIZE jobs.
+# Under a multi-worker server, JOB_SPILL_DIR lets the workers share the jobs through the disk.
+job_store = JobStore(int(os.getenv('JOB_STORE_SIZE', 200)), os.getenv('JOB_SPILL_DIR'))
+# Asynchronous jobs (POST /jobs) run on a pool of JOB_WORKERS threads instead of blocking a server worker.
+job_executor = ThreadPoolExecutor(max_workers=int(os.getenv('JOB_WORKERS', 4)), thread_name_prefix="job")
+# SVGs are served as image/svg+xml, compressed with brotli or gzip and with ETags, from /jobs/<job_id>/svg/<language>
+# and /change_language. SVG_RESPONSE_MODE=json keeps the old JSON responses ({'updated_svg': ...}) for every request,
+# and a request can ask for them with "format": "json" (or ?format=json).
+SVG_RESPONSE_MODE = os.getenv('SVG_RESPONSE_MODE', 'svg').lower()
+SVG_MAX_AGE = int(os.getenv('SVG_MAX_AGE', 3600))
+compressed_responses = CompressedResponses(int(float(os.getenv('COMPRESSION_CACHE_MB', 64)) * 1024 * 1024))
+# eager renders every language before /infographic returns; lazy renders only Hebrew and each other language on its
+# first request (memoized in the job); speculative also renders them in the background, LANGUAGE_WORKERS jobs at a
+# time, after the Hebrew infographic has been returned.
+LANGUAGE_MODE = os.getenv('LANGUAGE_MODE', 'eager').lower()
+language_executor = ThreadPoolExecutor(max_workers=int(os.getenv('LANGUAGE_WORKERS', 1)), thread_name_prefix="language")
+# The infographics of the common topics listed in WARM_POOL_TOPICS are generated ahead of time into WARM_POOL_DIR
+# (python warm_pool.py refresh, or every WARM_POOL_INTERVAL seconds in the background) and served from there.
+warm_pool = None
+if os.getenv('WARM_POOL', 'True').lower() in ['true', '1', 't']:
+    warm_pool = WarmPool(os.getenv('WARM_POOL_DIR', 'warm_pool'), float(os.getenv('WARM_POOL_TTL', 24 * 3600)))
+WARM_POOL_TOPICS = os.getenv('WARM_POOL_TOPICS', 'warm_topics.txt')
+WARM_POOL_INTERVAL = float(os.getenv('WARM_POOL_INTERVAL', 0))
+# Refreshes generate WARM_POOL_WORKERS topics at a time on their own threads, so they don't hold up batches.
+WARM_POOL_WORKERS = max(1, int(os.getenv('WARM_POOL_WORKERS', 2)))
+warm_pool_executor = ThreadPoolExecutor(max_workers=WARM_POOL_WORKERS, thread_name_prefix="warm")
+# While a job runs, the header and sub-headers are streamed from the model and the Hebrew infographic is sent as a
+# "preview" event each time one of their lines is complete, with a placeholder for the image (LLM_STREAMING).
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'True').lower() in ['true', '1', 't']
+PREVIEW_IMAGE = "data:image/svg+xml;base64," + base64.b64encode(
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="1" height="1"><rect width="1" height="1" fill="#E5E7EB"/></svg>'
+).decode("ascii")
+# The preview of the job the current pipeline run belongs to (see update_preview), or None.
+current_preview = contextvars.ContextVar("preview", default=None)
+# Batches (POST /batch and batch.py) generate BATCH_CONCURRENCY items at a time, up to BATCH_MAX_ITEMS per batch.
+BATCH_CONCURRENCY = max(1, int(os.getenv('BATCH_CONCURRENCY', 8)))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 200))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch")
+
+# /export renders PNG, JPEG or WebP versions of the SVGs with cairosvg on RASTER_WORKERS worker processes,
+# keeping up to RASTER_CACHE_MB of outputs in memory.
+rasterizer = Rasterizer(int(os.getenv('RASTER_WORKERS', 2)), int(float(os.getenv('RASTER_CACHE_MB', 64)) * 1024 * 1024))
+RASTER_TIMEOUT = float(os.getenv('RASTER_TIMEOUT', 30))
+
+# The template is chosen in-process by a local classifier, asking GPT-4 only below the classifier's confidence
+# threshold, calibrated on its held-out accuracy (or TEMPLATE_CLASSIFIER_THRESHOLD if set). The choices are appended to
+# TEMPLATE_HISTORY_PATH; retrain with "python template_classifier.py retrain".
+template_history = TemplateHistory(os.getenv('TEMPLATE_HISTORY_PATH', 'template_history.jsonl'))
+template_classifier = None
+if os.getenv('TEMPLATE_CLASSIFIER', 'True').lower() in ['true', '1', 't']:
+    template_classifier = load_classifier(os.getenv('TEMPLATE_CLASSIFIER_PATH', 'template_classifier.json'), template_history)
+    if os.getenv('TEMPLATE_CLASSIFIER_THRESHOLD'):
+        template_classifier.threshold = float(os.getenv('TEMPLATE_CLASSIFIER_THRESHOLD'))
+    logging.info(f"Template classifier confidence threshold: {template_classifier.threshold:.3f}")
 
 app = Flask(__name__)
 CORS(app, resources={
     r"/infographic": {"origins": client_host}, 
-    r"/change_language": {"origins": client_host}
+    r"/change_language": {"origins": client_host},
+    r"/export": {"origins": client_host},
+    r"/image/*": {"origins": client_host},
+    r"/images": {"origins": client_host},
+    r"/jobs": {"origins": client_host},
+    r"/jobs/*": {"origins": client_host}
 }, supports_credentials=True, allow_headers=['Content-Type'])
 
-# Loads or retrieves the English spaCy NLP model.
-nlp_en = None
-def get_nlp_model():
-    global nlp_en
-    if nlp_en is None:
-        nlp_en = spacy.load("en_core_web_sm")
-    return nlp_en
+# Extracts the keywords of the image prompts with spaCy (see keywords.KeywordExtractor for the NLP_MODE options).
+# With NLP_PREWARM the pipeline is loaded at startup instead of on the first request; under a preforking server
+# (e.g. gunicorn --preload) it is then loaded once and shared by the workers, and gc.freeze() keeps the garbage
+# collector from touching (and so copying) the shared pages.
+keyword_extractor = KeywordExtractor(os.getenv('NLP_MODE', 'trimmed').lower(), os.getenv('NLP_MODEL', 'en_core_web_sm'))
+if os.getenv('NLP_PREWARM', 'True').lower() in ['true', '1', 't']:
+    keyword_extractor.load()
+    gc.freeze()
+
+# Runs independent calls concurrently on the shared OpenAI pool.
+# calls maps a key to (function, args, fallback); a call that raises or times out yields its fallback, which is
+# recorded in the current trace (see metrics.record_fallback) so that the response can report it as degraded.
+# Each call gets timeout seconds from when it starts running, not from when it was submitted: the pool is shared with
+# the other requests, batches and warm pool refreshes, so calls may wait for a free worker first. The default timeout
+# is the scheduler's deadline, which covers the retries of a call.
+def run_parallel(calls, timeout=scheduler.deadline):
+    started = {}
+
+    def run(key, function, *args):
+        started[key] = time.monotonic()
+        return function(*args)
+
+    # Each call runs in a copy of the caller's context so per-request settings (e.g. cache_bypass) carry over.
+    futures = {key: llm_pool.submit(contextvars.copy_context().run, run, key, function, *args) for key, (function, args, _) in calls.items()}
+    pending = set(futures.values())
+    timed_out = set()
+    while pending:
+        running = [started[key] for key, future in futures.items() if future in pending and key in started]
+        # Queued calls have no deadline yet; check again shortly to start their clocks
+        wait_for = min([start + timeout - time.monotonic() for start in running] + [1.0])
+        done, pending = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for key, future in futures.items():
+            if future in pending and key in started and now - started[key] >= timeout:
+                timed_out.add(future)
+        pending -= timed_out
+    results = {}
+    for key, future in futures.items():
+        fallback = calls[key][2]
+        if future in timed_out:
+            logging.error(f"Parallel call {key} timed out")
+            record_fallback(str(key), "timeout")
+            results[key] = fallback
+        elif future.exception() is not None:
+            logging.error(f"Parallel call {key} failed: {future.exception()}")
+            record_fallback(str(key), str(future.exception()))
+            results[key] = fallback
+        else:
+            results[key] = future.result()
+    return results
+
+# Runs a dependency graph of tasks, starting each task as soon as all of its dependencies have finished.
+# tasks maps a name to (function, dependency names); the function is called with its dependencies' results in order.
+# on_finished, if given, is called with (name, elapsed seconds, finished task count, total task count) after each task.
+# Returns the results of all tasks by name. If a task raises, no new tasks are started and the error is re-raised.
+def run_dag(tasks, on_finished=None):
+    results = {}
+    running = {}
+    started = {}
+    pending = dict(tasks)
+    executor = ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="dag")
+    try:
+        while pending or running:
+            for name, (function, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    del pending[name]
+                    args = [results[dep] for dep in deps]
+                    started[name] = time.perf_counter()
+                    running[executor.submit(contextvars.copy_context().run, function, *args)] = name
+            if not running:
+                raise ValueError(f"Unresolvable task dependencies: {sorted(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                elapsed = time.perf_counter() - started[name]
+                logging.debug(f"Task {name} finished in {elapsed:.3f}s")
+                if on_finished:
+                    on_finished(name, elapsed, len(results), len(tasks))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+# Sends a chat completion to the provider and returns the reply, using the response cache when enabled.
+# kind names the calling stage for the cache hit/miss counters and the call metrics.
+# With on_lines, the reply is streamed and on_lines is called with its complete lines each time a line is completed
+# (and with all of them at the end); streamed calls aren't hedged, as a duplicate would report its lines too.
+def chat_completion(model, messages, kind="chat", on_lines=None, **options):
+    key = make_key("chat", provider.name, model, messages, options)
+    if response_cache:
+        cached = response_cache.get(key, kind=kind)
+        if cached is not None:
+            record_chat(model, kind, cached=True)
+            if on_lines is not None:
+                on_lines(cached.strip().split("\n"))
+            return cached
+    # Roughly 4 characters per token, for the tokens-per-minute limit
+    tokens = sum(len(message["content"]) for message in messages) // 4
+    if on_lines is not None:
+        content, usage = scheduler.call(model, lambda timeout: stream_chat(model, messages, on_lines, timeout, **options), tokens)
+    else:
+        content, usage = scheduler.call(model, lambda timeout: provider.chat(model, messages, timeout=timeout, **options), tokens, hedge=True)
+    record_chat(model, kind, usage)
+    if response_cache:
+        response_cache.put(key, content, kind=kind)
+    return content
+
+# Consumes a streamed chat completion, reporting its lines to on_lines as they are completed. Returns the reply and
+# its usage, like provider.chat.
+def stream_chat(model, messages, on_lines, timeout, **options):
+    pieces = []
+    usage = None
+    reported = 0
+    for piece, piece_usage in provider.chat_stream(model, messages, timeout=timeout, **options):
+        pieces.append(piece)
+        usage = piece_usage or usage
+        if "\n" in piece:
+            lines = "".join(pieces).split("\n")[:-1]
+            if len(lines) > reported:
+                reported = len(lines)
+                on_lines(lines)
+    content = "".join(pieces)
+    on_lines(content.strip().split("\n"))
+    return content, usage
+
+# Generates an image with DALL-E 3 (through the provider) and returns it base64 encoded, using the response cache
+# when enabled. The image bytes are stored once in the cache by their content hash.
+@timed("dalle")
+def generate_dalle_image(prompt, size="1024x1024"):
+    key = make_key("image", provider.name, "dall-e-3", prompt, size)
+    if response_cache:
+        cached = response_cache.get_blob(key, kind="dalle")
+        if cached is not None:
+            record_image("dall-e-3", size, cached=True)
+            return base64.b64encode(cached).decode("ascii")
+    image_base64 = scheduler.call("dall-e-3", lambda timeout: provider.generate_image("dall-e-3", prompt, size, timeout=timeout))
+    record_image("dall-e-3", size)
+    if response_cache:
+        response_cache.put_blob(key, base64.b64decode(image_base64), kind="dalle")
+    return image_base64
 
 # Translates text to a specified target language using OpenAI's GPT-4.
+@timed("translate_text")
 def translate_text(text, target_lang):
     if target_lang.lower() == "hebrew":
         return text
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="gpt-4-1106-preview",
             messages=[
                 {"role": "system", "content": f"Translate the following text from Hebrew to {target_lang}:"},
                 {"role": "user", "content": text}
             ],
+            kind="translate_text",
         )
-        return response.choices[0].message.content.strip()
+        return response.strip()
     except Exception as e:
         logging.error(f"Translation error: {e}")
+        record_fallback(f"translate_text {target_lang}", str(e))
         return text
 
 # Function to wrap text at the end of words when length exceeds max_chars_per_line
@@ -67,11 +377,9 @@ def wrap_text(text, max_chars_per_line, max_lines=None):
         lines = lines[:max_lines-1] + [extra]
     return lines
 
-# Function to modify SVG for wrapped text
-def add_wrapped_text_to_svg(svg_content, element_id, text, max_chars, x_pos, y_pos, font_size=None, font_weight=None, text_anchor=None, direction=None, fill=None):
-    if not text:
-        return svg_content
-
+# Function to build an SVG text element with the text wrapped into tspan lines
+# lines, if given, are the already laid out lines of the text and are used instead of wrapping it at max_chars.
+def build_wrapped_text_element(element_id, text, max_chars, x_pos, y_pos, font_size=None, font_weight=None, text_anchor=None, direction=None, fill=None, lines=None):
     # Create text element attributes
     attributes = f'id="{element_id}"'
     if font_size:
@@ -87,10 +395,13 @@ def add_wrapped_text_to_svg(svg_content, element_id, text, max_chars, x_pos, y_p
         attributes += f' fill="{fill}"'
 
     # Wrap the text
-    lines = wrap_text(text, max_chars, max_lines=2)
+    if lines is None:
+        lines = wrap_text(text, max_chars, max_lines=2)
 
-    # Create SVG text element with tspan for each line
-    text_element = f'<text font-family="Rubik, sans-serif" {attributes} x="{x_pos}" y="{y_pos}">\n'
+    # Create SVG text element with tspan for each line, without indentation and with short numbers (see svg_optimizer)
+    x_pos = format_number(x_pos)
+    y_pos = format_number(y_pos)
+    text_element = f'<text font-family="Rubik, sans-serif" {attributes} x="{x_pos}" y="{y_pos}">'
 
     # Calculate line height based on font size (approximately 1.2x font size)
     line_height = 1.2
@@ -103,22 +414,44 @@ def add_wrapped_text_to_svg(svg_content, element_id, text, max_chars, x_pos, y_p
 
     # Add tspan elements for each line
     for i, line in enumerate(lines):
-        dy = "1em" if i == 0 else f"{line_height}px"
-        text_element += f'    <tspan x="{x_pos}" dy="{dy}">{line}</tspan>\n'
+        dy = "1em" if i == 0 else f"{format_number(line_height)}px"
+        text_element += f'<tspan x="{x_pos}" dy="{dy}">{line}</tspan>'
 
     text_element += '</text>'
+    return text_element
 
-    # Find and replace the existing text element with new wrapped text
-    import re
-    pattern = f'<text[^>]*id="{element_id}"[^>]*>.*?</text>'
-    svg_content = re.sub(pattern, text_element, svg_content, flags=re.DOTALL)
+# Function to modify SVG for wrapped text
+def add_wrapped_text_to_svg(svg_content, element_id, text, max_chars, x_pos, y_pos, font_size=None, font_weight=None, text_anchor=None, direction=None, fill=None):
+    if not text:
+        return svg_content
 
-    return svg_content
+    text_element = build_wrapped_text_element(element_id, text, max_chars, x_pos, y_pos, font_size, font_weight, text_anchor, direction, fill)
+
+    # Find and replace the existing text element with new wrapped text
+    start, end = find_text_element(svg_content, element_id)
+    if start is None:
+        return svg_content
+    return svg_content[:start] + text_element + svg_content[end:]
+
+# Finds the <text> element with the given id and returns its (start, end) offsets, or (None, None).
+# Uses plain substring searches instead of a DOTALL regex, so an inline base64 image isn't re-scanned by the regex engine.
+def find_text_element(svg_content, element_id):
+    marker = f'id="{element_id}"'
+    index = svg_content.find(marker)
+    while index != -1:
+        start = svg_content.rfind("<", 0, index)
+        if svg_content.startswith("<text", start) and ">" not in svg_content[start:index]:
+            end = svg_content.find("</text>", index)
+            if end != -1:
+                return start, end + len("</text>")
+        index = svg_content.find(marker, index + 1)
+    return None, None
 
 # Function to shorten text using GPT-4
+@timed("shorten_text_gpt")
 def shorten_text_gpt(text, target_lang, max_words=7):
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="gpt-4-1106-preview",
             messages=[
                 {
@@ -127,184 +460,285 @@ def shorten_text_gpt(text, target_lang, max_words=7):
                 },
                 {"role": "user", "content": text},
             ],
+            kind="shorten_text_gpt",
         )
-        return response.choices[0].message.content.strip()
+        return response.strip()
     except Exception as e:
         logging.error(f"Error shortening text with GPT: {e}")
+        record_fallback(f"shorten_text_gpt {target_lang}", str(e))
         return text # Return original text in case of error
 
-# Function to create infographics for all languages
-def create_infographics_for_all(template_file, image_base64, header, sub_header1=None, sub_header2=None, result_prefix="result"):
-    languages = {"he": "Hebrew", "en": "English", "ar": "Arabic", "ru": "Russian"}
-    footer_texts = {
-        "he": "מערך ההסברה של פיקוד העורף",
-        "en": "The IDF's Information and Relief Formation",
-        "ar": "قسم التوعية في الجبهة الداخلية",
-        "ru": "Информационное подразделение Командования тыла",
-    }
-
-    # Different character limits for different languages (wrapping limits)
-    header_char_limits = {
-        "he": 25,
-        "en": 25,
-        "ar": 30,
-        "ru": 25
-    }
-
-    subheader_char_limits = {
-        "he": 25,
-        "en": 25,
-        "ar": 27,
-        "ru": 20
-    }
-
-    # Maximum word counts for header and subheaders
-    header_max_words = {
-        "he": 10,
-        "en": 10,
-        "ar": 10,
-        "ru": 8
-    }
-
-    subheader_max_words = {
-        "he": 10,
-        "en": 10,
-        "ar": 10,
-        "ru": 6
-    }
-
-    results = {}
+# Returns the maximum word count of a field ("header", "sub_header1" or "sub_header2") in a language.
+def max_words_for(code, field):
+    if field == "header":
+        return HEADER_MAX_WORDS.get(code, 12)
+    return SUBHEADER_MAX_WORDS.get(code, 9)
+
+# Translates several Hebrew texts to all other languages in one JSON-mode call to OpenAI's GPT-4,
+# asking for each translation to stay within the word limit of its language and field.
+# fields maps a field name to its Hebrew text; returns {code: {field: text}} holding only the valid translations.
+# languages limits the target language codes (default: all).
+@timed("translate_batch")
+def translate_batch(fields, languages=None):
+    fields = {field: text for field, text in fields.items() if text}
+    targets = {code: lang for code, lang in LANGUAGES.items() if code != "he" and (languages is None or code in languages)}
+    if not fields or not targets:
+        return {}
+    limits = {code: {field: max_words_for(code, field) for field in fields} for code in targets}
+    payload = {"texts": fields, "languages": targets, "max_words": limits}
+    try:
+        response = chat_completion(
+            model="gpt-4-1106-preview",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Translate each of the Hebrew texts in 'texts' to each of the languages in 'languages', keeping the original meaning as close as possible. "
+                    "Each translation must have at most 'max_words'[language code][text name] words, shorten it if needed. "
+                    "Respond with a JSON object that maps each language code to an object that maps each text name to its translation.",
+                },
+                {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+            ],
+            response_format={"type": "json_object"},
+            kind="translate_batch",
+        )
+        matrix = json.loads(response)
+    except Exception as e:
+        logging.error(f"Batch translation error: {e}")
+        record_fallback("translate_batch", str(e))
+        return {}
+
+    translations = {}
+    for code in targets:
+        translations[code] = {}
+        entries = matrix.get(code) if isinstance(matrix, dict) else None
+        for field in fields:
+            text = entries.get(field) if isinstance(entries, dict) else None
+            # With the glyph tables, translations over the word limit are kept: localize_texts only shortens the ones that
+            # don't fit their box
+            if isinstance(text, str) and text.strip() and (text_layout is not None or len(text.split()) <= limits[code][field]):
+                translations[code][field] = text.strip()
+            else:
+                logging.warning(f"Invalid batch translation for {code}/{field}: {text!r}")
+    return translations
+
+# Translates texts to all languages, shortening only the texts that can't fit their box even at the smallest font size.
+# fields maps a field name ("header", "sub_header1", "sub_header2") to its Hebrew text; returns {code: {field: text}}.
+# With BATCH_TRANSLATION all texts are translated in one call, and only the entries that failed validation
+# are translated separately. The separate translations run concurrently, followed by all the needed shortenings.
+# languages limits the language codes to localize (default: all).
+def localize_texts(fields, languages=None):
+    languages = {code: lang for code, lang in LANGUAGES.items() if languages is None or code in languages}
+    # Hebrew needs no translation: skip the call (and its span) when it is the only language
+    needs_translation = any(code != "he" for code in languages) and any(fields.values())
+    batch = translate_batch(fields, languages) if BATCH_TRANSLATION and needs_translation else {}
+
+    calls = {}
     for code, lang in languages.items():
-        translated_header = header if code == "he" else translate_text(header, lang)
-        translated_sub_header1 = translate_text(sub_header1, lang) if sub_header1 else ""
-        translated_sub_header2 = translate_text(sub_header2, lang) if sub_header2 else ""
-
-        header_word_count = len(translated_header.split())
-        subheader1_word_count = len(translated_sub_header1.split())
-        subheader2_word_count = len(translated_sub_header2.split())
-
-        # Shorten header if it exceeds word limit
-        header_max_word_count = header_max_words.get(code, 12)
-        if header_word_count > header_max_word_count:
-            translated_header = shorten_text_gpt(translated_header, lang, header_max_word_count)
-
-        # Shorten sub_header1 if it exceeds word limit
-        subheader1_max_word_count = subheader_max_words.get(code, 9)
-        if subheader1_word_count > subheader1_max_word_count:
-            translated_sub_header1 = shorten_text_gpt(translated_sub_header1, lang, subheader1_max_word_count)
-
-        # Shorten sub_header2 if it exceeds word limit
-        subheader2_max_word_count = subheader_max_words.get(code, 9)
-        if subheader2_word_count > subheader2_word_count: # corrected variable name here. It was subheader2_word_count > subheader1_max_word_count
-            translated_sub_header2 = shorten_text_gpt(translated_sub_header2, lang, subheader2_max_word_count)
-
-        # Determine text direction and template
-        is_rtl = code in ["he", "ar"]
-        direction = "rtl" if is_rtl else "ltr"
-        text_anchor_rtl = "end"  # For RTL languages
-        text_anchor_ltr = "start"    # For LTR languages
-        text_anchor = text_anchor_rtl if is_rtl else text_anchor_ltr
-
-        # Choose correct template based on template type and language direction
-        actual_template_file = template_file
-        if "template2" in template_file and not is_rtl:
-            actual_template_file = "template2_ltr.svg"
-            logging.info(f"Using LTR template for language: {code}")
-
-        try:
-            with open(actual_template_file, "r", encoding="utf-8") as file:
-                svg_content = file.read()
-                logging.info(f"Successfully opened template file: {actual_template_file}")
-        except Exception as e:
-            logging.error(f"Error opening template file {actual_template_file}: {e}")
-            continue
-
-        # Replace basic placeholders
-        # For template 2, direction and text-anchor are hardcoded in the SVG
-        if "template2" not in actual_template_file:
-            svg_content = svg_content.replace("{{direction}}", direction)
-            svg_content = svg_content.replace("{{text_anchor}}", text_anchor)
-        svg_content = svg_content.replace("{{footer_text}}", footer_texts[code])
-
-        # Make sure all placeholders are replaced
-        if "template2" in actual_template_file:
-            # Direct replacement for potential placeholder formats
-            svg_content = svg_content.replace("{{sub_header1}}", translated_sub_header1)
-            svg_content = svg_content.replace("{{sub_header2}}", translated_sub_header2)
+        for field, text in fields.items():
+            if text and code != "he" and field not in batch.get(code, {}):
+                calls[(code, field)] = (translate_text, (text, lang), text)
+    translations = run_parallel(calls)
+    for code, entries in batch.items():
+        for field, text in entries.items():
+            translations[(code, field)] = text
+
+    texts = {}
+    for code in languages:
+        texts[code] = {}
+        for field, text in fields.items():
+            texts[code][field] = translations.get((code, field), text) or ""
+
+    calls = {}
+    for code, lang in languages.items():
+        for field, text in texts[code].items():
+            if not text or field not in TEXT_BOXES:
+                continue
+            if text_layout is None:
+                max_words = max_words_for(code, field)
+                if len(text.split()) > max_words:
+                    calls[(code, field)] = (shorten_text_gpt, (text, lang, max_words), text)
+                continue
+            layout = text_layout.fit(text, TEXT_BOXES[field])
+            if not layout.fits:
+                # Ask for no more words than fit the box
+                max_words = max(1, min(max_words_for(code, field), layout.words_fitted))
+                calls[(code, field)] = (shorten_text_gpt, (text, lang, max_words), text)
+    for (code, field), text in run_parallel(calls).items():
+        texts[code][field] = text
+
+    return texts
+
+# Function to render the infographic of one language
+# texts holds the localized texts of that language, and image_href the image URI (or None to keep the placeholder).
+@timed("render")
+def render_infographic(template_file, code, texts, image_href):
+    return build_infographic(template_file, code, texts, image_href)
+
+# Renders the infographic of one language without recording a "render" stage (see render_infographic), for the
+# previews, which are timed as their own stage.
+def build_infographic(template_file, code, texts, image_href):
+    translated_sub_header1 = texts.get("sub_header1", "")
+    translated_sub_header2 = texts.get("sub_header2", "")
+
+    # Determine text direction and template
+    is_rtl = code in ["he", "ar"]
+    direction = "rtl" if is_rtl else "ltr"
+    text_anchor_rtl = "end"  # For RTL languages
+    text_anchor_ltr = "start"    # For LTR languages
+    text_anchor = text_anchor_rtl if is_rtl else text_anchor_ltr
+
+    # Choose correct template based on template type and language direction
+    actual_template_file = template_file
+    if "template2" in template_file and not is_rtl:
+        actual_template_file = "template2_ltr.svg"
+        logging.info(f"Using LTR template for language: {code}")
 
-        if image_base64:
-            svg_content = svg_content.replace("{{image}}", f"data:image/png;base64,{image_base64}")
-            # Also try this format of image placeholder
-            svg_content = svg_content.replace("BASE64", f"data:image/png;base64,{image_base64}")
+    try:
+        template = templates.get(actual_template_file)
+    except Exception as e:
+        logging.error(f"Error loading template file {actual_template_file}: {e}")
+        return None
 
-        # Apply wrapped text for header and subheaders
-        header_limit = header_char_limits.get(code, 25)
-        subheader_limit = subheader_char_limits.get(code, 25)
+    # Replace basic placeholders
+    # For template 2, direction and text-anchor are hardcoded in the SVG
+    values = {"footer_text": FOOTER_TEXTS[code]}
+    if "template2" not in actual_template_file:
+        values["direction"] = direction
+        values["text_anchor"] = text_anchor
+    else:
+        values["sub_header1"] = translated_sub_header1
+        values["sub_header2"] = translated_sub_header2
+    if image_href:
+        values["image"] = image_href
+
+    # Lay out the header and subheaders in their boxes
+    elements = build_text_elements(actual_template_file, code, texts, direction)
+
+    # Render the template with all placeholders and text elements in a single pass
+    svg_content = template.render(values, elements)
+    return svg_content
 
-        # Replace header with wrapped version
-        svg_content = add_wrapped_text_to_svg(
-            svg_content,
+# Returns the lines of a text of a field in a language and their font size: laid out in the field's box at the largest
+# font size that fits, or wrapped at the language's character limit without the glyph tables.
+def layout_text(field, code, text):
+    box = TEXT_BOXES[field]
+    if text_layout is None:
+        limits = HEADER_CHAR_LIMITS if field == "header" else SUBHEADER_CHAR_LIMITS
+        return wrap_text(text, limits.get(code, 25), max_lines=box.max_lines), box.font_sizes[0]
+    layout = text_layout.fit(text, box)
+    return layout.lines, layout.font_size
+
+# Builds the text elements of the header and subheaders of one language, each laid out in its box (see layout_text).
+def build_text_elements(template_file, code, texts, direction):
+    elements = {}
+    header = texts.get("header", "")
+    if header:
+        lines, font_size = layout_text("header", code, header)
+        elements["text1"] = build_wrapped_text_element(
             "text1",
-            translated_header,
-            header_limit,
+            header,
+            None,
             "250.0",
             "100.0",
-            font_size="32px",
+            font_size=f"{font_size}px",
             font_weight="bold",
             text_anchor="middle",  # Header is always centered
             direction=direction,
-            fill="#E89024"
+            fill="#E89024",
+            lines=lines
         )
 
-        if "template2" in actual_template_file:
-            # The x position needs to be adjusted for RTL - try a smaller increment
-            subheader_x_pos = "450.0" if is_rtl else "50.0"  # Trying x_pos = 500.0 for RTL
-            # subheader_x_pos = "800.0" if is_rtl else "50.0" # OLD - too far right
-            # subheader_x_pos = "450.0" if is_rtl else "50.0" # OLD - original value
-
-            if translated_sub_header1:
-                svg_content = add_wrapped_text_to_svg(
-                    svg_content,
-                    "text2",
-                    translated_sub_header1,
-                    subheader_limit,
-                    subheader_x_pos,
-                    "250.0",
-                    font_size="20px",
-                    text_anchor="start", # keep hardcoded value from template2.svg
-                    direction=direction, # keep hardcoded value from template2.svg
-                    fill="#FFFFFF"
-                )
-
-            if translated_sub_header2:
-                svg_content = add_wrapped_text_to_svg(
-                    svg_content,
-                    "text3",
-                    translated_sub_header2,
-                    subheader_limit,
-                    subheader_x_pos,
-                    "300.0",
-                    font_size="20px",
-                    text_anchor="start", # keep hardcoded value from template2.svg
-                    direction=direction, # keep hardcoded value from template2.svg
-                    fill="#FFFFFF"
-                )
-
-        # Log the SVG content for debugging
-        logging.debug(f"SVG content for {code}: {svg_content[:500]}...")
-
-        result_file = f"{result_prefix}_{code}.svg"
-        with open(result_file, "w", encoding="utf-8") as file:
-            file.write(svg_content)
-            logging.info(f"Successfully wrote SVG to {result_file}")
+    if "template2" in template_file:
+        subheader_x_pos = "450.0" if direction == "rtl" else "50.0"
+        for element_id, field, y_pos in (("text2", "sub_header1", "250.0"), ("text3", "sub_header2", "300.0")):
+            text = texts.get(field, "")
+            if not text:
+                continue
+            lines, font_size = layout_text(field, code, text)
+            elements[element_id] = build_wrapped_text_element(
+                element_id,
+                text,
+                None,
+                subheader_x_pos,
+                y_pos,
+                font_size=f"{font_size}px",
+                text_anchor="start", # keep hardcoded value from template2.svg
+                direction=direction, # keep hardcoded value from template2.svg
+                fill="#FFFFFF",
+                lines=lines
+            )
+    return elements
+
+# Resizes the generated image to the image slot of the template and re-encodes it.
+# Returns the image bytes and their format extension.
+@timed("resize_image")
+def prepare_image(image_base64, template_file):
+    data = base64.b64decode(image_base64)
+    size = templates.get(template_file).image_size
+    if not IMAGE_RESIZE or size is None:
+        return data, "png"
+    return image_variant(data, round(size[0] * IMAGE_SCALE), round(size[1] * IMAGE_SCALE), IMAGE_FORMAT)
+
+# Returns the URI to put in the SVGs for a prepared image: a link to the stored image when image_base_url
+# is given, otherwise a data URI.
+def image_uri(data, extension, image_base_url=None):
+    if image_base_url:
+        return f"{image_base_url}image/{image_store.put(data, extension)}"
+    return f"data:{MIME_TYPES[extension]};base64,{base64.b64encode(data).decode('ascii')}"
+
+# Function to create infographics for all languages
+# texts can hold the already localized texts (see localize_texts), otherwise they are localized here.
+# image_href can link to the stored image instead of embedding image_base64 in every language.
+# The SVGs are also written to <result_prefix>_<code>.svg unless result_prefix is None.
+def create_infographics_for_all(template_file, image_base64, header, sub_header1=None, sub_header2=None, result_prefix="result", texts=None, image_href=None):
+    if texts is None:
+        texts = localize_texts({"header": header, "sub_header1": sub_header1, "sub_header2": sub_header2})
+
+    # The image is prepared once and shared by all languages
+    if image_href is None and image_base64:
+        image_href = image_uri(*prepare_image(image_base64, template_file))
+
+    results = {}
+    for code in LANGUAGES:
+        svg_content = render_infographic(template_file, code, texts[code], image_href)
+        if svg_content is None:
+            continue
+
+        if result_prefix is not None:
+            result_file = f"{result_prefix}_{code}.svg"
+            with span("write_file"), open(result_file, "w", encoding="utf-8") as file:
+                file.write(svg_content)
+                logging.info(f"Successfully wrote SVG to {result_file}")
 
         results[code] = svg_content
     return results
 
-# Chooses an infographic template based on user input using OpenAI's GPT-4.
-def choose_template(user_input_english: str) -> int:
+# Chooses an infographic template ('1' or '2') based on user input: in-process with the template classifier when
+# it is confident enough, otherwise using OpenAI's GPT-4. Every choice is recorded in the template history, which
+# the classifier is retrained from. Falls back to template '1' if GPT-4 fails.
+@timed("choose_template")
+def choose_template(user_input_english: str) -> str:
+    if template_classifier is not None:
+        template, confidence = template_classifier.predict(user_input_english)
+        if confidence > 0 and confidence >= template_classifier.threshold:
+            logging.info(f"Template {template} chosen by the classifier (confidence {confidence:.2f})")
+            pipeline_metrics.count("infographic_template_choices_total", {"source": "classifier"})
+            template_history.record(user_input_english, template, "classifier")
+            return template
+        logging.info(f"Classifier confidence {confidence:.2f} is too low, asking GPT-4")
+    template = choose_template_gpt(user_input_english)
+    if template is None:
+        pipeline_metrics.count("infographic_template_choices_total", {"source": "fallback"})
+        return '1'
+    pipeline_metrics.count("infographic_template_choices_total", {"source": "llm"})
+    template_history.record(user_input_english, template, "llm")
+    return template
+
+# Asks OpenAI's GPT-4 to choose the template. Returns '1' or '2', or None on an unexpected reply or an error.
+@timed("choose_template_gpt")
+def choose_template_gpt(user_input_english: str) -> str:
     try:
-        template_response = client.chat.completions.create(
+        template_response = chat_completion(
             model="gpt-4-1106-preview",
             messages=[
                 {
@@ -313,17 +747,23 @@ def choose_template(user_input_english: str) -> int:
                 },
                 {"role": "user", "content": user_input_english},
             ],
+            kind="choose_template",
         )
-        template = template_response.choices[0].message.content.strip()
-        return template
+        match = re.search(r"[12]", template_response)
+        if match is None:
+            logging.error(f"Unexpected template choice: {template_response!r}, using template 1")
+            return None
+        return match.group(0)
     except Exception as e:
         logging.error(f"Error choosing template: {e}")
-        return 1
+        return None
 
 # Generates a header for the infographic using OpenAI's GPT-4.
+@timed("generate_header")
 def generate_header(user_input_english: str) -> str:
     try:
-        header_response = client.chat.completions.create(
+        header_response = chat_completion(
+            on_lines=preview_lines("header"),
             model="gpt-4o-mini",
             messages=[
                 {
@@ -337,19 +777,45 @@ def generate_header(user_input_english: str) -> str:
                 },
                 {"role": "user", "content": user_input_english},
             ],
+            kind="generate_header",
         )
-        header = header_response.choices[0].message.content.strip()
+        header = header_response.strip()
         print(f"Header generated: {header}")
         return header
     except Exception as e:
         logging.error(f"Error generating header: {e}")
         return None
 
+# Returns a similar enough image from the library, base64 encoded, or None. Requests with no_cache always get a
+# new image. stage says which text matched: the user input (skipping the prompt and the image) or the prompt.
+def reuse_library_image(query, stage):
+    if image_library is None or cache_bypass.get():
+        return None
+    match = image_library.best_match(query, IMAGE_REUSE_THRESHOLD)
+    if match is None:
+        return None
+    score, entry = match
+    logging.info(f"Reusing library image {entry.name} ({score:.2f} similar to {entry.user_input!r}) for {query!r}")
+    pipeline_metrics.count("infographic_image_library_total", {"outcome": f"reused_{stage}"})
+    return base64.b64encode(image_library.image(entry.name)).decode("ascii")
+
+# Returns a library image picked by an editor, base64 encoded.
+def library_image(name):
+    data = image_library.image(name) if image_library is not None else None
+    if data is None:
+        raise ValueError(f"Unknown library image: {name}")
+    pipeline_metrics.count("infographic_image_library_total", {"outcome": "picked"})
+    return base64.b64encode(data).decode("ascii")
+
 # Generates image using OpenAI's DALL-E 3 model.
+@timed("generate_image")
 def generate_image(user_input_english: str) -> str:
-    """Generates an image prompt and base64 encoded image."""
+    """Generates an image prompt and base64 encoded image, or reuses a similar image from the library."""
     try:
-        image_response = client.chat.completions.create(
+        reused = reuse_library_image(user_input_english, "input")
+        if reused is not None:
+            return reused
+        image_response = chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -358,26 +824,25 @@ def generate_image(user_input_english: str) -> str:
                 },
                 {"role": "user", "content": user_input_english},
             ],
+            kind="generate_image",
         )
-        image_prompt = image_response.choices[0].message.content.strip()
+        image_prompt = image_response.strip()
         print(f"Image prompt generated: {image_prompt}")
-        nlp = get_nlp_model()
-        doc = nlp(image_prompt)
-        keywords = ", ".join([token.text for token in doc if not token.is_stop and token.is_alpha])
+        keyword_list = keyword_extractor.extract(image_prompt)
+        keywords = ", ".join(keyword_list)
         image_prompt_with_keywords = f"{image_prompt}, {keywords}"
         print(f"Image prompt with keywords: {image_prompt_with_keywords}")
         static_prompt = "Isometric vector illustration in a clean and minimalist, modern style with bright, flat, solid colors and minimal shading, simplified geometric shapes, no background, no arabian features, "
         image_prompt_with_keywords = static_prompt + image_prompt_with_keywords
 
-        dalle_response = client.images.generate(
-            model="dall-e-3",
-            prompt=image_prompt_with_keywords,
-            n=1,
-            size="1024x1024",
-            response_format="b64_json",
-        )
-        image_base64 = dalle_response.data[0].b64_json
+        reused = reuse_library_image(f"{image_prompt} {' '.join(keyword_list)}", "prompt")
+        if reused is not None:
+            return reused
+        image_base64 = generate_dalle_image(image_prompt_with_keywords)
         print(f"Image base64 generated: {image_base64[:100]}...")
+        if image_library is not None:
+            pipeline_metrics.count("infographic_image_library_total", {"outcome": "generated"})
+            image_library.add(base64.b64decode(image_base64), user_input_english, image_prompt, keyword_list)
         return image_base64
     except Exception as dalle_error:
         logging.error(f"DALL-E 3 error: {dalle_error}")
@@ -394,12 +859,12 @@ def generate_prompts1(user_input_english: str) -> tuple:
         logging.error(f"Error generating prompts for template 1: {e}")
         return None, None
 
-# Generates prompts for template 2 infographics using OpenAI's GPT-4.
-def generate_prompts2(user_input_english: str, subheader_max_chars: int = 40) -> tuple:
+# Generates two sub-headers for a template 2 infographic from its header using OpenAI's GPT-4o-mini.
+@timed("generate_subheaders")
+def generate_subheaders(header: str, subheader_max_chars: int = 40) -> tuple:
     try:
-        print(f"Generating image prompts for user input: {user_input_english}")
-        header = generate_header(user_input_english)
-        headers_response = client.chat.completions.create(
+        headers_response = chat_completion(
+            on_lines=preview_lines("sub_header1", "sub_header2"),
             model="gpt-4o-mini",
             messages=[
                 {
@@ -411,8 +876,9 @@ def generate_prompts2(user_input_english: str, subheader_max_chars: int = 40) ->
                 },
                 {"role": "user", "content": header},
             ],
+            kind="generate_subheaders",
         )
-        raw_subheaders_response = headers_response.choices[0].message.content.strip()
+        raw_subheaders_response = headers_response.strip()
         print(f"Raw sub-headers response from GPT-4o-mini: '{raw_subheaders_response}'") # Added logging
         headers = raw_subheaders_response.split('\n')
         print(f"Split sub-headers: {headers}") # Added logging
@@ -431,6 +897,17 @@ def generate_prompts2(user_input_english: str, subheader_max_chars: int = 40) ->
             sub_header2 = sub_header2[:subheader_max_chars].rsplit(' ', 1)[0]
             print(f"Sub-header 2 truncated to: {sub_header2}")
 
+        return sub_header1, sub_header2
+    except Exception as e:
+        logging.error(f"Error generating sub-headers: {e}")
+        return None, None
+
+# Generates prompts for template 2 infographics using OpenAI's GPT-4.
+def generate_prompts2(user_input_english: str, subheader_max_chars: int = 40) -> tuple:
+    try:
+        print(f"Generating image prompts for user input: {user_input_english}")
+        header = generate_header(user_input_english)
+        sub_header1, sub_header2 = generate_subheaders(header, subheader_max_chars)
         image_base64 = generate_image(user_input_english)
         return header, sub_header1, sub_header2, image_base64
     except Exception as e:
@@ -443,35 +920,34 @@ def create_infographic1(image_base64, header) -> str:
     try:
         print(f"Creating infographic with header: {header}, template: 1")
         print(f"Image base64: {image_base64[:100]}...")
-        template_file = f"template1.svg"
-        with open(template_file, "r", encoding="utf-8") as file:
-            svg_content = file.read()
-        print(f"SVG content read successfully.")
+        template = templates.get("template1.svg")
 
         # Apply wrapped text for header
-        svg_content = add_wrapped_text_to_svg(
-            svg_content,
-            "text1",
-            header,
-            25,  # Default character limit
-            "250.0",
-            "100.0",
-            font_size="32px",
-            font_weight="bold",
-            text_anchor="middle",
-            direction="rtl",  # Default to Hebrew
-            fill="#E89024"
-        )
+        elements = {}
+        if header:
+            elements["text1"] = build_wrapped_text_element(
+                "text1",
+                header,
+                25,  # Default character limit
+                "250.0",
+                "100.0",
+                font_size="32px",
+                font_weight="bold",
+                text_anchor="middle",
+                direction="rtl",  # Default to Hebrew
+                fill="#E89024"
+            )
 
+        values = {}
         if image_base64:
-            svg_content = svg_content.replace("{{image}}", f"data:image/png;base64,{image_base64}")
-            svg_content = svg_content.replace("BASE64", f"data:image/png;base64,{image_base64}")
-        print(f"Placeholders replaced successfully.")
+            values["image"] = f"data:image/png;base64,{image_base64}"
+        svg_content = template.render(values, elements)
+        print("Placeholders replaced successfully.")
 
-        result_file = f"result1.svg"
-        with open(result_file, "w", encoding="utf-8") as file:
+        result_file = "result1.svg"
+        with span("write_file"), open(result_file, "w", encoding="utf-8") as file:
             file.write(svg_content)
-        print(f"SVG written to file successfully.")
+        print("SVG written to file successfully.")
 
         return svg_content
 
@@ -491,28 +967,26 @@ def create_infographic2(image_base64, header, sub_header1, sub_header2) -> str:
         direction = "rtl"
         text_anchor = "start"
         
-        with open(template_file, "r", encoding="utf-8") as file:
-            svg_content = file.read()
-        print(f"SVG content read successfully.")
+        template = templates.get(template_file)
 
         # Apply wrapped text for headers
-        svg_content = add_wrapped_text_to_svg(
-            svg_content,
-            "text1",
-            header,
-            25,  # Default character limit
-            "250.0",
-            "100.0",
-            font_size="32px",
-            font_weight="bold",
-            text_anchor="middle",
-            direction=direction,
-            fill="#E89024"
-        )
+        elements = {}
+        if header:
+            elements["text1"] = build_wrapped_text_element(
+                "text1",
+                header,
+                25,  # Default character limit
+                "250.0",
+                "100.0",
+                font_size="32px",
+                font_weight="bold",
+                text_anchor="middle",
+                direction=direction,
+                fill="#E89024"
+            )
 
         if sub_header1:
-            svg_content = add_wrapped_text_to_svg(
-                svg_content,
+            elements["text2"] = build_wrapped_text_element(
                 "text2",
                 sub_header1,
                 25,  # Shorter character limit for subheaders
@@ -525,8 +999,7 @@ def create_infographic2(image_base64, header, sub_header1, sub_header2) -> str:
             )
 
         if sub_header2:
-            svg_content = add_wrapped_text_to_svg(
-                svg_content,
+            elements["text3"] = build_wrapped_text_element(
                 "text3",
                 sub_header2,
                 25,  # Shorter character limit for subheaders
@@ -538,14 +1011,16 @@ def create_infographic2(image_base64, header, sub_header1, sub_header2) -> str:
                 fill="#FFFFFF"
             )
 
+        values = {}
         if image_base64:
-            svg_content = svg_content.replace("{{image}}", f"data:image/png;base64,{image_base64}")
-        print(f"Placeholders replaced successfully.")
+            values["image"] = f"data:image/png;base64,{image_base64}"
+        svg_content = template.render(values, elements)
+        print("Placeholders replaced successfully.")
 
-        result_file = f"result2.svg"
-        with open(result_file, "w", encoding="utf-8") as file:
+        result_file = "result2.svg"
+        with span("write_file"), open(result_file, "w", encoding="utf-8") as file:
             file.write(svg_content)
-        print(f"SVG written to file successfully.")
+        print("SVG written to file successfully.")
 
         return svg_content
 
@@ -553,82 +1028,654 @@ def create_infographic2(image_base64, header, sub_header1, sub_header2) -> str:
         logging.error(f"שגיאה ביצירת אינפוגרפיקה: {e}")
         return None
 
-# Deletes created SVG files after generating a new one.
-def delete_previous_svgs():
-    """Deletes all SVG files with result1_ and result2_ prefixes."""
-    for filename in glob.glob("result1_*.svg"):
+TEMPLATE_FILES = {'1': "template1.svg", '2': "template2.svg"}
+
+# Runs the whole generation pipeline for a Hebrew user input as a dependency graph.
+# The image is generated right after the input is translated, in parallel with choosing the template and
+# generating the texts, and resized to the chosen template's image slot. The translations to other languages
+# start as soon as the header exists, and each language is rendered as soon as its own texts are ready, so the
+# Hebrew infographic doesn't wait for the translations.
+# With image_base_url the image is stored once and linked from the SVGs as <image_base_url>image/<hash>.png.
+# With job, the progress of each stage and each rendered SVG are recorded in the job as they happen.
+# languages are the languages rendered now (default: all of them, or only Hebrew in the lazy LANGUAGE_MODEs).
+# image_name is a library image picked by an editor, used instead of generating one, and template forces a template.
+# A fresh warm pool entry for the input is returned without running the pipeline, unless use_warm_pool is False.
+# Returns the chosen template, the SVGs by language code (None for an invalid template) and the sources the other
+# languages can be rendered from later (see render_job_language).
+def run_infographic_pipeline(user_input, image_base_url=None, job=None, languages=None, image_name=None, template=None, use_warm_pool=True):
+    if use_warm_pool and image_name is None:
+        started = time.perf_counter()
+        warm = warm_pool_result(user_input, template)
+        if warm is not None:
+            if job is not None:
+                job.finish_stage("warm_pool", time.perf_counter() - started, 1, 1)
+                for code in sorted(warm[1], key=lambda code: code != "he"):
+                    job.set_svg(code, warm[1][code])
+            return warm
+    if languages is None:
+        languages = list(LANGUAGES) if LANGUAGE_MODE == 'eager' else ["he"]
+    other_languages = [code for code in languages if code != "he"]
+    language_groups = {group: codes for group, codes in (("he", ["he"] if "he" in languages else []), ("others", other_languages)) if codes}
+
+    def template_task(english):
+        chosen = template or choose_template(english)
+        update_preview(template=chosen)
+        return chosen
+
+    def sub_headers_task(template, header):
+        if template == '2':
+            return generate_subheaders(header)
+        return None, None
+
+    def image_href_task(template, image_base64):
+        if template not in TEMPLATE_FILES or not image_base64:
+            return None
+        return image_uri(*prepare_image(image_base64, TEMPLATE_FILES[template]), image_base_url)
+
+    def header_texts_task(languages, header):
+        return localize_texts({"header": header}, languages)
+
+    def sub_header_texts_task(languages, sub_headers):
+        sub_header1, sub_header2 = sub_headers
+        return localize_texts({"sub_header1": sub_header1, "sub_header2": sub_header2}, languages)
+
+    def render_task(code, template, image_href, header_texts, sub_header_texts):
+        if template not in TEMPLATE_FILES:
+            return None
+        svg_content = render_infographic(TEMPLATE_FILES[template], code, {**header_texts[code], **sub_header_texts[code]}, image_href)
+        if job is not None and svg_content is not None:
+            job.set_svg(code, svg_content)
+        return svg_content
+
+    tasks = {
+        "english": (lambda: translate_text(user_input, "English"), []),
+        "template": (template_task, ["english"]),
+        "header": (generate_header, ["english"]),
+        "image": ((lambda english: library_image(image_name)) if image_name else generate_image, ["english"]),
+        "image_href": (image_href_task, ["template", "image"]),
+        "sub_headers": (sub_headers_task, ["template", "header"]),
+    }
+    for group, codes in language_groups.items():
+        tasks[f"header_texts_{group}"] = (partial(header_texts_task, codes), ["header"])
+        tasks[f"sub_header_texts_{group}"] = (partial(sub_header_texts_task, codes), ["sub_headers"])
+    for code in languages:
+        group = "he" if code == "he" else "others"
+        tasks[f"render_{code}"] = (partial(render_task, code), ["template", "image_href", f"header_texts_{group}", f"sub_header_texts_{group}"])
+
+    token = current_preview.set({"job": job, "values": {}, "lock": threading.Lock()} if job is not None and LLM_STREAMING else None)
+    try:
+        results = run_dag(tasks, job.finish_stage if job is not None else None)
+    finally:
+        current_preview.reset(token)
+    logging.info(f"User input (English): {results['english']}")
+    logging.info(f"Template chosen: {results['template']}, Type: {type(results['template'])}")
+    if results["template"] not in TEMPLATE_FILES:
+        return results["template"], None, None
+    svgs = {code: results[f"render_{code}"] for code in languages if results[f"render_{code}"] is not None}
+    sub_header1, sub_header2 = results["sub_headers"]
+    sources = {
+        "template": results["template"],
+        "header": results["header"],
+        "sub_header1": sub_header1,
+        "sub_header2": sub_header2,
+        "image_href": results["image_href"],
+    }
+    return results["template"], svgs, sources
+
+# Returns the on_lines callback (see chat_completion) streaming the lines of a reply into the given fields of the
+# current preview, or None when there is no preview (the reply then isn't streamed).
+def preview_lines(*fields):
+    if current_preview.get() is None:
+        return None
+
+    def on_lines(lines):
+        update_preview(**dict(zip(fields, [line.strip() for line in lines if line.strip()])))
+    return on_lines
+
+# Updates the current preview with values (texts by field, or the template) and sends the Hebrew infographic
+# rendered with the texts known so far, until the real one is ready. Without a chosen template yet, the texts are
+# previewed in the template they fit.
+def update_preview(**values):
+    preview = current_preview.get()
+    if preview is None:
+        return
+    job = preview["job"]
+    with preview["lock"]:
+        changed = {key: value for key, value in values.items() if value and preview["values"].get(key) != value}
+        if not changed or "he" in job.svgs:
+            return
+        preview["values"].update(changed)
+        texts = {key: value for key, value in preview["values"].items() if key != "template"}
+        if not texts.get("header"):
+            return
+        template = preview["values"].get("template") or ('2' if texts.get("sub_header1") else '1')
+        if template not in TEMPLATE_FILES:
+            return
         try:
-            os.remove(filename)
-            logging.info(f"Deleted previous SVG: {filename}")
-        except OSError as e:
-            logging.error(f"Error deleting {filename}: {e}")
-    for filename in glob.glob("result2_*.svg"):
+            with span("preview"):
+                svg_content = build_infographic(TEMPLATE_FILES[template], "he", texts, PREVIEW_IMAGE)
+        except Exception as e:
+            logging.error(f"Error rendering the preview of job {job.id}: {e}")
+            return
+        if svg_content is not None:
+            job.add_event("preview", {"language": "he", "template": template, "texts": texts, "svg": svg_content})
+
+# Translates, fits and renders one language of a job from its sources. Returns None if the job has none.
+@timed("render_language")
+def render_job_language(job, code):
+    sources = job.sources
+    if not sources or code not in LANGUAGES or sources["template"] not in TEMPLATE_FILES:
+        return None
+    fields = {field: sources[field] for field in ("header", "sub_header1", "sub_header2")}
+    texts = localize_texts(fields, [code])[code]
+    return render_infographic(TEMPLATE_FILES[sources["template"]], code, texts, sources["image_href"])
+
+# Returns the SVG of a job in a language, rendering and memoizing it on the first request in the lazy LANGUAGE_MODEs.
+# Returns None for a language the job doesn't have and can't render.
+def job_language_svg(job, code):
+    if code in job.svgs or not job.sources or code not in LANGUAGES:
+        return job.svgs.get(code)
+    svg_content = job.language_svg(code, partial(render_job_language, job))
+    if svg_content is not None:
+        job_store.save(job)
+    return svg_content
+
+# Fingerprint of everything the warm pool entries depend on: the template files, the prompts and models (the source
+# of the functions making the model calls), the texts' layout, the image settings and the provider. Entries
+# generated with another fingerprint aren't served. Recomputed when a template file changes.
+def pipeline_fingerprint():
+    paths = [os.path.join(templates.directory, name) for name in sorted(set(TEMPLATE_FILES.values()) | {"template2_ltr.svg"})]
+    return _pipeline_fingerprint(tuple((path, os.path.getmtime(path)) for path in paths if os.path.exists(path)))
+
+@lru_cache(maxsize=8)
+def _pipeline_fingerprint(template_files):
+    parts = [provider.name, FOOTER_TEXTS, {field: vars(box) for field, box in TEXT_BOXES.items()}, text_layout and text_layout.widths, IMAGE_RESIZE, IMAGE_SCALE, IMAGE_FORMAT,
+             SVG_OPTIMIZE and inspect.getsource(inspect.getmodule(optimize_svg))]
+    for path, _ in template_files:
+        with open(path, "rb") as file:
+            parts.append(hashlib.sha256(file.read()).hexdigest())
+    for function in (translate_text, translate_batch, shorten_text_gpt, choose_template_gpt, generate_header,
+                     generate_image, generate_subheaders, build_infographic, build_text_elements, layout_text):
+        parts.append(inspect.getsource(function))
+    return make_key(*parts)
+
+# Returns (template, SVGs of all languages, sources) from a fresh warm pool entry of the input, or None.
+# Requests with no_cache skip the warm pool.
+def warm_pool_result(user_input, template=None):
+    if warm_pool is None or cache_bypass.get():
+        return None
+    entry = warm_pool.get(user_input)
+    if not warm_pool.is_fresh(entry, pipeline_fingerprint()):
+        pipeline_metrics.count("infographic_warm_pool_total", {"outcome": "miss" if entry is None else "stale"})
+        return None
+    template = template or entry["template"]
+    result = entry["results"].get(template)
+    if result is None:
+        pipeline_metrics.count("infographic_warm_pool_total", {"outcome": "miss"})
+        return None
+    pipeline_metrics.count("infographic_warm_pool_total", {"outcome": "hit"})
+    logging.info(f"Serving {user_input!r} from the warm pool")
+    return template, dict(result["svgs"]), None
+
+# Generates the warm pool entries of the topics that are missing or stale (all of them with force) on the warm pool
+# executor (WARM_POOL_WORKERS at a time): every language, with the template the pipeline chooses and with the other one. Returns the outcome of each
+# topic: "fresh" (kept), "generated" or "failed".
+def refresh_warm_pool(topics, force=False):
+    fingerprint = pipeline_fingerprint()
+
+    def refresh(topic):
+        if not force and warm_pool.is_fresh(warm_pool.get(topic), fingerprint):
+            return "fresh"
+        try:
+            with trace():
+                chosen, svgs, _ = run_infographic_pipeline(topic, languages=list(LANGUAGES), use_warm_pool=False)
+                if svgs is None:
+                    return "failed"
+                results = {chosen: {"svgs": svgs}}
+                for other in TEMPLATE_FILES:
+                    if other != chosen:
+                        _, other_svgs, _ = run_infographic_pipeline(topic, languages=list(LANGUAGES), template=other, use_warm_pool=False)
+                        if other_svgs is not None:
+                            results[other] = {"svgs": other_svgs}
+            warm_pool.put(topic, {"template": chosen, "results": results, "fingerprint": fingerprint})
+            return "generated"
+        except Exception as e:
+            logging.error(f"Error warming {topic!r}: {e}")
+            return "failed"
+
+    futures = {topic: warm_pool_executor.submit(refresh, topic) for topic in topics}
+    return {topic: future.result() for topic, future in futures.items()}
+
+# Refreshes the warm pool from WARM_POOL_TOPICS every WARM_POOL_INTERVAL seconds (a daemon thread).
+def warm_pool_refresher():
+    while True:
+        try:
+            outcomes = list(refresh_warm_pool(read_topics(WARM_POOL_TOPICS)).values())
+            logging.info(f"Warm pool refreshed: {outcomes.count('generated')} generated, {outcomes.count('failed')} failed")
+        except Exception as e:
+            logging.error(f"Error refreshing the warm pool: {e}")
+        time.sleep(WARM_POOL_INTERVAL)
+
+# Returns the sources to keep in a job for rendering its other languages later: only in the lazy LANGUAGE_MODEs.
+def lazy_sources(sources):
+    return sources if LANGUAGE_MODE != 'eager' else None
+
+# The languages a job can be asked for: all of them when it can render the missing ones.
+def available_languages(job):
+    return sorted(LANGUAGES) if job.sources else sorted(job.svgs)
+
+# Renders the other languages of a job in the background (LANGUAGE_MODE=speculative), one job at a time on the
+# low-priority language pool, so that a language switch finds them ready.
+def speculate_languages(job):
+    for code in LANGUAGES:
         try:
-            os.remove(filename)
-            logging.info(f"Deleted previous SVG: {filename}")
-        except OSError as e:
-            logging.error(f"Error deleting {filename}: {e}")
+            job_language_svg(job, code)
+        except Exception as e:
+            logging.error(f"Error rendering {code} of job {job.id} in the background: {e}")
+
+def schedule_languages(job):
+    if LANGUAGE_MODE == 'speculative' and job.sources:
+        language_executor.submit(speculate_languages, job)
+
+# Returns whether the current request gets the legacy JSON responses with the SVG inside.
+def wants_json_svg(data=None):
+    requested = request.args.get('format') or (data or {}).get('format')
+    return (requested or SVG_RESPONSE_MODE) == 'json'
+
+# Returns a compressed image/svg+xml response for a job's SVG. A job's SVGs don't change, so browsers may reuse them
+# for SVG_MAX_AGE seconds and then revalidate them with their ETag.
+def svg_response(svg_content, headers=None):
+    return compressed_responses.respond(request, svg_content, 'image/svg+xml', f'private, max-age={SVG_MAX_AGE}', headers)
+
+# Returns the URL of a job's SVG in a language on the server at base_url.
+def svg_url(base_url, job_id, language):
+    return f"{base_url}jobs/{job_id}/svg/{language}"
 
 # Endpoint to generate an infographic based on user input.
+# Returns the job id and the URL of the Hebrew SVG, or the Hebrew SVG itself in the legacy JSON mode.
 @app.route('/infographic', methods=['POST'])
 def infographic():
     try:
-        delete_previous_svgs()  # Delete previous SVGs before generating new ones.
-        user_input = request.get_json()['header']
+        data = request.get_json()
+        user_input = data['header']
         logging.info(f"User input (Hebrew): {user_input}")
-
-        # Translate user input to English
-        user_input_english = translate_text(user_input, "English")
-        logging.info(f"User input (English): {user_input_english}")
-
-        template = choose_template(user_input_english)
-        logging.info(f"Raw template response: '{template}'") # ADD THIS LINE
-        logging.info(f"Template chosen: {template}, Type: {type(template)}")
-        if template == '1':
-            header, image_base64 = generate_prompts1(user_input_english)
-            svg_results = create_infographics_for_all("template1.svg", image_base64, header, result_prefix="result1")
-        elif template == '2':
-            header, sub_header1, sub_header2, image_base64 = generate_prompts2(user_input_english)
-            svg_results = create_infographics_for_all("template2.svg", image_base64, header, sub_header1, sub_header2, result_prefix="result2")
-        else:
+        image_name = data.get('image')
+        if image_name and (image_library is None or image_library.get(image_name) is None):
+            return jsonify({'error': f'Unknown library image: {image_name}'}), 400
+        template = data.get('template')
+        if template is not None and str(template) not in TEMPLATE_FILES:
+            return jsonify({'error': f'Unknown template: {template}'}), 400
+
+        # 'no_cache' skips cached responses for this request (fresh ones are still stored).
+        token = cache_bypass.set(bool(data.get('no_cache')))
+        try:
+            image_base_url = request.host_url if IMAGE_OUTPUT_MODE == 'link' else None
+            with trace() as pipeline_trace:
+                template, svg_results, sources = run_infographic_pipeline(user_input, image_base_url, image_name=image_name, template=template and str(template))
+        finally:
+            cache_bypass.reset(token)
+        timings = pipeline_trace.summary()
+        logging.info(f"Infographic generated in {timings['total_seconds']}s, estimated cost ${timings['cost_dollars']}")
+        if svg_results is None:
             logging.error("Invalid template number")
-            return jsonify({'error': 'Invalid template number'}), 400
-        # Always pass the Hebrew version to the frontend
-        return jsonify({'updated_svg': svg_results.get("he")})
+            return jsonify({'error': 'Invalid template number', 'timings': timings}), 400
+        job = job_store.save(Job(template=template, svgs=svg_results, timings=timings, sources=lazy_sources(sources)))
+        schedule_languages(job)
+        if wants_json_svg(data):
+            # Always pass the Hebrew version to the frontend, with the job id for changing the language
+            body = json.dumps({'updated_svg': svg_results.get("he"), 'job_id': job.id, 'degraded': timings['degraded'], 'timings': timings}, ensure_ascii=False)
+            return compressed_responses.respond(request, body, 'application/json')
+        return jsonify({
+            'job_id': job.id,
+            'template': template,
+            'languages': available_languages(job),
+            'svg_url': svg_url(request.host_url, job.id, 'he'),
+            'degraded': timings['degraded'],
+            'timings': timings,
+        })
     except Exception as e:
         logging.error(f"Error in /infographic endpoint: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Runs the pipeline of an asynchronous job, recording its progress and results in the job.
+def run_job(job, user_input, image_base_url, no_cache, image_name=None, template=None):
+    token = cache_bypass.set(no_cache)
+    try:
+        job.set_status("running")
+        with trace() as pipeline_trace:
+            template, svg_results, sources = run_infographic_pipeline(user_input, image_base_url, job, image_name=image_name, template=template)
+        job.timings = pipeline_trace.summary()
+        if svg_results is None:
+            logging.error("Invalid template number")
+            job.fail('Invalid template number')
+        else:
+            job.sources = lazy_sources(sources)
+            job.finish(template, available_languages(job))
+    except Exception as e:
+        logging.error(f"Error in job {job.id}: {e}")
+        job.fail(str(e))
+    finally:
+        cache_bypass.reset(token)
+        job_store.save(job)
+    schedule_languages(job)
+
+# Endpoint to start generating an infographic in the background. Returns the job id right away;
+# the progress and results are available from /jobs/<job_id> and /jobs/<job_id>/events.
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        data = request.get_json()
+        user_input = data['header']
+        logging.info(f"User input (Hebrew): {user_input}")
+        image_name = data.get('image')
+        if image_name and (image_library is None or image_library.get(image_name) is None):
+            return jsonify({'error': f'Unknown library image: {image_name}'}), 400
+        template = data.get('template')
+        if template is not None and str(template) not in TEMPLATE_FILES:
+            return jsonify({'error': f'Unknown template: {template}'}), 400
+        job = job_store.save(Job(status="pending"))
+        image_base_url = request.host_url if IMAGE_OUTPUT_MODE == 'link' else None
+        job_executor.submit(run_job, job, user_input, image_base_url, bool(data.get('no_cache')), image_name, template and str(template))
+        return jsonify({'job_id': job.id, 'status': job.status}), 202
+    except Exception as e:
+        logging.error(f"Error in /jobs endpoint: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Endpoint to poll a job: its status, stage timings and ready languages, and the SVG of ?language= if given.
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    response = {
+        'job_id': job.id,
+        'status': job.status,
+        'template': job.template,
+        'error': job.error,
+        'stages': job.stages,
+        'degraded': bool(job.timings and job.timings.get('degraded')),
+        'timings': job.timings,
+        'languages': sorted(job.svgs),
+        'available_languages': available_languages(job),
+    }
+    language = request.args.get('language')
+    if language:
+        response['updated_svg'] = job_language_svg(job, language)
+    return jsonify(response)
+
+# Endpoint to stream the progress of a job as Server-Sent Events: "status", "stage" (a finished pipeline stage),
+# "svg" (a rendered language, Hebrew usually first), and finally "done" or "error".
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+
+    # Outside the legacy JSON mode the "svg" events carry the URL of the SVG instead of the SVG
+    legacy = wants_json_svg()
+    base_url = request.host_url
+
+    def event_data(event, data):
+        if event == 'svg' and not legacy:
+            data = {'language': data['language'], 'url': svg_url(base_url, job.id, data['language'])}
+        return json.dumps(data, ensure_ascii=False)
+
+    def stream():
+        if job.loaded and not job.finished:
+            yield from remote_stream()
+            return
+        position = 0
+        while True:
+            events = job.wait_events(position, timeout=15)
+            if not events:
+                if job.finished:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event, data in events:
+                yield f"event: {event}\ndata: {event_data(event, data)}\n\n"
+            position += len(events)
+
+    # The job runs in another worker process: follow its event log, from where the copy read from the spill
+    # directory left off, until its end.
+    def remote_stream():
+        for event, data in job.events:
+            yield f"event: {event}\ndata: {event_data(event, data)}\n\n"
+        offset = job.log_offset
+        waited = 0
+        while True:
+            time.sleep(1)
+            events, offset = job_store.read_events(job.id, offset)
+            if not events:
+                waited += 1
+                if waited >= 15:
+                    waited = 0
+                    yield ": keep-alive\n\n"
+                continue
+            waited = 0
+            for event, data in events:
+                yield f"event: {event}\ndata: {event_data(event, data)}\n\n"
+                if event in ("done", "error"):
+                    return
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Generates one batch item and returns its result: the job id, template, SVGs by language and timings, or the error.
+def run_batch_item(user_input, image_base_url, no_cache):
+    token = cache_bypass.set(no_cache)
+    try:
+        with trace() as pipeline_trace:
+            # A batch writes out every language, so they are all rendered right away
+            template, svg_results, _ = run_infographic_pipeline(user_input, image_base_url, languages=list(LANGUAGES))
+        timings = pipeline_trace.summary()
+        if svg_results is None:
+            return {'error': 'Invalid template number', 'timings': timings}
+        job = job_store.save(Job(template=template, svgs=svg_results, timings=timings))
+        return {'job_id': job.id, 'template': template, 'svgs': svg_results, 'timings': timings}
+    except Exception as e:
+        logging.error(f"Error in batch item {user_input!r}: {e}")
+        return {'error': str(e)}
+    finally:
+        cache_bypass.reset(token)
+
+# Generates the infographics of a list of Hebrew inputs on the batch pool. Identical inputs (up to whitespace) are
+# generated once. Yields the result of each distinct input as soon as it is done, with the positions of the input in
+# the list as "indices", and finally a summary of the batch.
+def run_batch(user_inputs, image_base_url=None, no_cache=False):
+    started = time.perf_counter()
+    positions = {}
+    for index, user_input in enumerate(user_inputs):
+        positions.setdefault(batch_key(user_input), []).append(index)
+    pipeline_metrics.count("infographic_batch_items_total", {"outcome": "duplicate"}, len(user_inputs) - len(positions))
+    futures = {batch_executor.submit(run_batch_item, key, image_base_url, no_cache): key for key in positions}
+    failed = 0
+    try:
+        for future in as_completed(futures):
+            key = futures[future]
+            result = future.result()
+            outcome = "failed" if 'error' in result else "done"
+            failed += outcome == "failed"
+            pipeline_metrics.count("infographic_batch_items_total", {"outcome": outcome})
+            yield {'input': key, 'indices': positions[key], **result}
+    finally:
+        # The client went away: don't start the items that haven't started yet
+        for future in futures:
+            future.cancel()
+    elapsed = time.perf_counter() - started
+    logging.info(f"Batch of {len(user_inputs)} inputs ({len(positions)} distinct) generated in {elapsed:.1f}s")
+    yield {'summary': {
+        'inputs': len(user_inputs),
+        'distinct': len(positions),
+        'failed': failed,
+        'seconds': round(elapsed, 3),
+        'inputs_per_second': round(len(user_inputs) / elapsed, 3) if elapsed else None,
+    }}
+
+# Endpoint to generate a set of infographics, from {"headers": [...]} or a JSON Lines body (one input per line).
+# Streams the results as JSON Lines in the order the items finish, then a summary line (see run_batch).
+# With "svgs": false (or ?svgs=false) the results only carry the job ids, for fetching the SVGs from /export.
+@app.route('/batch', methods=['POST'])
+def batch():
+    try:
+        if request.is_json:
+            data = request.get_json()
+            if not isinstance(data.get('headers'), list):
+                return jsonify({'error': '"headers" must be a list of inputs'}), 400
+            user_inputs = parse_inputs(json.dumps(header, ensure_ascii=False) for header in data['headers'])
+        else:
+            data = {}
+            user_inputs = parse_inputs(request.get_data(as_text=True).splitlines())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not user_inputs:
+        return jsonify({'error': 'No inputs'}), 400
+    if len(user_inputs) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} inputs per batch'}), 400
+    logging.info(f"Batch of {len(user_inputs)} inputs")
+    no_cache = bool(data.get('no_cache')) or request.args.get('no_cache', '').lower() in ['true', '1', 't']
+    include_svgs = str(data.get('svgs', request.args.get('svgs', 'true'))).lower() in ['true', '1', 't']
+    image_base_url = request.host_url if IMAGE_OUTPUT_MODE == 'link' else None
+
+    def stream():
+        for result in run_batch(user_inputs, image_base_url, no_cache):
+            if not include_svgs:
+                result.pop('svgs', None)
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(stream(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Endpoint to change the language of the displayed infographic.
 @app.route('/change_language', methods=['POST'])
 def change_language():
     try:
-        language = request.get_json()['language']
-        # Determine which template was last used by checking for the files.
-        template = None
-        if os.path.exists("result1_he.svg"):
-            template = '1'
-            prefix = "result1"
-        elif os.path.exists("result2_he.svg"):
-            template = '2'
-            prefix = "result2"
-        else:
-            logging.error("No result svg files found")
-            return jsonify({'error': 'No result svg files found'}), 500
-        # Load the correct svg based on the language.
-        file_name = f"{prefix}_{language}.svg"
-        with open(file_name, 'r', encoding="utf-8") as f:
-            svg_content = f.read()
-        return jsonify({'updated_svg': svg_content})
+        data = request.get_json()
+        language = data['language']
+        job = job_store.get(data.get('job_id'))
+        if job is None:
+            return jsonify({'error': 'Unknown job id'}), 404
+        svg_content = job_language_svg(job, language)
+        if svg_content is None:
+            return jsonify({'error': f'No infographic for language: {language}'}), 404
+        if wants_json_svg(data):
+            return compressed_responses.respond(request, json.dumps({'updated_svg': svg_content}, ensure_ascii=False), 'application/json')
+        return svg_response(svg_content)
     except Exception as e:
         logging.error(f"Error in /change_language endpoint: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Endpoint to get the SVG of a job in a language, cacheable by the browser (see svg_response).
+@app.route('/jobs/<job_id>/svg/<language>')
+def job_svg(job_id, language):
+    try:
+        job = job_store.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown job id'}), 404
+        svg_content = job_language_svg(job, language)
+        if svg_content is None:
+            return jsonify({'error': f'No infographic for language: {language}'}), 404
+        return svg_response(svg_content)
+    except Exception as e:
+        logging.error(f"Error in /jobs/{job_id}/svg endpoint: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Endpoint to download a self-contained infographic, with any linked image embedded in the SVG.
+# With ?format=png, jpeg or webp the infographic is rasterized at ?size= (square, story, banner or <width>x<height>).
+@app.route('/export')
+def export():
+    try:
+        language = request.args.get('language', 'he')
+        image_format = request.args.get('format', 'svg').lower()
+        job = job_store.get(request.args.get('job_id'))
+        if job is None:
+            return jsonify({'error': 'Unknown job id'}), 404
+        svg_content = job_language_svg(job, language)
+        if svg_content is None:
+            return jsonify({'error': f'No infographic for language: {language}'}), 404
+        if image_format == 'svg':
+            return svg_response(
+                image_store.inline_images(svg_content),
+                headers={'Content-Disposition': f'attachment; filename="infographic_{language}.svg"'},
+            )
+
+        if image_format not in RASTER_FORMATS:
+            return jsonify({'error': f'Unknown format: {image_format}'}), 400
+        size_name = request.args.get('size', 'square')
+        size = parse_size(size_name)
+        if size is None:
+            return jsonify({'error': f'Unknown size: {size_name}'}), 400
+        if not rasterization_available():
+            return jsonify({'error': 'Raster export needs cairosvg and the cairo library'}), 501
+        data = rasterizer.render(
+            (job.id, language, size, image_format),
+            lambda: image_store.inline_images(svg_content),
+            size[0],
+            size[1],
+            image_format,
+            timeout=RASTER_TIMEOUT,
+        )
+        return Response(
+            data,
+            mimetype=RASTER_FORMATS[image_format][0],
+            headers={
+                'Content-Disposition': f'attachment; filename="infographic_{language}_{size_name}.{image_format}"',
+                'Cache-Control': 'private, max-age=3600',
+            },
+        )
+    except FutureTimeoutError:
+        logging.error("Rasterizing the infographic timed out")
+        return jsonify({'error': 'Rasterizing the infographic timed out'}), 504
+    except Exception as e:
+        logging.error(f"Error in /export endpoint: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Endpoint to browse and search the image library: ?q= ranks the images by similarity to an English text (the latest
+# images without it), ?limit= caps the results. Each result has the name to send as "image" to /infographic or /jobs.
+@app.route('/images')
+def library_images():
+    if image_library is None:
+        return jsonify({'error': 'The image library is disabled'}), 404
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    return jsonify({'images': [
+        {**entry.to_dict(), 'score': round(score, 3), 'url': f"{request.host_url}image/{entry.name}"}
+        for score, entry in image_library.search(query, limit)
+    ]})
+
+# Endpoint to serve a stored image. Images are content-addressed, so they can be cached forever.
+@app.route('/image/<name>')
+def image(name):
+    data = image_store.get(name)
+    if data is None:
+        return jsonify({'error': 'Image not found'}), 404
+    return Response(
+        data,
+        mimetype=MIME_TYPES[name.rsplit('.', 1)[1]],
+        headers={'Cache-Control': 'public, max-age=31536000, immutable'},
+    )
+
+# Endpoint to view the response cache hit/miss counters and size.
+@app.route('/cache_stats')
+def cache_stats():
+    if response_cache is None:
+        return jsonify({'enabled': False, 'compressed_responses': compressed_responses.stats()})
+    return jsonify({'enabled': True, **response_cache.stats(), 'compressed_responses': compressed_responses.stats()})
+
+# Endpoint for Prometheus to scrape the stage timings and the model call, token and cost counters of this process.
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(pipeline_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Basic route to check if the Flask server is running.
 @app.route('/')
 def test_route():
     return 'Flask server is running!'
 
+if warm_pool is not None and WARM_POOL_INTERVAL > 0:
+    threading.Thread(target=warm_pool_refresher, name="warm-pool", daemon=True).start()
+
 if __name__ == '__main__':
     debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() in ['true', '1', 't']
     port = int(os.getenv('SERVER_PORT', 5000))
@@ -0,0 +1,110 @@
+# Generates a campaign set of infographics, one per Hebrew input, through POST /batch or in-process.
+# Identical inputs are generated once, the items run BATCH_CONCURRENCY at a time with all of their model calls
+# sharing the LLM_MAX_CONCURRENCY limit, and every language of each item is written out as soon as it is done.
+#
+# Usage (from the backend folder):
+#   python batch.py inputs.jsonl [--output batch_output] [--url http://localhost:5000/] [--no-cache]
+# The inputs file has one input per line: a plain line of text, a JSON string or a JSON object with a "header".
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# Parses the inputs of a batch from lines of text, JSON strings or JSON objects with a "header".
+# Raises ValueError for a JSON line without a header; blank lines are skipped.
+def parse_inputs(lines):
+    inputs = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            value = line
+        if isinstance(value, dict):
+            value = value.get("header")
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"Line {number} has no header")
+        inputs.append(value)
+    return inputs
+
+# Returns the key identical inputs share: the input with its whitespace collapsed.
+def batch_key(user_input):
+    return " ".join(user_input.split())
+
+# Yields the result lines of a batch from the server at base_url, as the server streams them.
+def stream_from_server(base_url, inputs, no_cache):
+    http_request = urllib.request.Request(
+        base_url.rstrip("/") + "/batch",
+        data=json.dumps({"headers": inputs, "no_cache": no_cache}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(http_request, timeout=3600) as response:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+
+# Yields the result lines of a batch generated in this process.
+def stream_in_process(inputs, no_cache):
+    import app
+    yield from app.run_batch(inputs, no_cache=no_cache)
+
+# Writes the SVG of each language of a result, once for every position the input had in the batch.
+def write_result(output_dir, result):
+    paths = []
+    for index in result["indices"]:
+        for code, svg_content in result.get("svgs", {}).items():
+            path = os.path.join(output_dir, f"{index + 1:03d}_{code}.svg")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(svg_content)
+            paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the infographics of a list of Hebrew inputs.")
+    parser.add_argument("inputs", help="file with one input per line (text, JSON string or {\"header\": ...})")
+    parser.add_argument("--output", default="batch_output", help="folder the SVGs and results.jsonl are written to")
+    parser.add_argument("--url", help="base URL of a running backend (default: in-process)")
+    parser.add_argument("--no-cache", action="store_true", help="skip the cached model responses")
+    args = parser.parse_args()
+
+    with open(args.inputs, "r", encoding="utf-8") as file:
+        try:
+            inputs = parse_inputs(file)
+        except ValueError as e:
+            sys.exit(f"{args.inputs}: {e}")
+    os.makedirs(args.output, exist_ok=True)
+    print(f"Generating {len(inputs)} inputs ({len({batch_key(user_input) for user_input in inputs})} distinct)")
+
+    started = time.perf_counter()
+    done = failed = 0
+    stream = stream_from_server(args.url, inputs, args.no_cache) if args.url else stream_in_process(inputs, args.no_cache)
+    try:
+        with open(os.path.join(args.output, "results.jsonl"), "w", encoding="utf-8") as results:
+            for result in stream:
+                if "summary" in result:
+                    continue
+                paths = write_result(args.output, result)
+                results.write(json.dumps({key: value for key, value in result.items() if key != "svgs"}, ensure_ascii=False) + "\n")
+                results.flush()
+                elapsed = time.perf_counter() - started
+                if "error" in result:
+                    failed += 1
+                    print(f"[{elapsed:7.1f}s] failed {result['input']!r}: {result['error']}")
+                else:
+                    done += 1
+                    print(f"[{elapsed:7.1f}s] {result['input']!r}: template {result['template']}, {len(paths)} files")
+    except urllib.error.URLError as e:
+        sys.exit(f"Batch request failed: {e}")
+    elapsed = time.perf_counter() - started
+    print(
+        f"Done in {elapsed:.1f}s: {done} generated, {failed} failed, {len(inputs) - done - failed} duplicates, "
+        f"{len(inputs) / elapsed:.2f} inputs/s. Results in {args.output}"
+    )
+
+if __name__ == "__main__":
+    main()
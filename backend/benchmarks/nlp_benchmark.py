@@ -0,0 +1,125 @@
+# Measures the startup time, memory and extraction speed of each keyword extraction mode (NLP_MODE).
+# Every mode runs in a fresh Python process, so the import and load times and the memory are measured from scratch.
+# Each row records the spaCy pipeline that was loaded and its components. The "full" and "trimmed" rows are marked
+# invalid, and the benchmark exits with an error, when the model isn't installed and KeywordExtractor fell back to a
+# blank pipeline.
+#
+# Usage (from the backend folder):
+#   python benchmarks/nlp_benchmark.py [--modes full trimmed blank stopwords] [--iterations 1000] [--output nlp.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+PROMPTS = [
+    "A man lying on his stomach in the park",
+    "A man inside a secure-residential-space",
+    "Train on rails in a park",
+    "Fire in a white room without any furnitures",
+    "A family checking their emergency kit before a storm",
+]
+
+# Current resident memory of this process in MB, or None where it can't be read.
+def rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return round(int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current memory, in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+# Runs one mode in this process and prints its measurements as JSON.
+def run_child(mode, iterations):
+    baseline = rss_mb()
+    started = time.perf_counter()
+    from keywords import KeywordExtractor
+    extractor = KeywordExtractor(mode)
+    extractor.load()
+    load_seconds = time.perf_counter() - started
+    loaded = rss_mb()
+    nlp = extractor.load()
+    pipeline = f"{nlp.meta['lang']}_{nlp.meta['name']}" if nlp is not None else None
+    components = list(nlp.pipe_names) if nlp is not None else []
+
+    first_started = time.perf_counter()
+    extractor.extract(PROMPTS[0])
+    first_call_ms = (time.perf_counter() - first_started) * 1000
+
+    started = time.perf_counter()
+    for index in range(iterations):
+        extractor.extract(PROMPTS[index % len(PROMPTS)])
+    per_call_us = (time.perf_counter() - started) / iterations * 1_000_000
+
+    print(json.dumps({
+        "mode": mode,
+        "pipeline": pipeline,
+        "pipeline_version": nlp.meta.get("version") if nlp is not None else None,
+        "components": components,
+        "valid": mode not in ("full", "trimmed") or pipeline == extractor.model_name,
+        "startup_seconds": round(load_seconds, 3),
+        "rss_before_mb": baseline,
+        "rss_after_load_mb": loaded,
+        "rss_delta_mb": round(loaded - baseline, 1) if loaded is not None and baseline is not None else None,
+        "first_call_ms": round(first_call_ms, 3),
+        "per_call_us": round(per_call_us, 2),
+        "keywords": {prompt: extractor.extract(prompt) for prompt in PROMPTS},
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure startup time, memory and speed of the keyword extraction modes.")
+    parser.add_argument("--modes", nargs="+", default=["full", "trimmed", "blank", "stopwords"])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.iterations)
+        return
+
+    results = []
+    for mode in args.modes:
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode, "--iterations", str(args.iterations)],
+            capture_output=True, text=True, cwd=BACKEND_DIR,
+        )
+        if child.returncode != 0:
+            print(f"{mode}: failed\n{child.stderr}")
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        results.append(result)
+        pipeline = f"{result['pipeline']} {result['components']}" if result["pipeline"] else "no spaCy"
+        print(
+            f"{mode:10} startup {result['startup_seconds']:.3f} s  memory +{result['rss_delta_mb']} MB  "
+            f"first call {result['first_call_ms']:.3f} ms  then {result['per_call_us']:.2f} us/call  ({pipeline})"
+        )
+        if not result["valid"]:
+            print(f"{mode:10} INVALID: the model isn't installed and a blank pipeline was loaded instead")
+
+    # The modes should agree on the keywords; list the prompts where they don't
+    for prompt in PROMPTS:
+        outputs = {result["mode"]: result["keywords"][prompt] for result in results if result["valid"]}
+        if len({tuple(keywords) for keywords in outputs.values()}) > 1:
+            print(f"Keywords differ for {prompt!r}: {outputs}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+        print(f"Saved results to {args.output}")
+    invalid = [result["mode"] for result in results if not result["valid"]]
+    if invalid:
+        raise SystemExit(f"Invalid measurements for {', '.join(invalid)}: install the model with python -m spacy download en_core_web_sm")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+# End-to-end benchmark of the generation and rendering pipeline.
+# Load: drives POST /infographic followed by POST /change_language at a fixed concurrency, in-process through the
+# Flask test client (LLM_PROVIDER defaults to the stub here) or against a running server with --url.
+# Micro: wrap_text, layout_text, add_wrapped_text_to_svg on an SVG with an embedded 1024x1024 image, and full
+# create_infographics_for_all renders of all languages.
+# Reports p50/p95/p99 latency, throughput and peak RSS, and saves the results as JSON; --compare prints the
+# change against an earlier results file.
+#
+# Usage (from the backend folder):
+#   python benchmarks/pipeline_benchmark.py [--requests 50] [--concurrency 8] [--url http://localhost:5000/]
+#                                           [--output results.json] [--compare previous.json]
+# The stub latencies are set with the STUB_* environment variables (see README).
+import argparse
+import base64
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# File arguments are relative to where the benchmark was started
+START_DIR = os.getcwd()
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("CACHE_ENABLED", "False")
+os.environ.setdefault("LLM_PROVIDER", "stub")
+
+import logging
+import app
+from providers import placeholder_png
+
+logging.disable(logging.CRITICAL)
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+INPUTS = [
+    "איך להתגונן מטילים",
+    "רעידת אדמה",
+    "שריפה בבית",
+    "תחבורה ציבורית",
+    "מה עושים כשנשמעת אזעקה בזמן נסיעה",
+]
+
+TEXTS = {
+    "header": "כך תתגוננו בזמן אזעקה בשטח פתוח",
+    "sub_header1": "היכנסו למרחב המוגן הקרוב",
+    "sub_header2": "שכבו על הקרקע והגנו על הראש",
+}
+
+# Returns the value at the given percentile (nearest rank) of a list of timings.
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(timings, wall_time=None, errors=0):
+    summary = {
+        "count": len(timings),
+        "errors": errors,
+        "p50_ms": round(percentile(timings, 50), 3) if timings else None,
+        "p95_ms": round(percentile(timings, 95), 3) if timings else None,
+        "p99_ms": round(percentile(timings, 99), 3) if timings else None,
+        "mean_ms": round(sum(timings) / len(timings), 3) if timings else None,
+    }
+    if wall_time:
+        summary["throughput_per_s"] = round(len(timings) / wall_time, 3)
+    return summary
+
+# Peak resident memory of this process in MB, or None where it can't be measured.
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+# Posts JSON to an endpoint, in-process or to the server at base_url, and returns (status, body).
+# The body is parsed when it is JSON and returned as text otherwise (e.g. the SVG of /change_language).
+def post(base_url, path, payload):
+    if base_url is None:
+        response = app.app.test_client().post(path, json=payload)
+        return response.status_code, response.get_json() if response.is_json else response.get_data(as_text=True)
+    http_request = urllib.request.Request(
+        base_url.rstrip("/") + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(http_request, timeout=300) as response:
+            body = response.read().decode("utf-8")
+            return response.status, json.loads(body) if response.headers.get_content_type() == "application/json" else body
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+# One simulated user: generates an infographic and switches it to English.
+def user_session(base_url, index, timings, errors):
+    start = time.perf_counter()
+    status, body = post(base_url, "/infographic", {"header": INPUTS[index % len(INPUTS)]})
+    if status != 200 or not body or not body.get("job_id"):
+        errors["infographic"] += 1
+        return
+    timings["infographic"].append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    status, body = post(base_url, "/change_language", {"language": "en", "job_id": body["job_id"]})
+    if status != 200:
+        errors["change_language"] += 1
+        return
+    timings["change_language"].append((time.perf_counter() - start) * 1000)
+
+def run_load(base_url, requests, concurrency):
+    timings = {"infographic": [], "change_language": []}
+    errors = {"infographic": 0, "change_language": 0}
+    start = time.perf_counter()
+    # The pipeline prints its progress; keep it out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for index in range(requests):
+                executor.submit(user_session, base_url, index, timings, errors)
+    wall_time = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_time_s": round(wall_time, 3),
+        "sessions_per_s": round(len(timings["change_language"]) / wall_time, 3),
+        "endpoints": {name: summarize(timings[name], wall_time, errors[name]) for name in timings},
+    }
+
+def measure(function, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+def run_micro(iterations, png):
+    image_base64 = base64.b64encode(png).decode("ascii")
+    with open("template2.svg", "r", encoding="utf-8") as file:
+        svg_with_image = file.read().replace("BASE64", f"data:image/png;base64,{image_base64}")
+    texts = {code: dict(TEXTS) if code == "he" else {field: "Stay in the nearest protected space now" for field in TEXTS} for code in app.LANGUAGES}
+    return {
+        "wrap_text": measure(lambda: app.wrap_text(TEXTS["header"] * 3, 25, 3), iterations),
+        "layout_text": measure(lambda: app.layout_text("header", "he", TEXTS["header"] * 3), iterations),
+        "add_wrapped_text_to_svg": measure(
+            lambda: app.add_wrapped_text_to_svg(svg_with_image, "text2", TEXTS["sub_header1"], 25, "450.0", "250.0", "20px", None, "start", "rtl", "#FFFFFF"),
+            iterations,
+        ),
+        **{
+            f"create_infographics_for_all[{template_file}]": measure(
+                lambda: app.create_infographics_for_all(template_file, image_base64, None, result_prefix=None, texts=texts),
+                iterations,
+            )
+            for template_file in ["template1.svg", "template2.svg"]
+        },
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Prints the p50/p95/p99 change of every benchmark also found in an earlier results file.
+def compare(results, previous):
+    def flatten(section):
+        if "endpoints" in section:
+            section = section["endpoints"]
+        return {name: summary for name, summary in section.items() if isinstance(summary, dict)}
+
+    print(f"\nCompared with {previous.get('revision') or 'previous run'} ({previous.get('timestamp')}):")
+    for part in ("load", "micro"):
+        if not results.get(part) or not previous.get(part):
+            continue
+        before_all = flatten(previous[part])
+        for name, after in flatten(results[part]).items():
+            before = before_all.get(name)
+            if not before:
+                continue
+            changes = []
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if before.get(key) and after.get(key) is not None:
+                    changes.append(f"{key[:-3]} {(after[key] - before[key]) / before[key] * 100:+.1f}%")
+            print(f"  {name}: {', '.join(changes)}")
+
+def print_summary(name, summary):
+    line = f"  {name}: p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms"
+    if "throughput_per_s" in summary:
+        line += f"  {summary['throughput_per_s']}/s  errors {summary['errors']}"
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the infographic endpoints under load and the rendering functions.")
+    parser.add_argument("--url", help="base URL of a running backend (default: in-process with the test client)")
+    parser.add_argument("--requests", type=int, default=50, help="number of simulated users")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=100, help="iterations of each micro-benchmark")
+    parser.add_argument("--image", help="PNG file to embed in the micro-benchmarks (default: a 1024x1024 placeholder)")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", default=f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json", help="JSON file to save the results to")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+    output, previous_file, image_file = (
+        os.path.join(START_DIR, path) if path else None for path in (args.output, args.compare, args.image)
+    )
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "provider": None if args.url else app.provider.name,
+            "llm_max_concurrency": app.LLM_MAX_CONCURRENCY,
+            "stub": {name: value for name, value in os.environ.items() if name.startswith("STUB_")},
+        },
+    }
+
+    if not args.skip_load:
+        target = args.url or f"in-process ({app.provider.name} provider)"
+        print(f"Load: {args.requests} users, concurrency {args.concurrency}, {target}")
+        results["load"] = run_load(args.url, args.requests, args.concurrency)
+        print(f"  {results['load']['sessions_per_s']} sessions/s over {results['load']['wall_time_s']} s")
+        for name, summary in results["load"]["endpoints"].items():
+            print_summary(name, summary)
+
+    if not args.skip_micro:
+        if image_file:
+            with open(image_file, "rb") as file:
+                png = file.read()
+        else:
+            png = placeholder_png(1024)
+        print(f"Micro: {args.iterations} iterations, {len(png) / 1024 / 1024:.2f} MB image")
+        results["micro"] = run_micro(args.iterations, png)
+        for name, summary in results["micro"].items():
+            print_summary(name, summary)
+
+    # Measured on this process, so it only covers the server with the in-process load run
+    results["peak_rss_mb"] = peak_rss_mb()
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2, ensure_ascii=False)
+    print(f"Saved results to {output}")
+
+    if previous_file:
+        with open(previous_file, "r", encoding="utf-8") as file:
+            compare(results, json.load(file))
+
+if __name__ == "__main__":
+    main()
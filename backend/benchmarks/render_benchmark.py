@@ -0,0 +1,110 @@
+# Micro-benchmark of rendering one infographic language with a real-size 1024x1024 image embedded.
+# Compares the previous approach (read the template file, str.replace the placeholders and re.sub each text element
+# across the whole SVG) with render_infographic (single join over the pre-parsed template).
+#
+# Usage (from the backend folder):
+#   python benchmarks/render_benchmark.py [--image path/to/dalle.png] [--iterations 200]
+import argparse
+import base64
+import io
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("CACHE_ENABLED", "False")
+# The legacy path reads the template files as they are, so the rendered outputs only match unoptimized
+os.environ.setdefault("SVG_OPTIMIZE", "False")
+
+import logging
+import app
+
+logging.disable(logging.CRITICAL)
+
+TEXTS = {
+    "header": "כך תתגוננו בזמן אזעקה בשטח פתוח",
+    "sub_header1": "היכנסו למרחב המוגן הקרוב",
+    "sub_header2": "שכבו על הקרקע והגנו על הראש",
+}
+
+# Creates a 1024x1024 PNG with enough detail to reach the size of a DALL-E image (~1.5-2 MB).
+def synthetic_png():
+    from PIL import Image
+    rng = random.Random(0)
+    image = Image.new("RGB", (1024, 1024))
+    pixels = image.load()
+    for y in range(1024):
+        for x in range(1024):
+            noise = rng.randrange(48)
+            pixels[x, y] = ((x // 4 + noise) % 256, (y // 4 + noise) % 256, (x + y) // 8 % 256)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+# The rendering path before the template registry, kept here as the baseline.
+def legacy_render(template_file, code, texts, image_base64):
+    is_rtl = code in ["he", "ar"]
+    direction = "rtl" if is_rtl else "ltr"
+    actual_template_file = "template2_ltr.svg" if "template2" in template_file and not is_rtl else template_file
+    with open(actual_template_file, "r", encoding="utf-8") as file:
+        svg_content = file.read()
+    if "template2" not in actual_template_file:
+        svg_content = svg_content.replace("{{direction}}", direction)
+        svg_content = svg_content.replace("{{text_anchor}}", "end" if is_rtl else "start")
+    svg_content = svg_content.replace("{{footer_text}}", app.FOOTER_TEXTS[code])
+    if "template2" in actual_template_file:
+        svg_content = svg_content.replace("{{sub_header1}}", texts["sub_header1"])
+        svg_content = svg_content.replace("{{sub_header2}}", texts["sub_header2"])
+    svg_content = svg_content.replace("{{image}}", f"data:image/png;base64,{image_base64}")
+    svg_content = svg_content.replace("BASE64", f"data:image/png;base64,{image_base64}")
+    # The text elements are laid out the same way in both paths; only how they are put in the SVG differs
+    for element_id, text_element in app.build_text_elements(actual_template_file, code, texts, direction).items():
+        pattern = f'<text[^>]*id="{element_id}"[^>]*>.*?</text>'
+        svg_content = re.sub(pattern, text_element, svg_content, flags=re.DOTALL)
+    return svg_content
+
+def measure(function, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), statistics.mean(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rendering one infographic language with a 1024x1024 image.")
+    parser.add_argument("--image", help="PNG file to embed (default: a synthetic 1024x1024 PNG)")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as file:
+            png = file.read()
+    else:
+        png = synthetic_png()
+    image_base64 = base64.b64encode(png).decode("ascii")
+    image_href = f"data:image/png;base64,{image_base64}"
+    print(f"Embedded image: {len(png) / 1024 / 1024:.2f} MB PNG, {len(image_base64) / 1024 / 1024:.2f} MB base64")
+
+    for template_file in ["template1.svg", "template2.svg"]:
+        for code in ["he", "en"]:
+            texts = TEXTS if code == "he" else {field: "Stay in the nearest protected space now" for field in TEXTS}
+            # The output of both paths must match before timing them
+            assert legacy_render(template_file, code, texts, image_base64) == app.render_infographic(template_file, code, texts, image_href)
+            legacy = measure(lambda: legacy_render(template_file, code, texts, image_base64), args.iterations)
+            current = measure(lambda: app.render_infographic(template_file, code, texts, image_href), args.iterations)
+            without_image = measure(lambda: app.render_infographic(template_file, code, texts, None), args.iterations)
+            print(
+                f"{template_file} [{code}]  legacy: {legacy[0]:.3f} ms (mean {legacy[1]:.3f})  "
+                f"render_infographic: {current[0]:.3f} ms (mean {current[1]:.3f})  "
+                f"without image: {without_image[0]:.3f} ms"
+            )
+
+if __name__ == "__main__":
+    main()
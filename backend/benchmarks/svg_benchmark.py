@@ -0,0 +1,119 @@
+# Before/after benchmark of the SVG output optimizer (see svg_optimizer.py).
+# Renders every language of both templates from the template files as they are with the indented text elements
+# ("before"), and from the optimized templates with the compact text elements ("after"). Reports the size of each SVG
+# (raw, gzip and brotli, as served by /jobs/<job_id>/svg/<language>), the render time, the XML parse time and, when
+# cairosvg and the cairo library are installed, the rasterization time.
+# The generated image is linked (IMAGE_OUTPUT_MODE=link), or embedded as a resized PNG with --inline.
+#
+# Usage (from the backend folder):
+#   python benchmarks/svg_benchmark.py [--inline] [--iterations 200]
+import argparse
+import base64
+import gzip
+import os
+import statistics
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("CACHE_ENABLED", "False")
+os.environ.setdefault("LLM_PROVIDER", "stub")
+
+import logging
+import app
+from http_cache import brotli
+from providers import placeholder_png
+from raster import rasterization_available, rasterize
+from svg_optimizer import optimize_svg
+from template_registry import TemplateRegistry
+
+logging.disable(logging.CRITICAL)
+
+TEXTS = {
+    "he": {"header": "כך תתגוננו בזמן אזעקה בשטח פתוח", "sub_header1": "היכנסו למרחב המוגן הקרוב", "sub_header2": "שכבו על הקרקע והגנו על הראש"},
+    "en": {"header": "How to protect yourself during a siren in an open area", "sub_header1": "Enter the nearest protected space", "sub_header2": "Lie on the ground and protect your head"},
+    "ar": {"header": "كيف تحمي نفسك أثناء صفارة الإنذار في منطقة مفتوحة", "sub_header1": "ادخلوا إلى أقرب مكان محمي", "sub_header2": "استلقوا على الأرض واحموا رؤوسكم"},
+    "ru": {"header": "Как защититься во время сирены на открытой местности", "sub_header1": "Войдите в ближайшее укрытие", "sub_header2": "Лягте на землю и защитите голову"},
+}
+TEMPLATE_NAMES = ["template1.svg", "template2.svg", "template2_ltr.svg"]
+
+# The indented text elements build_wrapped_text_element emitted before the optimizer.
+def indented_text_elements(template_file, code, texts, direction):
+    elements = compact_text_elements(template_file, code, texts, direction)
+    return {element_id: element.replace("<tspan", "\n    <tspan").replace("</text>", "\n</text>") for element_id, element in elements.items()}
+
+compact_text_elements = app.build_text_elements
+
+def measure(function, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+# Makes render_infographic use the given template registry and text elements.
+def use(registry, build_text_elements):
+    app.templates = registry
+    app.build_text_elements = build_text_elements
+
+def sizes(svg_content):
+    data = svg_content.encode("utf-8")
+    return len(data), len(gzip.compress(data, 6)), len(brotli.compress(data, quality=5)) if brotli else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the rendered SVGs before and after the output optimizer.")
+    parser.add_argument("--inline", action="store_true", help="embed the generated image instead of linking it")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.inline:
+        png, _ = app.image_variant(placeholder_png(1024), 400, 400, "png")
+        image_href = f"data:image/png;base64,{base64.b64encode(png).decode('ascii')}"
+    else:
+        image_href = "http://localhost:5000/image/0123456789abcdef.png"
+
+    started = time.perf_counter()
+    optimized = TemplateRegistry(app.templates.directory, TEMPLATE_NAMES, optimize=lambda source: optimize_svg(source, app.IMAGE_SCALE))
+    print(f"Optimized {len(TEMPLATE_NAMES)} templates in {(time.perf_counter() - started) * 1000:.0f} ms (once, at startup)")
+    variants = {
+        "before": (TemplateRegistry(app.templates.directory, TEMPLATE_NAMES), indented_text_elements),
+        "after": (optimized, compact_text_elements),
+    }
+    can_rasterize = rasterization_available()
+    totals = {name: [0, 0, 0] for name in variants}
+
+    for template_file in app.TEMPLATE_FILES.values():
+        for code in TEXTS:
+            row = []
+            for name, (registry, build_text_elements) in variants.items():
+                use(registry, build_text_elements)
+                texts = TEXTS[code]
+                svg_content = app.render_infographic(template_file, code, texts, image_href)
+                raw, gzipped, brotli_size = sizes(svg_content)
+                totals[name] = [totals[name][0] + raw, totals[name][1] + gzipped, totals[name][2] + (brotli_size or 0)]
+                render_ms = measure(lambda: app.render_infographic(template_file, code, texts, image_href), args.iterations)
+                parse_ms = measure(lambda: ET.fromstring(svg_content.encode("utf-8")), args.iterations)
+                row.append(f"{name}: {raw:7d} B (gzip {gzipped:6d}, br {brotli_size or '-':>6}) render {render_ms:.3f} ms parse {parse_ms:.3f} ms")
+                if can_rasterize:
+                    raster_ms = measure(lambda: rasterize(svg_content, 1080, 1080, "png"), max(args.iterations // 20, 3))
+                    row[-1] += f" rasterize {raster_ms:.1f} ms"
+            print(f"{template_file} [{code}]")
+            for line in row:
+                print(f"  {line}")
+
+    before, after = totals["before"], totals["after"]
+    print(
+        f"All {len(app.TEMPLATE_FILES) * len(TEXTS)} SVGs: {before[0]} -> {after[0]} B ({after[0] / before[0]:.1%}), "
+        f"gzip {before[1]} -> {after[1]} B ({after[1] / before[1]:.1%})"
+        + (f", br {before[2]} -> {after[2]} B ({after[2] / before[2]:.1%})" if brotli else "")
+    )
+    if not can_rasterize:
+        print("Rasterization not measured: cairosvg or the cairo library is not installed")
+
+if __name__ == "__main__":
+    main()
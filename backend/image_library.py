@@ -0,0 +1,158 @@
+# Library of the generated images, so that recurring topics (shelters, earthquakes, fires, public transport) can
+# reuse an earlier image instead of paying for a new prompt and DALL-E generation.
+# Every image is stored once in the ImageStore and indexed by the English user input, its image prompt and the
+# prompt's keywords. The index is an in-process TF-IDF cosine similarity, scored separately against the input and
+# against the prompt with its keywords (a short input like "Earthquake" should match an earlier "Earthquake" even
+# though its prompt is long), with an inverted index so that only the entries sharing a word with the query are
+# scored. Entries are appended to a JSON Lines file.
+import json
+import logging
+import math
+import threading
+import time
+
+from keywords import WORD_PATTERN, STOP_WORDS
+
+# Returns the indexed terms of a text: its lowercase words without the stop words, with a plural "s" dropped
+# ("rockets" matches "rocket").
+def terms(text):
+    return [
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in WORD_PATTERN.findall((text or "").lower())
+        if word not in STOP_WORDS
+    ]
+
+# Returns how many times each item occurs.
+def counts(items):
+    result = {}
+    for item in items:
+        result[item] = result.get(item, 0) + 1
+    return result
+
+# One image of the library: the stored file name and what it was generated for.
+class LibraryEntry:
+    def __init__(self, name, user_input, prompt, keywords, created_at=None):
+        self.name = name
+        self.user_input = user_input
+        self.prompt = prompt
+        self.keywords = keywords
+        self.created_at = created_at or time.time()
+        self.fields = {
+            "input": counts(terms(user_input)),
+            "prompt": counts(terms(prompt) + [term for keyword in keywords for term in terms(keyword)]),
+        }
+
+    @property
+    def terms(self):
+        return set(self.fields["input"]) | set(self.fields["prompt"])
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "input": self.user_input,
+            "prompt": self.prompt,
+            "keywords": self.keywords,
+            "time": round(self.created_at, 3),
+        }
+
+class ImageLibrary:
+    def __init__(self, path, image_store):
+        self.path = path
+        self.image_store = image_store
+        self.entries = []
+        self._by_name = {}
+        # term -> indices of the entries containing it
+        self._postings = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        data = json.loads(line)
+                        self._index(LibraryEntry(data["name"], data["input"], data["prompt"], data.get("keywords", []), data.get("time")))
+                    except (ValueError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Error loading image library {self.path}: {e}")
+        logging.info(f"Image library: {len(self.entries)} images")
+
+    def _index(self, entry):
+        if entry.name in self._by_name:
+            return self._by_name[entry.name]
+        index = len(self.entries)
+        self.entries.append(entry)
+        self._by_name[entry.name] = entry
+        for term in entry.terms:
+            self._postings.setdefault(term, []).append(index)
+        return entry
+
+    # Stores an image (PNG bytes) with what it was generated for, and returns its entry.
+    def add(self, data, user_input, prompt, keywords):
+        name = self.image_store.put(data)
+        entry = LibraryEntry(name, user_input, prompt, list(keywords))
+        with self._lock:
+            if name in self._by_name:
+                return self._by_name[name]
+            self._index(entry)
+            try:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(entry.to_dict(), ensure_ascii=False) + "\n")
+            except OSError as e:
+                logging.error(f"Error recording image {name} in the library: {e}")
+        return entry
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    # Returns the bytes of an entry's image, or None if the file is gone.
+    def image(self, name):
+        return self.image_store.get(name) if name in self._by_name else None
+
+    # Smoothed inverse document frequency of a term.
+    def _idf(self, term):
+        return math.log((len(self.entries) + 1) / (len(self._postings.get(term, ())) + 1)) + 1
+
+    # Cosine similarity of a query vector (with its norm) and a field's term counts.
+    def _similarity(self, query_vector, query_norm, field_counts):
+        dot = 0.0
+        norm = 0.0
+        for term, count in field_counts.items():
+            weight = count * self._idf(term)
+            norm += weight * weight
+            dot += weight * query_vector.get(term, 0.0)
+        return dot / (math.sqrt(norm) * query_norm) if dot else 0.0
+
+    # Returns up to limit (score, entry) pairs most similar to the query, best first; scores are cosine similarities
+    # between 0 and 1 (the better of the input and the prompt). An empty query lists the latest images.
+    def search(self, query, limit=20):
+        with self._lock:
+            query_counts = counts(terms(query))
+            if not query_counts:
+                return [(0.0, entry) for entry in reversed(self.entries[-limit:])]
+            query_vector = {term: count * self._idf(term) for term, count in query_counts.items()}
+            query_norm = math.sqrt(sum(weight * weight for weight in query_vector.values()))
+            candidates = set()
+            for term in query_vector:
+                candidates.update(self._postings.get(term, ()))
+            scored = []
+            for index in candidates:
+                entry = self.entries[index]
+                score = max(self._similarity(query_vector, query_norm, field_counts) for field_counts in entry.fields.values())
+                if score:
+                    scored.append((score, entry))
+        scored.sort(key=lambda pair: (-pair[0], -pair[1].created_at))
+        return scored[:limit]
+
+    # Returns the most similar entry whose image still exists if its score reaches threshold, or None.
+    def best_match(self, query, threshold):
+        for score, entry in self.search(query, limit=5):
+            if score < threshold:
+                return None
+            if self.image_store.get(entry.name) is not None:
+                return score, entry
+        return None
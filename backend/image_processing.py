@@ -0,0 +1,47 @@
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Pillow save options per output format.
+SAVE_OPTIONS = {
+    "png": {"format": "PNG", "optimize": True},
+    "webp": {"format": "WEBP", "quality": 85, "method": 6},
+    "jpeg": {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+}
+
+_variants = OrderedDict()
+_variants_lock = threading.Lock()
+
+# Resizes an image to fit within width x height (never upscaling) and re-encodes it in the given format.
+def resize_image(data, width, height, image_format="png"):
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((width, height), Image.LANCZOS)
+        if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, **SAVE_OPTIONS[image_format])
+        return buffer.getvalue()
+
+# Returns the resized and re-encoded variant of an image, keeping recent variants in an in-memory LRU cache.
+# If the image can't be processed the original bytes are returned with the "png" format.
+def image_variant(data, width, height, image_format="png", cache_size=32):
+    key = (hashlib.sha256(data).hexdigest(), width, height, image_format)
+    with _variants_lock:
+        if key in _variants:
+            _variants.move_to_end(key)
+            return _variants[key], image_format
+    try:
+        variant = resize_image(data, width, height, image_format)
+    except Exception as e:
+        logging.error(f"Error resizing image to {width}x{height} {image_format}: {e}")
+        return data, "png"
+    logging.info(f"Resized image from {len(data)} to {len(variant)} bytes ({width}x{height} {image_format})")
+    with _variants_lock:
+        _variants[key] = variant
+        while len(_variants) > cache_size:
+            _variants.popitem(last=False)
+    return variant, image_format
@@ -0,0 +1,51 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+
+MIME_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+# A stored image file name: the content hash and the format extension.
+IMAGE_NAME_PATTERN = re.compile(r'[0-9a-f]{64}\.(?:png|webp|jpeg)')
+# Matches an image reference to the /image endpoint inside an SVG and captures the stored file name.
+IMAGE_LINK_PATTERN = re.compile(r'(xlink:href|href)="[^"]*/image/(' + IMAGE_NAME_PATTERN.pattern + r')"')
+
+# Stores images once on disk under the SHA-256 hash of their content.
+class ImageStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    # Stores the image bytes (if not already stored) and returns the file name "<hash>.<extension>".
+    def put(self, data, extension="png"):
+        name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            # Write to a temporary file first so concurrent requests never see a partial image.
+            descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        return name
+
+    # Returns the bytes of a stored image, or None if it doesn't exist.
+    def get(self, name):
+        if not IMAGE_NAME_PATTERN.fullmatch(name):
+            return None
+        try:
+            with open(os.path.join(self.directory, name), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    # Replaces every link to a stored image in the SVG with an inline data URI, for self-contained exports.
+    def inline_images(self, svg_content):
+        def replace(match):
+            data = self.get(match.group(2))
+            if data is None:
+                return match.group(0)
+            extension = match.group(2).rsplit(".", 1)[1]
+            encoded = base64.b64encode(data).decode("ascii")
+            return f'{match.group(1)}="data:{MIME_TYPES[extension]};base64,{encoded}"'
+        return IMAGE_LINK_PATTERN.sub(replace, svg_content)
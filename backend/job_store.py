@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import span
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# The result of one /infographic request: the chosen template and the SVG of each language.
+# Asynchronous jobs start as "pending", move to "running" and end as "done" or "failed", recording
+# progress events on the way for clients that poll or stream them. timings holds the per-stage timing, token
+# and cost breakdown of the generation (see metrics.Trace.summary). sources holds what the other languages of a
+# lazily rendered job are rendered from (the template, texts and image) when they are first asked for.
+class Job:
+    def __init__(self, job_id=None, template=None, svgs=None, status="done", timings=None, sources=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.template = template
+        self.svgs = svgs or {}
+        self.status = status
+        self.error = None
+        self.stages = {}
+        self.timings = timings
+        self.sources = sources
+        self.events = []
+        self._renders = {}
+        self.created_at = time.time()
+        # Whether the job was read from the spill directory (created by another process, or evicted), the
+        # modification time of its file when this copy last read or wrote it, the path of its event log there (see
+        # JobStore) and how far this copy read that log, in bytes.
+        self.loaded = False
+        self.spill_mtime = None
+        self.event_log = None
+        self.log_offset = 0
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    # Rebuilds the events of a job read from the spill directory without an event log (a job that was created
+    # finished) from its state, for clients streaming its events: its status, the SVGs it has and its end.
+    def replay_events(self):
+        self.events = [("status", {"status": self.status})]
+        for code, svg_content in self.svgs.items():
+            self.events.append(("svg", {"language": code, "svg": svg_content}))
+        if self.status == "done":
+            self.events.append(("done", {
+                "template": self.template,
+                "languages": sorted(self.svgs),
+                "degraded": bool(self.timings and self.timings.get("degraded")),
+                "timings": self.timings,
+            }))
+        elif self.status == "failed":
+            self.events.append(("error", {"error": self.error}))
+
+    # Applies the events read from the event log of a job to its state: a copy read from the spill directory learns
+    # what the process running the job did since it last wrote the job's file.
+    def apply_events(self, events):
+        for event, data in events:
+            self.events.append((event, data))
+            if event == "status":
+                self.status = data["status"]
+            elif event == "stage":
+                self.stages[data["stage"]] = data["elapsed"]
+            elif event == "svg":
+                self.svgs[data["language"]] = data["svg"]
+            elif event == "done":
+                self.template, self.status = data["template"], "done"
+                self.timings = data.get("timings", self.timings)
+            elif event == "error":
+                self.error, self.status = data["error"], "failed"
+
+    # Records a progress event, appends it to the job's event log if it has one, and wakes up the clients waiting
+    # for events.
+    def add_event(self, event, data):
+        with self._condition:
+            self.events.append((event, data))
+            if self.event_log:
+                try:
+                    append_event(self.event_log, event, data)
+                except OSError as e:
+                    logging.error(f"Error logging event {event} of job {self.id}: {e}")
+            self._condition.notify_all()
+
+    # Waits up to timeout seconds for events after the first start ones, and returns them.
+    def wait_events(self, start, timeout):
+        with self._condition:
+            if len(self.events) <= start and not self.finished:
+                self._condition.wait(timeout)
+            return self.events[start:]
+
+    def set_status(self, status):
+        self.status = status
+        self.add_event("status", {"status": status})
+
+    # Records the time a pipeline stage took.
+    def finish_stage(self, stage, elapsed, completed, total):
+        self.stages[stage] = round(elapsed, 3)
+        self.add_event("stage", {"stage": stage, "elapsed": round(elapsed, 3), "completed": completed, "total": total})
+
+    # Stores the SVG of a language as soon as it is rendered.
+    def set_svg(self, code, svg_content):
+        self.svgs[code] = svg_content
+        self.add_event("svg", {"language": code, "svg": svg_content})
+
+    # Returns the SVG of a language, rendering it with render(code) and storing it the first time it is asked for.
+    # Concurrent callers wait for the same render; a render that fails or returns None isn't memoized.
+    def language_svg(self, code, render):
+        with self._condition:
+            if code in self.svgs:
+                return self.svgs[code]
+            future = self._renders.get(code)
+            owner = future is None
+            if owner:
+                future = self._renders[code] = Future()
+        if owner:
+            try:
+                svg_content = render(code)
+                if svg_content is not None:
+                    self.set_svg(code, svg_content)
+                future.set_result(svg_content)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._renders.pop(code, None)
+        return future.result()
+
+    # available lists the languages that can be asked for, including those not rendered yet (default: the rendered ones).
+    def finish(self, template, available=None):
+        self.template = template
+        self.status = "done"
+        self.add_event("done", {
+            "template": template,
+            "languages": sorted(self.svgs),
+            "available": sorted(available or self.svgs),
+            "degraded": bool(self.timings and self.timings.get("degraded")),
+            "timings": self.timings,
+        })
+
+    def fail(self, error):
+        self.error = error
+        self.status = "failed"
+        self.add_event("error", {"error": error})
+
+# Appends an event to an event log: one JSON [event, data] line, written with a single append so that the lines of
+# concurrent writers don't interleave.
+def append_event(path, event, data):
+    line = (json.dumps([event, data], ensure_ascii=False) + "\n").encode("utf-8")
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+# Keeps jobs in an in-memory LRU, optionally writing them through to spill_dir so that other worker
+# processes (and this one, after eviction) can still load them.
+# In spill_dir each job also has an append-only event log, <job_id>.events.jsonl, to which its events are written as
+# they happen, so that a client of another worker streams them in order and in full (see read_events), and a copy
+# read from spill_dir has the stages and SVGs of a job still running elsewhere.
+# A job read from spill_dir is only kept in memory once it is finished, and is read again whenever its file changed
+# (another process finished it or rendered more languages), so that a job running elsewhere isn't seen as pending
+# forever and a stale copy doesn't overwrite a newer file.
+class JobStore:
+    def __init__(self, max_jobs=200, spill_dir=None):
+        self.max_jobs = max_jobs
+        self.spill_dir = spill_dir
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    # Stores a job (replacing any previous version) and returns it.
+    def save(self, job):
+        if self.spill_dir and job.event_log is None:
+            job.event_log = self._events_path(job.id)
+        if not job.loaded or job.finished:
+            with self._lock:
+                self._jobs[job.id] = job
+                self._jobs.move_to_end(job.id)
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+        if self.spill_dir:
+            try:
+                self._merge_newer(job)
+                self._write(job)
+            except OSError as e:
+                logging.error(f"Error spilling job {job.id}: {e}")
+        return job
+
+    # Adds to a job what another process wrote to its file since this copy last read or wrote it: its end, and the
+    # languages it rendered.
+    def _merge_newer(self, job):
+        if job.spill_mtime is None or self._spill_mtime(job.id) in (None, job.spill_mtime):
+            return
+        newer = self._read(job.id)
+        if newer is None:
+            return
+        if newer.finished and not job.finished:
+            job.template, job.status, job.error = newer.template, newer.status, newer.error
+            job.stages, job.timings, job.sources = newer.stages, newer.timings, newer.sources
+        job.svgs = {**newer.svgs, **job.svgs}
+        job.spill_mtime = newer.spill_mtime
+
+    # Returns a job by id, or None if it is unknown (or the id is malformed).
+    def get(self, job_id):
+        if not isinstance(job_id, str) or not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._jobs.move_to_end(job_id)
+        if job is not None:
+            if self.spill_dir and job.finished:
+                self._merge_newer(job)
+            return job
+        if self.spill_dir:
+            job = self._read(job_id)
+            if job is not None and job.finished:
+                with self._lock:
+                    self._jobs[job_id] = job
+                    self._jobs.move_to_end(job_id)
+                    while len(self._jobs) > self.max_jobs:
+                        self._jobs.popitem(last=False)
+            return job
+        return None
+
+    def _path(self, job_id):
+        return os.path.join(self.spill_dir, f"{job_id}.json")
+
+    def _events_path(self, job_id):
+        return os.path.join(self.spill_dir, f"{job_id}.events.jsonl")
+
+    # Returns the events of a job's event log written after offset (in bytes), and the offset after them.
+    # A line still being written is left for the next read.
+    def read_events(self, job_id, offset=0):
+        try:
+            with open(self._events_path(job_id), "rb") as file:
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return [], offset
+        except OSError as e:
+            logging.error(f"Error reading the events of job {job_id}: {e}")
+            return [], offset
+        complete = data[:data.rfind(b"\n") + 1]
+        events = []
+        for line in complete.splitlines():
+            try:
+                event, data = json.loads(line)
+                events.append((event, data))
+            except ValueError as e:
+                logging.error(f"Invalid event of job {job_id}: {e}")
+        return events, offset + len(complete)
+
+    def _spill_mtime(self, job_id):
+        try:
+            return os.path.getmtime(self._path(job_id))
+        except OSError:
+            return None
+
+    def _write(self, job):
+        data = {
+            "id": job.id, "template": job.template, "svgs": job.svgs, "status": job.status,
+            "error": job.error, "stages": job.stages, "timings": job.timings, "sources": job.sources,
+            "created_at": job.created_at,
+        }
+        with span("write_file"):
+            descriptor, temp_path = tempfile.mkstemp(dir=self.spill_dir)
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(temp_path, self._path(job.id))
+        job.spill_mtime = self._spill_mtime(job.id)
+
+    def _read(self, job_id):
+        try:
+            mtime = os.path.getmtime(self._path(job_id))
+            with open(self._path(job_id), "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading spilled job {job_id}: {e}")
+            return None
+        job = Job(data["id"], data["template"], data["svgs"], data.get("status", "done"))
+        job.error = data.get("error")
+        job.stages = data.get("stages", {})
+        job.timings = data.get("timings")
+        job.sources = data.get("sources")
+        job.created_at = data["created_at"]
+        job.loaded = True
+        job.spill_mtime = mtime
+        job.event_log = self._events_path(job_id)
+        events, job.log_offset = self.read_events(job_id)
+        if events and events[0][0] == "status":
+            job.apply_events(events)
+        else:
+            # A job created finished only logs the languages rendered later, and its file has them all
+            job.replay_events()
+        return job
@@ -0,0 +1,77 @@
+import logging
+import re
+import threading
+import time
+
+NLP_MODES = ("full", "trimmed", "blank", "stopwords")
+# The components of en_core_web_sm. Keyword extraction only reads lexical attributes (text, is_stop, is_alpha),
+# which come from the tokenizer and the vocabulary, so the "trimmed" mode excludes all of them.
+MODEL_COMPONENTS = ["tok2vec", "tagger", "parser", "senter", "attribute_ruler", "lemmatizer", "ner"]
+# Words, keeping contractions in one piece so that they are dropped as not alphabetic, as spaCy's tokens are.
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+
+# spaCy's English stop words (without the contractions, which WORD_PATTERN never matches), for the "stopwords"
+# mode that doesn't import spaCy at all.
+STOP_WORDS = frozenset("""
+a about above across after afterwards again against all almost alone along already also although always am
+among amongst amount an and another any anyhow anyone anything anyway anywhere are around as at back be became
+because become becomes becoming been before beforehand behind being below beside besides between beyond both
+bottom but by ca call can cannot could did do does doing done down due during each eight either eleven else
+elsewhere empty enough even ever every everyone everything everywhere except few fifteen fifty first five for
+former formerly forty four from front full further get give go had has have he hence her here hereafter hereby
+herein hereupon hers herself him himself his how however hundred i if in indeed into is it its itself just keep
+last latter latterly least less made make many may me meanwhile might mine more moreover most mostly move much
+must my myself name namely neither never nevertheless next nine no nobody none noone nor not nothing now
+nowhere of off often on once one only onto or other others otherwise our ours ourselves out over own part per
+perhaps please put quite rather re really regarding same say see seem seemed seeming seems serious several she
+should show side since six sixty so some somehow someone something sometime sometimes somewhere still such take
+ten than that the their them themselves then thence there thereafter thereby therefore therein thereupon these
+they third this those though three through throughout thru thus to together too top toward towards twelve
+twenty two under unless until up upon us used using various very via was we well were what whatever when whence
+whenever where whereafter whereas whereby wherein whereupon wherever whether which while whither who whoever
+whole whom whose why will with within without would yet you your yours yourself yourselves
+""".split())
+
+# Extracts the keywords (the alphabetic, non-stop-word tokens) of the image prompts.
+# Modes: "full" loads the whole spaCy model, "trimmed" loads it without any pipeline component, "blank" uses a blank
+# English spaCy pipeline (no model package needed) and "stopwords" a regex tokenizer with the same stop words.
+# The pipeline is loaded on first use, or up front with load() so that a preforking server shares it between workers.
+class KeywordExtractor:
+    def __init__(self, mode="trimmed", model_name="en_core_web_sm"):
+        if mode not in NLP_MODES:
+            raise ValueError(f"Unknown NLP mode: {mode}")
+        self.mode = mode
+        self.model_name = model_name
+        self.load_seconds = None
+        self._nlp = None
+        self._lock = threading.Lock()
+
+    # Loads the spaCy pipeline of the mode once, falling back to a blank pipeline if the model isn't installed.
+    def load(self):
+        if self.mode == "stopwords" or self._nlp is not None:
+            return self._nlp
+        with self._lock:
+            if self._nlp is None:
+                started = time.perf_counter()
+                self._nlp = self._load()
+                self.load_seconds = time.perf_counter() - started
+                logging.info(f"Loaded the {self.mode} spaCy pipeline in {self.load_seconds:.2f}s")
+        return self._nlp
+
+    def _load(self):
+        import spacy
+        if self.mode == "blank":
+            return spacy.blank("en")
+        try:
+            if self.mode == "trimmed":
+                return spacy.load(self.model_name, exclude=MODEL_COMPONENTS)
+            return spacy.load(self.model_name)
+        except OSError as e:
+            logging.error(f"Error loading spaCy model {self.model_name}, using a blank English pipeline: {e}")
+            return spacy.blank("en")
+
+    # Returns the keywords of a text in order.
+    def extract(self, text):
+        if self.mode == "stopwords":
+            return [word for word in WORD_PATTERN.findall(text) if word.isalpha() and word.lower() not in STOP_WORDS]
+        return [token.text for token in self.load()(text) if not token.is_stop and token.is_alpha]
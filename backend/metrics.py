@@ -0,0 +1,249 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Estimated prices in dollars: per 1M prompt and completion tokens for the chat models, per image for DALL-E.
+CHAT_PRICES = {
+    "gpt-4-1106-preview": (10.0, 30.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+}
+IMAGE_PRICES = {
+    ("dall-e-3", "1024x1024"): 0.04,
+    ("dall-e-3", "1024x1792"): 0.08,
+    ("dall-e-3", "1792x1024"): 0.08,
+}
+# Descriptions of the counters other modules increment with Metrics.count.
+COUNTERS = {
+    "infographic_llm_retries_total": "Model calls retried after a transient error.",
+    "infographic_llm_hedges_total": "Duplicate requests sent for slow model calls.",
+    "infographic_llm_hedge_wins_total": "Hedged model calls answered first by the duplicate request.",
+    "infographic_llm_throttled_seconds_total": "Seconds model calls waited for the rate limits.",
+    "infographic_llm_queued_seconds_total": "Seconds model calls waited for a free in-flight slot.",
+    "infographic_image_library_total": "Images generated, reused from the library (by input or prompt) or picked by an editor.",
+    "infographic_warm_pool_total": "Requests answered from the warm pool (hit), or not (miss, or stale).",
+    "infographic_batch_items_total": "Batch items generated, by outcome (done, failed or duplicate).",
+    "infographic_template_choices_total": "Templates chosen by the local classifier, by the LLM or by the fallback.",
+    "infographic_fallbacks_total": "Parallel model calls that timed out or failed and fell back to a default (e.g. the untranslated text).",
+}
+# Upper bounds (seconds) of the stage duration histogram buckets.
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+# One timed stage. Model calls made inside it add their model, tokens and cost to it.
+class Span:
+    def __init__(self, stage, offset):
+        self.stage = stage
+        self.offset = offset
+        self.elapsed = None
+        self.model = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.cached = False
+        self.error = None
+
+    def to_dict(self):
+        span = {"stage": self.stage, "start": round(self.offset, 3), "elapsed": round(self.elapsed or 0, 3)}
+        if self.model:
+            span.update(model=self.model, prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens,
+                        cost_dollars=round(self.cost, 6), cached=self.cached)
+        if self.error:
+            span["error"] = self.error
+        return span
+
+# The spans of one request or job. Spans nest (e.g. "dalle" inside "generate_image"), so the seconds of the
+# stages overlap, while tokens and cost are only counted on the innermost span and add up.
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.fallbacks = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def add_fallback(self, call, reason):
+        with self._lock:
+            self.fallbacks.append({"call": call, "reason": reason})
+
+    # Returns the timing breakdown: totals, per-stage sums and the individual spans in start order.
+    def summary(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.offset)
+            fallbacks = list(self.fallbacks)
+        stages = {}
+        for span in spans:
+            stage = stages.setdefault(span.stage, {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost_dollars": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += span.elapsed or 0
+            stage["prompt_tokens"] += span.prompt_tokens
+            stage["completion_tokens"] += span.completion_tokens
+            stage["cost_dollars"] += span.cost
+        for stage in stages.values():
+            stage["seconds"] = round(stage["seconds"], 3)
+            stage["cost_dollars"] = round(stage["cost_dollars"], 6)
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 3),
+            "prompt_tokens": sum(span.prompt_tokens for span in spans),
+            "completion_tokens": sum(span.completion_tokens for span in spans),
+            "cost_dollars": round(sum(span.cost for span in spans), 6),
+            "stages": stages,
+            "spans": [span.to_dict() for span in spans],
+            # Calls whose result was replaced by a fallback: the output is usable but not what was asked for
+            "degraded": bool(fallbacks),
+            "fallbacks": fallbacks,
+        }
+
+# Process-wide counters and histograms, rendered in the Prometheus text format.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_buckets = {}
+        self.stage_sums = {}
+        self.stage_errors = {}
+        self.llm_calls = {}
+        self.tokens = {}
+        self.cost = {}
+        self.counters = {name: {} for name in COUNTERS}
+
+    # Adds amount to one of the COUNTERS with the given labels.
+    def count(self, name, labels, amount=1):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.counters[name][key] = self.counters[name].get(key, 0) + amount
+
+    def observe_stage(self, stage, elapsed, failed):
+        with self._lock:
+            buckets = self.stage_buckets.setdefault(stage, [0] * (len(STAGE_BUCKETS) + 1))
+            for index, bound in enumerate(STAGE_BUCKETS):
+                if elapsed <= bound:
+                    buckets[index] += 1
+            buckets[-1] += 1
+            self.stage_sums[stage] = self.stage_sums.get(stage, 0.0) + elapsed
+            if failed:
+                self.stage_errors[stage] = self.stage_errors.get(stage, 0) + 1
+
+    def observe_call(self, model, kind, cached, prompt_tokens, completion_tokens, cost):
+        with self._lock:
+            key = (model, kind, "true" if cached else "false")
+            self.llm_calls[key] = self.llm_calls.get(key, 0) + 1
+            for token_type, count in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+                if count:
+                    self.tokens[(model, token_type)] = self.tokens.get((model, token_type), 0) + count
+            if cost:
+                self.cost[model] = self.cost.get(model, 0.0) + cost
+
+    def render(self):
+        lines = []
+
+        def header(name, kind, description):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            header("infographic_stage_seconds", "histogram", "Wall time of the pipeline stages.")
+            for stage, buckets in sorted(self.stage_buckets.items()):
+                for bound, count in zip(STAGE_BUCKETS, buckets):
+                    lines.append(f'infographic_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'infographic_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {buckets[-1]}')
+                lines.append(f'infographic_stage_seconds_sum{{stage="{stage}"}} {self.stage_sums[stage]:.6f}')
+                lines.append(f'infographic_stage_seconds_count{{stage="{stage}"}} {buckets[-1]}')
+            header("infographic_stage_errors_total", "counter", "Pipeline stages that raised an error.")
+            for stage, count in sorted(self.stage_errors.items()):
+                lines.append(f'infographic_stage_errors_total{{stage="{stage}"}} {count}')
+            header("infographic_llm_calls_total", "counter", "Model calls, including the ones answered from the response cache.")
+            for (model, kind, cached), count in sorted(self.llm_calls.items()):
+                lines.append(f'infographic_llm_calls_total{{model="{model}",kind="{kind}",cached="{cached}"}} {count}')
+            header("infographic_llm_tokens_total", "counter", "Tokens sent to and received from the chat models.")
+            for (model, token_type), count in sorted(self.tokens.items()):
+                lines.append(f'infographic_llm_tokens_total{{model="{model}",type="{token_type}"}} {count}')
+            header("infographic_llm_cost_dollars_total", "counter", "Estimated cost of the model calls in dollars.")
+            for model, cost in sorted(self.cost.items()):
+                lines.append(f'infographic_llm_cost_dollars_total{{model="{model}"}} {cost:.6f}')
+            for name, description in COUNTERS.items():
+                header(name, "counter", description)
+                for key, value in sorted(self.counters[name].items()):
+                    labels = ",".join(f'{label}="{label_value}"' for label, label_value in key)
+                    lines.append(f"{name}{{{labels}}} {round(value, 6)}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Collects the spans of everything run in this context (including the tasks it starts through copied contexts)
+# into a new Trace.
+@contextmanager
+def trace():
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+# Times a stage and records it in the process metrics and in the current trace, if any.
+@contextmanager
+def span(stage):
+    current_trace = _current_trace.get()
+    started = time.perf_counter()
+    current = Span(stage, started - current_trace.started if current_trace else 0.0)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = str(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.elapsed = time.perf_counter() - started
+        metrics.observe_stage(stage, current.elapsed, current.error is not None)
+        if current_trace is not None:
+            current_trace.add(current)
+
+# Decorator form of span for a whole function.
+def timed(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _record(model, kind, cached, prompt_tokens, completion_tokens, cost):
+    metrics.observe_call(model, kind, cached, prompt_tokens, completion_tokens, cost)
+    current = _current_span.get()
+    if current is not None:
+        current.model = model
+        current.cached = cached
+        current.prompt_tokens += prompt_tokens
+        current.completion_tokens += completion_tokens
+        current.cost += cost
+
+# Records a call that fell back to its default (reason: "timeout" or the error) in the process metrics and in the
+# current trace, if any.
+def record_fallback(call, reason):
+    metrics.count("infographic_fallbacks_total", {"reason": "timeout" if reason == "timeout" else "error"})
+    current_trace = _current_trace.get()
+    if current_trace is not None:
+        current_trace.add_fallback(call, reason)
+
+# Records a chat completion on the current span; usage holds its prompt_tokens and completion_tokens.
+# Calls answered from the cache cost nothing.
+def record_chat(model, kind, usage=None, cached=False):
+    prompt_tokens = usage.get("prompt_tokens", 0) if usage else 0
+    completion_tokens = usage.get("completion_tokens", 0) if usage else 0
+    prompt_price, completion_price = CHAT_PRICES.get(model, (0.0, 0.0))
+    cost = 0.0 if cached else (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+    _record(model, kind, cached, prompt_tokens, completion_tokens, cost)
+
+# Records a generated image on the current span.
+def record_image(model, size, cached=False):
+    _record(model, "image", cached, 0, 0, 0.0 if cached else IMAGE_PRICES.get((model, size), 0.0))
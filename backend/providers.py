@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+
+# Sends the chat completions and image generations to OpenAI.
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self, api_key=None):
+        from openai import OpenAI
+        # Retries are left to the call scheduler
+        self.client = OpenAI(api_key=api_key, max_retries=0)
+
+    # Returns the reply text of a chat completion and its token usage.
+    def chat(self, model, messages, timeout=None, **options):
+        response = self.client.chat.completions.create(model=model, messages=messages, timeout=timeout, **options)
+        usage = None
+        if response.usage is not None:
+            usage = {"prompt_tokens": response.usage.prompt_tokens, "completion_tokens": response.usage.completion_tokens}
+        return response.choices[0].message.content, usage
+
+    # Yields the reply of a chat completion as it is generated, as (text, None) pieces, then ("", usage) at the end.
+    def chat_stream(self, model, messages, timeout=None, **options):
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options,
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content, None
+            if chunk.usage is not None:
+                yield "", {"prompt_tokens": chunk.usage.prompt_tokens, "completion_tokens": chunk.usage.completion_tokens}
+
+    # Returns a generated image as base64 encoded PNG.
+    def generate_image(self, model, prompt, size="1024x1024", timeout=None):
+        response = self.client.images.generate(
+            model=model,
+            prompt=prompt,
+            n=1,
+            size=size,
+            response_format="b64_json",
+            timeout=timeout,
+        )
+        return response.data[0].b64_json
+
+# A simulated transient error; status_code makes the call scheduler retry it like an OpenAI API error.
+class StubProviderError(Exception):
+    def __init__(self, message, status_code=503):
+        super().__init__(message)
+        self.status_code = status_code
+
+# Translations the stub returns for its own headers and common inputs; other texts are returned with a language tag.
+CANNED_TRANSLATIONS = {
+    "הנחיות התגוננות לשעת חירום": {
+        "English": "Protection guidelines for emergencies",
+        "Arabic": "تعليمات الحماية في حالات الطوارئ",
+        "Russian": "Инструкции по защите в чрезвычайной ситуации",
+    },
+    "היכנסו למרחב המוגן הקרוב": {
+        "English": "Enter the nearest protected space",
+        "Arabic": "ادخلوا إلى أقرب حيز محمي",
+        "Russian": "Войдите в ближайшее защищенное помещение",
+    },
+    "הישארו בו עשר דקות": {
+        "English": "Stay there for ten minutes",
+        "Arabic": "ابقوا فيه عشر دقائق",
+        "Russian": "Оставайтесь там десять минут",
+    },
+    "איך להתגונן מטילים": {
+        "English": "How to protect yourself from rockets",
+        "Arabic": "كيف تحمي نفسك من الصواريخ",
+        "Russian": "Как защититься от ракет",
+    },
+    "רעידת אדמה": {"English": "Earthquake", "Arabic": "زلزال", "Russian": "Землетрясение"},
+    "שריפה בבית": {"English": "A fire at home", "Arabic": "حريق في المنزل", "Russian": "Пожар в доме"},
+    "תחבורה ציבורית": {"English": "Public transportation", "Arabic": "المواصلات العامة", "Russian": "Общественный транспорт"},
+}
+
+# A local, deterministic stand-in for OpenAI for load tests and benchmarks: no network and no API key.
+# Each call sleeps for a log-normally distributed latency around the configured median, fails with probability
+# failure_rate, and returns a canned reply chosen from the system prompt. Images are a generated placeholder PNG.
+class StubProvider:
+    name = "stub"
+
+    def __init__(self, chat_latency=0.3, image_latency=2.0, latency_sigma=0.5, failure_rate=0.0, seed=None, image_size=1024):
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.image_size = image_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._image = None
+
+    # Waits for a random latency around median (only its first part for a stream) or fails like the API would.
+    # Returns the latency.
+    def _simulate(self, median, timeout, first=1.0):
+        with self._lock:
+            latency = median * self._random.lognormvariate(0, self.latency_sigma) if median > 0 else 0
+            failed = self._random.random() < self.failure_rate
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise StubProviderError(f"Stub call timed out after {timeout}s", status_code=408)
+        time.sleep(latency * first)
+        if failed:
+            raise StubProviderError("Stub call failed")
+        return latency
+
+    # Returns a canned reply for the kind of request the system prompt describes, and an estimate of its token
+    # usage (about 4 characters per token).
+    def chat(self, model, messages, timeout=None, **options):
+        self._simulate(self.chat_latency, timeout)
+        content = self._reply(messages, options)
+        usage = {
+            "prompt_tokens": sum(len(message["content"]) for message in messages) // 4 + 1,
+            "completion_tokens": len(content) // 4 + 1,
+        }
+        return content, usage
+
+    # Streams the canned reply word by word: the first word arrives after a fifth of the latency, and the others are
+    # spread over the rest of it, like a model generating tokens.
+    def chat_stream(self, model, messages, timeout=None, **options):
+        latency = self._simulate(self.chat_latency, timeout, first=0.2)
+        content = self._reply(messages, options)
+        pieces = re.findall(r"\S+\s*|\s+", content)
+        for piece in pieces:
+            time.sleep(latency * 0.8 / max(len(pieces), 1))
+            yield piece, None
+        yield "", {
+            "prompt_tokens": sum(len(message["content"]) for message in messages) // 4 + 1,
+            "completion_tokens": len(content) // 4 + 1,
+        }
+
+    def _reply(self, messages, options):
+        system_prompt = messages[0]["content"]
+        text = messages[-1]["content"]
+        if options.get("response_format", {}).get("type") == "json_object":
+            return self._batch_translation(text)
+        match = re.match(r"Translate the following text from Hebrew to (\w+)", system_prompt)
+        if match:
+            return self._translate(text, match.group(1))
+        match = re.search(r"to a maximum of (\d+) words", system_prompt)
+        if match:
+            return " ".join(text.split()[:int(match.group(1))])
+        if "choose a template" in system_prompt:
+            return "1" if hashlib.sha256(text.encode("utf-8")).digest()[0] % 2 else "2"
+        if "sub-headers" in system_prompt:
+            return "היכנסו למרחב המוגן הקרוב\nהישארו בו עשר דקות"
+        if "return a prompt describing" in system_prompt:
+            return "A man inside a secure residential space"
+        if "header" in system_prompt:
+            return "הנחיות התגוננות לשעת חירום"
+        return text
+
+    def _translate(self, text, language):
+        canned = CANNED_TRANSLATIONS.get(" ".join(text.split()), {})
+        return canned.get(language, f"[{language}] {text}")
+
+    # Answers a batch translation request (see translate_batch) with a valid translation matrix.
+    def _batch_translation(self, payload_text):
+        payload = json.loads(payload_text)
+        matrix = {}
+        for code, language in payload["languages"].items():
+            matrix[code] = {}
+            for field, text in payload["texts"].items():
+                words = self._translate(text, language).split()
+                matrix[code][field] = " ".join(words[:payload["max_words"][code][field]])
+        return json.dumps(matrix, ensure_ascii=False)
+
+    # Returns a placeholder PNG as base64. It is generated once, with enough noise to be as large as a DALL-E image,
+    # from the seeded random generator so that it is the same in every process with STUB_SEED.
+    def generate_image(self, model, prompt, size="1024x1024", timeout=None):
+        self._simulate(self.image_latency, timeout)
+        with self._lock:
+            if self._image is None:
+                self._image = base64.b64encode(placeholder_png(self.image_size, self._random)).decode("ascii")
+        return self._image
+
+# Builds a square RGB PNG: a gradient with random noise in half of every row, so it compresses like a photo.
+# The noise comes from generator (a random.Random), or from an unseeded one.
+def placeholder_png(size, generator=None):
+    generator = generator or random.Random()
+    rows = []
+    for y in range(size):
+        half = size // 2
+        gradient = bytes(((x + y) // 4) % 256 for x in range(half) for _ in range(3))
+        rows.append(b"\x00" + generator.randbytes(half * 3) + gradient)
+    raw = b"".join(rows)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+# Creates the provider selected by LLM_PROVIDER ("openai" or "stub").
+def provider_from_env():
+    name = os.getenv("LLM_PROVIDER", "openai").lower()
+    if name == "stub":
+        seed = os.getenv("STUB_SEED")
+        logging.info("Using the stub LLM provider")
+        return StubProvider(
+            chat_latency=float(os.getenv("STUB_CHAT_LATENCY", 0.3)),
+            image_latency=float(os.getenv("STUB_IMAGE_LATENCY", 2.0)),
+            latency_sigma=float(os.getenv("STUB_LATENCY_SIGMA", 0.5)),
+            failure_rate=float(os.getenv("STUB_FAILURE_RATE", 0.0)),
+            seed=int(seed) if seed else None,
+        )
+    if name != "openai":
+        raise ValueError(f"Unknown LLM_PROVIDER: {name}")
+    return OpenAIProvider(api_key=os.getenv("OPENAI_API_KEY"))
@@ -0,0 +1,119 @@
+import io
+import logging
+import multiprocessing
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Output sizes for the social channels; any "<width>x<height>" is accepted too.
+SIZES = {
+    "square": (1080, 1080),
+    "story": (1080, 1920),
+    "banner": (1200, 628),
+}
+SIZE_PATTERN = re.compile(r'(\d{2,4})x(\d{2,4})')
+MAX_SIDE = 4096
+RASTER_FORMATS = {
+    "png": ("image/png", {"format": "PNG", "optimize": True}),
+    "jpeg": ("image/jpeg", {"format": "JPEG", "quality": 90, "optimize": True, "progressive": True}),
+    "webp": ("image/webp", {"format": "WEBP", "quality": 90, "method": 4}),
+}
+# The templates' background color, filling the margins when the size isn't square.
+BACKGROUND = (4, 68, 103)
+
+# Returns the (width, height) of a size name or "<width>x<height>", or None if it is invalid.
+def parse_size(size):
+    if size in SIZES:
+        return SIZES[size]
+    match = SIZE_PATTERN.fullmatch(size or "")
+    if match is None:
+        return None
+    width, height = int(match.group(1)), int(match.group(2))
+    if not (16 <= width <= MAX_SIDE and 16 <= height <= MAX_SIDE):
+        return None
+    return width, height
+
+# Returns whether cairosvg (and the cairo library it needs) can be loaded.
+def rasterization_available():
+    try:
+        import cairosvg  # noqa: F401
+        return True
+    except (ImportError, OSError):
+        return False
+
+# Renders a (self-contained) SVG to an image of width x height in the given format.
+# The square infographic is scaled to fit and centered on the background color. Runs in the worker processes.
+def rasterize(svg_content, width, height, image_format):
+    import cairosvg
+    from PIL import Image
+
+    side = min(width, height)
+    png = cairosvg.svg2png(bytestring=svg_content.encode("utf-8"), output_width=side, output_height=side)
+    with Image.open(io.BytesIO(png)) as infographic:
+        canvas = Image.new("RGB", (width, height), BACKGROUND)
+        infographic = infographic.convert("RGBA")
+        canvas.paste(infographic, ((width - side) // 2, (height - side) // 2), infographic)
+        buffer = io.BytesIO()
+        canvas.save(buffer, **RASTER_FORMATS[image_format][1])
+        return buffer.getvalue()
+
+# Rasterizes SVGs on a pool of worker processes, so that request threads only wait and the GIL isn't held by
+# cairo and the encoders. The outputs are kept in an LRU of up to max_bytes, keyed by (job, language, size, format);
+# a request for an output that is already being rendered waits for that render instead of starting another.
+class Rasterizer:
+    def __init__(self, workers=2, max_bytes=64 * 1024 * 1024):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self._pool = None
+        self._cache = OrderedDict()
+        self._size = 0
+        self._pending = {}
+        # Reentrant, as a render that finishes right away runs its callback in the submitting thread
+        self._lock = threading.RLock()
+
+    # The workers are started from a fork server (or spawned where there is none) instead of being forked from this
+    # multi-threaded process, where another thread could be holding a lock (logging, SQLite) the child would inherit.
+    def _executor(self):
+        if self._pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        return self._pool
+
+    # Returns the image bytes for key, rendering the SVG from get_svg() if they aren't cached.
+    # get_svg() runs outside the lock (it may inline images), so other outputs aren't held up while it does.
+    def render(self, key, get_svg, width, height, image_format, timeout=None):
+        future = self._lookup(key)
+        if future is None:
+            svg_content = get_svg()
+            with self._lock:
+                future = self._lookup(key)
+                if future is None:
+                    future = self._executor().submit(rasterize, svg_content, width, height, image_format)
+                    self._pending[key] = future
+                    future.add_done_callback(lambda done: self._finished(key, done))
+        if isinstance(future, bytes):
+            return future
+        return future.result(timeout=timeout)
+
+    # Returns the cached bytes for key, the future of its render in progress, or None.
+    def _lookup(self, key):
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+            return self._pending.get(key)
+
+    def _finished(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            data = future.result()
+            self._cache[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._size -= len(evicted)
+        logging.info(f"Rasterized {key} to {len(data)} bytes")
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+
+# Set to True for the current request to skip cache reads (fresh responses are still stored).
+cache_bypass = ContextVar("cache_bypass", default=False)
+
+# Normalizes user input so that insignificant whitespace differences hit the same entry.
+def normalize_text(text):
+    return " ".join(str(text).split())
+
+# Normalizes every string nested in lists and dicts (e.g. chat messages).
+def _normalize(value):
+    if isinstance(value, str):
+        return normalize_text(value)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+# Builds a cache key from the parts that determine a response (kind, model, messages/prompt, options).
+def make_key(*parts):
+    data = json.dumps(_normalize(parts), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+# Disk-backed response cache using SQLite, with TTL and size-based LRU eviction.
+# Text responses are stored inline; binary responses (images) are stored once in a blobs table by content hash.
+# Writes keep a running total of the cache size instead of summing the tables every time; when it crosses max_bytes,
+# the least recently used entries are deleted in one statement down to LOW_WATER of max_bytes. The total is
+# recomputed after every eviction and every SYNC_INTERVAL seconds, to account for the writes of other processes.
+class ResponseCache:
+    LOW_WATER = 0.9
+    SYNC_INTERVAL = 60
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_bytes=500 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, kind TEXT, value TEXT, blob_hash TEXT,
+                size INTEGER, created_at REAL, accessed_at REAL)""")
+            db.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB, size INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            self._total = self._total_size(db)
+        self._synced_at = time.time()
+
+    # Returns this thread's connection to the cache database.
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            self._local.db = db
+        return db
+
+    def _count(self, counters, kind):
+        with self._lock:
+            counters[kind] = counters.get(kind, 0) + 1
+
+    # Returns the cached (value, blob) row for a key, or None on a miss or an expired entry.
+    def _lookup(self, key, kind):
+        if cache_bypass.get():
+            self._count(self.misses, kind)
+            return None
+        try:
+            db = self._connect()
+            row = db.execute(
+                "SELECT entries.value, blobs.data, entries.created_at FROM entries "
+                "LEFT JOIN blobs ON blobs.hash = entries.blob_hash WHERE entries.key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[2] > self.ttl:
+                self._count(self.misses, kind)
+                return None
+            with db:
+                db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._count(self.hits, kind)
+            return row[0], row[1]
+        except sqlite3.Error as e:
+            logging.error(f"Cache read error: {e}")
+            self._count(self.misses, kind)
+            return None
+
+    # Returns the cached text for a key, or None.
+    def get(self, key, kind="text"):
+        row = self._lookup(key, kind)
+        return row[0] if row else None
+
+    # Returns the cached bytes for a key, or None.
+    def get_blob(self, key, kind="blob"):
+        row = self._lookup(key, kind)
+        return row[1] if row else None
+
+    def _store(self, key, kind, value, blob):
+        try:
+            db = self._connect()
+            now = time.time()
+            added = 0
+            with db:
+                blob_hash = None
+                if blob is not None:
+                    blob_hash = hashlib.sha256(blob).hexdigest()
+                    inserted = db.execute("INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)", (blob_hash, blob, len(blob)))
+                    added += len(blob) if inserted.rowcount == 1 else 0
+                size = len(value.encode("utf-8")) if value is not None else 0
+                db.execute(
+                    "INSERT OR REPLACE INTO entries (key, kind, value, blob_hash, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, kind, value, blob_hash, size, now, now),
+                )
+                added += size
+            # A replaced entry is counted twice until the next sync, which at worst evicts a little early
+            with self._lock:
+                self._total += added
+                due = self._total > self.max_bytes or now - self._synced_at > self.SYNC_INTERVAL
+            if due:
+                self._evict(db)
+        except sqlite3.Error as e:
+            logging.error(f"Cache write error: {e}")
+
+    # Stores a text response.
+    def put(self, key, value, kind="text"):
+        self._store(key, kind, value, None)
+
+    # Stores a binary response once by its content hash and references it from the key.
+    def put_blob(self, key, data, kind="blob"):
+        self._store(key, kind, None, data)
+
+    # Deletes the expired entries, then, if the cache is over max_bytes, the least recently used entries down to
+    # LOW_WATER of max_bytes (an entry frees its size and its blob's), then the blobs no entry references anymore.
+    # Resynchronizes the running total with the tables.
+    def _evict(self, db):
+        # Another thread is already evicting
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            with db:
+                db.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl,))
+                self._delete_orphan_blobs(db)
+                total = self._total_size(db)
+                if total > self.max_bytes:
+                    excess = total - int(self.max_bytes * self.LOW_WATER)
+                    db.execute(
+                        "DELETE FROM entries WHERE key IN (SELECT key FROM ("
+                        "SELECT entries.key, entries.size + COALESCE(blobs.size, 0) AS own, "
+                        "SUM(entries.size + COALESCE(blobs.size, 0)) OVER (ORDER BY entries.accessed_at, entries.key) AS freed "
+                        "FROM entries LEFT JOIN blobs ON blobs.hash = entries.blob_hash"
+                        ") WHERE freed - own < ?)",
+                        (excess,),
+                    )
+                    self._delete_orphan_blobs(db)
+                    total = self._total_size(db)
+            with self._lock:
+                self._total = total
+                self._synced_at = time.time()
+        finally:
+            self._evict_lock.release()
+
+    def _delete_orphan_blobs(self, db):
+        db.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT blob_hash FROM entries WHERE blob_hash IS NOT NULL)")
+
+    def _total_size(self, db):
+        entries_size = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        blobs_size = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        return entries_size + blobs_size
+
+    # Returns the hit/miss counters by kind and the current number of entries and bytes.
+    def stats(self):
+        with self._lock:
+            stats = {"hits": dict(self.hits), "misses": dict(self.misses)}
+        try:
+            db = self._connect()
+            stats["entries"] = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            stats["bytes"] = self._total_size(db)
+        except sqlite3.Error as e:
+            logging.error(f"Cache stats error: {e}")
+        return stats
+
+# Creates the cache from the environment, or returns None when caching is disabled.
+def cache_from_env():
+    if os.getenv("CACHE_ENABLED", "True").lower() not in ["true", "1", "t"]:
+        return None
+    return ResponseCache(
+        os.getenv("CACHE_PATH", "cache.sqlite3"),
+        ttl=float(os.getenv("CACHE_TTL", 7 * 24 * 3600)),
+        max_bytes=int(float(os.getenv("CACHE_MAX_MB", 500)) * 1024 * 1024),
+    )
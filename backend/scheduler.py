@@ -0,0 +1,214 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import metrics
+
+# HTTP status codes worth retrying: timeouts, conflicts, rate limits and server errors.
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "Timeout", "ConnectionError"}
+
+class DeadlineExceeded(Exception):
+    pass
+
+# A token bucket refilled continuously at rate tokens per second, holding at most capacity tokens.
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Takes amount tokens if they are available right now.
+    def try_acquire(self, amount=1):
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+            return False
+
+    # Takes amount tokens, waiting for them until the deadline (a time.monotonic() value, or None to wait for ever).
+    # Returns the seconds waited; raises DeadlineExceeded if the tokens wouldn't be there in time.
+    def acquire(self, amount=1, deadline=None):
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise DeadlineExceeded("Rate limit wait would exceed the call deadline")
+            time.sleep(delay)
+            waited += delay
+
+# Returns whether an error from a provider call is transient (timeout, connection error, 429 or 5xx).
+def is_retryable(error):
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES or isinstance(error, (TimeoutError, ConnectionError))
+
+# Returns the delay in seconds the server asked for with Retry-After (or retry-after-ms), or None.
+def retry_after(error):
+    value = getattr(error, "retry_after", None)
+    if value is not None:
+        return float(value)
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+# Runs every model call through per-model rate limits (requests and estimated tokens per minute), retries
+# transient errors with exponential backoff and jitter (or the server's Retry-After), bounds each call by a
+# deadline covering all of its attempts, and can hedge slow calls by sending a duplicate after hedge_after seconds
+# and using whichever answers first. At most max_in_flight requests (hedges included) are sent at a time across
+# all callers, so that a batch of infographics queues for the provider instead of flooding it; 0 means no limit.
+# rate_limits maps a model name (or "*" for the others) to {"rpm": requests per minute, "tpm": tokens per minute}.
+class CallScheduler:
+    def __init__(self, rate_limits=None, max_retries=3, backoff_base=0.5, backoff_max=20.0, call_timeout=60.0,
+                 deadline=120.0, hedge_after=0.0, max_workers=16, max_in_flight=0):
+        self.rate_limits = rate_limits or {}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.call_timeout = call_timeout
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge") if hedge_after > 0 else None
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+
+    # Returns the (requests, tokens) buckets of a model; either may be None when not limited.
+    def _buckets_for(self, model):
+        with self._buckets_lock:
+            if model not in self._buckets:
+                limits = self.rate_limits.get(model, self.rate_limits.get("*", {}))
+                rpm, tpm = limits.get("rpm"), limits.get("tpm")
+                self._buckets[model] = (
+                    TokenBucket(rpm / 60, max(1, rpm / 60)) if rpm else None,
+                    TokenBucket(tpm / 60, max(1, tpm / 6)) if tpm else None,
+                )
+            return self._buckets[model]
+
+    def _acquire(self, model, tokens, deadline, block=True):
+        requests_bucket, tokens_bucket = self._buckets_for(model)
+        if not block:
+            # Used for hedges: only send one if the limits have room for it right now
+            return (requests_bucket is None or requests_bucket.try_acquire()) and (tokens_bucket is None or tokens_bucket.try_acquire(tokens))
+        waited = 0.0
+        if requests_bucket is not None:
+            waited += requests_bucket.acquire(1, deadline)
+        if tokens_bucket is not None and tokens:
+            waited += tokens_bucket.acquire(tokens, deadline)
+        if waited:
+            metrics.count("infographic_llm_throttled_seconds_total", {"model": model}, waited)
+        return True
+
+    # Wraps function(timeout) to hold one of the in-flight slots while it runs, waiting for a slot until the deadline.
+    def _limited(self, model, function, deadline):
+        if self._slots is None:
+            return function
+
+        def limited(timeout):
+            started = time.monotonic()
+            if not self._slots.acquire(timeout=max(0, deadline - started)):
+                raise DeadlineExceeded(f"{model} call waited for a free slot past its {self.deadline}s deadline")
+            queued = time.monotonic() - started
+            if queued > 0.001:
+                metrics.count("infographic_llm_queued_seconds_total", {"model": model}, queued)
+            try:
+                return function(max(0.001, min(timeout, deadline - time.monotonic())))
+            finally:
+                self._slots.release()
+        return limited
+
+    # Calls function(timeout) for a model call and returns its result. tokens is the estimated token count of the
+    # call for the tokens-per-minute limit; hedge allows a duplicate request when the call is slow.
+    def call(self, model, function, tokens=0, hedge=False):
+        deadline = time.monotonic() + self.deadline
+        function = self._limited(model, function, deadline)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{model} call exceeded its {self.deadline}s deadline")
+            self._acquire(model, tokens, deadline)
+            timeout = min(self.call_timeout, deadline - time.monotonic())
+            try:
+                if hedge and self._hedge_pool is not None:
+                    return self._hedged(model, function, timeout, tokens, deadline)
+                return function(timeout)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                metrics.count("infographic_llm_retries_total", {"model": model})
+                logging.warning(f"Retrying {model} call in {delay:.2f}s (attempt {attempt}/{self.max_retries}): {e}")
+                time.sleep(delay)
+
+    # Sends the call, and a duplicate if it hasn't answered after hedge_after seconds and the rate limits allow.
+    # Returns the first successful result; raises the first error if every request fails.
+    def _hedged(self, model, function, timeout, tokens, deadline):
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, function, timeout)
+        done, _ = wait([primary], timeout=min(self.hedge_after, timeout))
+        if done or not self._acquire(model, tokens, deadline, block=False):
+            return primary.result(timeout=max(0, deadline - time.monotonic()))
+        metrics.count("infographic_llm_hedges_total", {"model": model})
+        hedged_timeout = min(self.call_timeout, deadline - time.monotonic())
+        pending = {primary, self._hedge_pool.submit(contextvars.copy_context().run, function, hedged_timeout)}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f"{model} call exceeded its {self.deadline}s deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        metrics.count("infographic_llm_hedge_wins_total", {"model": model})
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+# Creates the scheduler from the LLM_* environment variables (see README).
+def scheduler_from_env(call_timeout, max_in_flight=0):
+    try:
+        rate_limits = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+    except ValueError as e:
+        logging.error(f"Ignoring invalid LLM_RATE_LIMITS: {e}")
+        rate_limits = {}
+    return CallScheduler(
+        rate_limits=rate_limits,
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+        backoff_base=float(os.getenv("LLM_BACKOFF_BASE", 0.5)),
+        call_timeout=call_timeout,
+        deadline=float(os.getenv("LLM_CALL_DEADLINE", 120)),
+        hedge_after=float(os.getenv("LLM_HEDGE_AFTER", 0)),
+        max_in_flight=max_in_flight,
+    )
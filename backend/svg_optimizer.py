@@ -0,0 +1,133 @@
+# Shrinks the SVG templates once, when they are loaded (see TemplateRegistry), so that every infographic rendered
+# from them (each language's file, every response and export) is smaller:
+# - embedded raster images (the logo) are downscaled to their displayed size times image_scale,
+# - definitions (gradients, clip paths) that nothing references and unused namespace declarations are removed,
+# - comments and the whitespace between tags are dropped,
+# - numbers are shortened to PRECISION decimals ("250.0" -> "250") and default style values removed,
+# - presentation attributes a <tspan> repeats from its <text> are removed, as it inherits them.
+# Placeholders ({{name}}, BASE64) and the slot ids are kept as they are, so templates compile the same way.
+import base64
+import logging
+import re
+
+from image_processing import resize_image
+
+PRECISION = 2
+
+COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+BETWEEN_TAGS_PATTERN = re.compile(r'>\s+<')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+ATTRIBUTE_PATTERN = re.compile(r'([\w:-]+)="([^"]*)"')
+NAMESPACE_PATTERN = re.compile(r'\s+xmlns:(\w+)="[^"]*"')
+DEFS_PATTERN = re.compile(r'<defs>(.*?)</defs>', re.DOTALL)
+DEFINITION_PATTERN = re.compile(r'<(?P<tag>\w+)\b[^>]*\bid="(?P<id>[^"]+)"[^>]*?(?:/>|>.*?</(?P=tag)>)', re.DOTALL)
+NUMBER_PATTERN = re.compile(r'(?<![\w#.])(-?\d+\.\d+)')
+DEFAULT_STYLE_PATTERN = re.compile(r';?\b(?:stop-opacity|fill-opacity|stroke-opacity|opacity):1(?=;|$)')
+IMAGE_PATTERN = re.compile(r'<image\b[^>]*>')
+DATA_URI_PATTERN = re.compile(r'data:image/(png|jpeg);base64,([A-Za-z0-9+/=\s]+)')
+TEXT_PATTERN = re.compile(r'(<text\b[^>]*>)(.*?)(</text>)', re.DOTALL)
+TSPAN_PATTERN = re.compile(r'<tspan\b[^>]*>')
+# Attributes whose value a <tspan> inherits from its <text>
+INHERITED_ATTRIBUTES = {"fill", "font-family", "font-size", "font-weight", "direction", "text-anchor"}
+# Attributes whose values are numbers (with an optional unit)
+NUMERIC_ATTRIBUTES = {"x", "y", "x1", "y1", "x2", "y2", "cx", "cy", "r", "width", "height", "dx", "dy", "offset",
+                      "stroke-width", "font-size"}
+
+# Formats a number with up to PRECISION decimals and no trailing zeros.
+def format_number(value):
+    text = f"{round(float(value), PRECISION):.{PRECISION}f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+# Downscales the data URI images of an SVG to their width x height times image_scale, keeping the smaller encoding.
+def shrink_images(source, image_scale):
+    def shrink(match):
+        element = match.group(0)
+        attributes = dict(ATTRIBUTE_PATTERN.findall(element))
+        data_uri = DATA_URI_PATTERN.search(element)
+        try:
+            width = float(attributes["width"].replace("px", ""))
+            height = float(attributes["height"].replace("px", ""))
+        except (KeyError, ValueError):
+            return element
+        if data_uri is None:
+            return element
+        image_format = data_uri.group(1)
+        data = base64.b64decode("".join(data_uri.group(2).split()))
+        try:
+            resized = resize_image(data, round(width * image_scale), round(height * image_scale), image_format)
+        except Exception as e:
+            logging.error(f"Error resizing an embedded image: {e}")
+            return element
+        if len(resized) >= len(data):
+            return element
+        logging.info(f"Resized an embedded image from {len(data)} to {len(resized)} bytes")
+        encoded = base64.b64encode(resized).decode("ascii")
+        return element[:data_uri.start()] + f"data:image/{image_format};base64,{encoded}" + element[data_uri.end():]
+    return IMAGE_PATTERN.sub(shrink, source)
+
+# Removes the definitions no url(#id) or #id reference points to, and the <defs> left empty.
+def remove_unused_definitions(source):
+    def clean(match):
+        definitions = match.group(1)
+        rest = source[:match.start()] + source[match.end():]
+        for definition in DEFINITION_PATTERN.finditer(match.group(1)):
+            if f"#{definition.group('id')})" not in rest and f'"#{definition.group("id")}"' not in rest:
+                definitions = definitions.replace(definition.group(0), "")
+        return f"<defs>{definitions}</defs>" if definitions.strip() else ""
+    return DEFS_PATTERN.sub(clean, source)
+
+# Removes the xmlns:prefix declarations whose prefix isn't used.
+def remove_unused_namespaces(source):
+    def clean(match):
+        return match.group(0) if re.search(rf'\b{match.group(1)}:', source) else ""
+    return NAMESPACE_PATTERN.sub(clean, source)
+
+# Shortens the numbers of the numeric attributes and removes the default style values.
+def shorten_numbers(source):
+    def shorten(match):
+        name, value = match.group(1), match.group(2)
+        if name in NUMERIC_ATTRIBUTES:
+            value = NUMBER_PATTERN.sub(lambda number: format_number(number.group(1)), value)
+        elif name == "style":
+            value = DEFAULT_STYLE_PATTERN.sub("", value).strip(";")
+        return f'{name}="{value}"'
+    return ATTRIBUTE_PATTERN.sub(shorten, source)
+
+# Removes the inherited attributes a <tspan> repeats from its <text>, unless another <tspan> of the same text sets
+# them to a different value (which the repeated value could be overriding).
+def remove_inherited_attributes(source):
+    def clean(match):
+        parent = dict(ATTRIBUTE_PATTERN.findall(match.group(1)))
+        tspans = TSPAN_PATTERN.findall(match.group(2))
+        overridden = {
+            name for tspan in tspans for name, value in ATTRIBUTE_PATTERN.findall(tspan)
+            if name in INHERITED_ATTRIBUTES and value != parent.get(name)
+        }
+        redundant = {name for name in INHERITED_ATTRIBUTES - overridden if name in parent}
+
+        def clean_tspan(tspan):
+            return ATTRIBUTE_PATTERN.sub(lambda attribute: "" if attribute.group(1) in redundant else attribute.group(0), tspan.group(0))
+        return match.group(1) + TSPAN_PATTERN.sub(clean_tspan, match.group(2)) + match.group(3)
+    return TEXT_PATTERN.sub(clean, source)
+
+# Collapses the whitespace inside a tag to single spaces between its attributes.
+def _collapse_tag(tag):
+    return re.sub(r'\s+(/?>)$', r'\1', re.sub(r'\s+', " ", tag))
+
+# Drops the comments and the whitespace between tags and inside them.
+def collapse_whitespace(source):
+    source = COMMENT_PATTERN.sub("", source)
+    source = BETWEEN_TAGS_PATTERN.sub("><", source)
+    source = TAG_PATTERN.sub(lambda match: _collapse_tag(match.group(0)), source)
+    return source.strip()
+
+# Returns the optimized source of an SVG template.
+def optimize_svg(source, image_scale=2):
+    optimized = shrink_images(source, image_scale)
+    optimized = remove_unused_definitions(optimized)
+    optimized = remove_unused_namespaces(optimized)
+    optimized = shorten_numbers(optimized)
+    optimized = remove_inherited_attributes(optimized)
+    optimized = collapse_whitespace(optimized)
+    logging.info(f"Optimized SVG from {len(source)} to {len(optimized)} characters")
+    return optimized
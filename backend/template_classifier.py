@@ -0,0 +1,225 @@
+# Local classifier choosing the infographic template ('1' or '2') for an English user input in-process.
+# A multinomial naive Bayes model over the words of the input (and its length), trained on a few seed examples and
+# on the history of template choices; choose_template only asks the LLM when the classifier isn't confident.
+# The confidence only counts the words the classifier has seen (an input without any has no confidence), and the
+# confidence threshold is calibrated on held-out predictions (see calibrate_threshold).
+#
+# Retrain from the history (from the backend folder):
+#   python template_classifier.py retrain [--history template_history.jsonl] [--output template_classifier.json]
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+
+TEMPLATES = ("1", "2")
+WORD_PATTERN = re.compile(r"[a-z']+")
+LENGTH_PREFIX = "__length_"
+# The calibrated threshold is the lowest confidence above which the held-out predictions are at least this accurate
+TARGET_ACCURACY = 0.95
+
+# Template 1 is a header and a big image (a topic); template 2 adds sub-headers (instructions, steps, questions).
+SEED_EXAMPLES = [
+    ("Earthquake", "1"),
+    ("Fire safety", "1"),
+    ("Public transportation", "1"),
+    ("Heat wave", "1"),
+    ("Flood warning", "1"),
+    ("Tsunami", "1"),
+    ("Missile alert", "1"),
+    ("Snow storm", "1"),
+    ("The Home Front Command app", "1"),
+    ("Emergency kit", "1"),
+    ("Hazardous materials", "1"),
+    ("Independence Day events", "1"),
+    ("How to protect yourself from rockets", "2"),
+    ("Explain about the two steps to defend yourselves from a rocket attack", "2"),
+    ("What to do when a siren sounds while driving", "2"),
+    ("How do you deal with a fire in the house?", "2"),
+    ("Steps to prepare a protected space", "2"),
+    ("What should you do during an earthquake", "2"),
+    ("Instructions for staying in the shelter", "2"),
+    ("How to prepare an emergency kit for your family", "2"),
+    ("Two things to check before a storm", "2"),
+    ("Where to go if there is no protected space nearby", "2"),
+]
+
+# Returns the features of a text: its lowercase words and a bucket of its word count.
+def features(text):
+    words = WORD_PATTERN.findall(text.lower())
+    length = len(words)
+    bucket = "short" if length <= 3 else "medium" if length <= 7 else "long"
+    return words + [f"{LENGTH_PREFIX}{bucket}__"]
+
+class TemplateClassifier:
+    # threshold is the confidence from which predictions can be trusted (None: not calibrated)
+    def __init__(self, counts, documents, threshold=None):
+        self.counts = counts
+        self.documents = documents
+        self.threshold = threshold
+        self.vocabulary = set().union(*(template_counts.keys() for template_counts in counts.values()))
+        self.totals = {template: sum(counts[template].values()) for template in TEMPLATES}
+
+    # Trains a classifier on (text, template) pairs.
+    @classmethod
+    def train(cls, examples):
+        counts = {template: {} for template in TEMPLATES}
+        documents = {template: 0 for template in TEMPLATES}
+        for text, template in examples:
+            if template not in TEMPLATES:
+                continue
+            documents[template] += 1
+            for feature in features(text):
+                counts[template][feature] = counts[template].get(feature, 0) + 1
+        return cls(counts, documents)
+
+    # Returns the log-probability of each template given the features.
+    def _scores(self, text_features):
+        total_documents = sum(self.documents.values())
+        scores = {}
+        for template in TEMPLATES:
+            counts = self.counts[template]
+            denominator = self.totals[template] + len(self.vocabulary)
+            # Laplace smoothing for the class prior and the feature likelihoods
+            score = math.log((self.documents[template] + 1) / (total_documents + len(TEMPLATES)))
+            for feature in text_features:
+                score += math.log((counts.get(feature, 0) + 1) / denominator)
+            scores[template] = score
+        return scores
+
+    # Returns the most likely template and the confidence in it: its probability given the known words only.
+    # The length of the input helps choosing the template but isn't evidence on its own, so an input without any
+    # known word (off-topic or unseen) gets a confidence of 0.
+    def predict(self, text):
+        text_features = [feature for feature in features(text) if feature in self.vocabulary]
+        scores = self._scores(text_features)
+        best = max(scores, key=scores.get)
+        words = [feature for feature in text_features if not feature.startswith(LENGTH_PREFIX)]
+        if not words:
+            return best, 0.0
+        word_scores = self._scores(words)
+        probability = 1 / sum(math.exp(score - word_scores[best]) for score in word_scores.values())
+        return best, probability
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"counts": self.counts, "documents": self.documents, "threshold": self.threshold}, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls(data["counts"], data["documents"], data.get("threshold"))
+
+# Appends the template choices (input, template and who decided it) to a JSON Lines file for retraining.
+class TemplateHistory:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, text, template, source):
+        entry = {"input": text, "template": template, "source": source, "time": round(time.time(), 3)}
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.error(f"Error recording template choice: {e}")
+
+    # Returns the (input, template) pairs decided by the given sources, the latest choice of each input winning.
+    def examples(self, sources=("llm",)):
+        latest = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("source") in sources and entry.get("template") in TEMPLATES:
+                        latest[entry["input"]] = entry["template"]
+        except FileNotFoundError:
+            pass
+        return list(latest.items())
+
+# Trains a classifier on the examples, with its threshold calibrated on them.
+def train_calibrated(examples):
+    classifier = TemplateClassifier.train(examples)
+    classifier.threshold = calibrate_threshold(held_out_predictions(examples))
+    return classifier
+
+# Loads the trained classifier from model_path, or trains one on the seed examples and the history.
+def load_classifier(model_path, history):
+    if model_path and os.path.exists(model_path):
+        try:
+            classifier = TemplateClassifier.load(model_path)
+            if classifier.threshold is None:
+                classifier.threshold = calibrate_threshold(held_out_predictions(SEED_EXAMPLES + history.examples()))
+            return classifier
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Error loading template classifier {model_path}: {e}")
+    return train_calibrated(SEED_EXAMPLES + history.examples())
+
+# Returns the (confidence, correct) pair of every example, predicted by k-fold cross-validation.
+def held_out_predictions(examples, folds=5, seed=0):
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+    predictions = []
+    for fold in range(folds):
+        test = shuffled[fold::folds]
+        train = [example for index, example in enumerate(shuffled) if index % folds != fold]
+        classifier = TemplateClassifier.train(train)
+        for text, template in test:
+            predicted, confidence = classifier.predict(text)
+            predictions.append((confidence, predicted == template))
+    return predictions
+
+# Returns the lowest confidence from which the held-out predictions are at least target_accuracy accurate, or 1.0
+# (trust no prediction, always ask the LLM) if there is none.
+def calibrate_threshold(predictions, target_accuracy=TARGET_ACCURACY):
+    threshold = 1.0
+    correct = total = 0
+    # From the most confident prediction down, the accuracy of the predictions above each confidence
+    for confidence, is_correct in sorted(predictions, key=lambda prediction: -prediction[0]):
+        if confidence <= 0:
+            break
+        correct += is_correct
+        total += 1
+        if correct / total >= target_accuracy:
+            threshold = confidence
+    return threshold
+
+# Returns the accuracy of k-fold cross-validation on the examples.
+def cross_validate(examples, folds=5, seed=0):
+    predictions = held_out_predictions(examples, folds, seed)
+    return sum(correct for _, correct in predictions) / len(predictions) if predictions else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the template classifier from the history of template choices.")
+    parser.add_argument("command", choices=["retrain"])
+    parser.add_argument("--history", default=os.getenv("TEMPLATE_HISTORY_PATH", "template_history.jsonl"))
+    parser.add_argument("--output", default=os.getenv("TEMPLATE_CLASSIFIER_PATH", "template_classifier.json"))
+    parser.add_argument("--include-classifier", action="store_true", help="also train on the choices the classifier made itself")
+    args = parser.parse_args()
+
+    sources = ("llm", "classifier") if args.include_classifier else ("llm",)
+    history = TemplateHistory(args.history).examples(sources)
+    examples = SEED_EXAMPLES + history
+    counts = {template: sum(1 for _, label in examples if label == template) for template in TEMPLATES}
+    print(f"Training on {len(examples)} examples ({len(history)} from the history): {counts}")
+    predictions = held_out_predictions(examples)
+    print(f"Cross-validated accuracy: {sum(correct for _, correct in predictions) / len(predictions):.1%}")
+    classifier = train_calibrated(examples)
+    trusted = [correct for confidence, correct in predictions if confidence >= classifier.threshold]
+    print(
+        f"Confidence threshold: {classifier.threshold:.3f} ({len(trusted)}/{len(predictions)} held-out predictions above it, "
+        f"{sum(trusted) / len(trusted) if trusted else 0:.1%} accurate)"
+    )
+    classifier.save(args.output)
+    print(f"Saved the classifier to {args.output}")
+
+if __name__ == "__main__":
+    main()
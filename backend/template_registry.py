@@ -0,0 +1,138 @@
+import logging
+import os
+import re
+import threading
+import time
+
+# Matches the slots of a template: whole <text id="textN"> elements, {{placeholders}} and the BASE64 image placeholder.
+SLOT_PATTERN = re.compile(
+    r'(?P<element><text[^>]*\bid="(?P<element_id>text\d+)"[^>]*>.*?</text>)'
+    r'|\{\{(?P<placeholder>\w+)\}\}'
+    r'|(?P<base64>BASE64)',
+    re.DOTALL,
+)
+PLACEHOLDER_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+# Matches the generated image's <image id="image1"> element.
+IMAGE_ELEMENT_PATTERN = re.compile(r'<image[^>]*\bid="image1"[^>]*>')
+
+# Splits text into static strings and ("placeholder", name, original) tuples.
+def _compile_placeholders(text):
+    parts = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        parts.append(text[position:match.start()])
+        parts.append(("placeholder", match.group(1), match.group(0)))
+        position = match.end()
+    parts.append(text[position:])
+    return [part for part in parts if part != ""]
+
+# An SVG template pre-parsed into static chunks and named slots, rendered with a single join.
+class CompiledTemplate:
+    def __init__(self, name, source):
+        self.name = name
+        self.parts = []
+        position = 0
+        for match in SLOT_PATTERN.finditer(source):
+            self.parts.append(source[position:match.start()])
+            if match.group("element"):
+                # An element slot keeps its original markup (with its own placeholders) as the default.
+                self.parts.append(("element", match.group("element_id"), _compile_placeholders(match.group("element"))))
+            elif match.group("placeholder"):
+                self.parts.append(("placeholder", match.group("placeholder"), match.group(0)))
+            else:
+                self.parts.append(("placeholder", "image", match.group(0)))
+            position = match.end()
+        self.parts.append(source[position:])
+        self.parts = [part for part in self.parts if part != ""]
+        self.slots = {part[1] for part in self.parts if isinstance(part, tuple)}
+        self.image_size = self._read_image_size(source)
+
+    # Returns the (width, height) in pixels of the generated image's slot, or None if the template has none.
+    @staticmethod
+    def _read_image_size(source):
+        match = IMAGE_ELEMENT_PATTERN.search(source)
+        if not match:
+            return None
+        size = []
+        for attribute in ("width", "height"):
+            value = re.search(rf'\b{attribute}="([\d.]+)(?:px)?"', match.group(0))
+            if not value:
+                return None
+            size.append(round(float(value.group(1))))
+        return tuple(size)
+
+    @staticmethod
+    def _render_parts(parts, values, out):
+        for part in parts:
+            if isinstance(part, str):
+                out.append(part)
+            else:
+                out.append(values.get(part[1], part[2]))
+
+    # Renders the template. values maps placeholder names (e.g. "direction", "footer_text", "image") to text,
+    # and elements maps text element ids (e.g. "text1") to their replacement markup.
+    # Placeholders without a value are left as they are and elements without a replacement keep their original markup.
+    def render(self, values, elements=None):
+        elements = elements or {}
+        out = []
+        for part in self.parts:
+            if isinstance(part, str):
+                out.append(part)
+            elif part[0] == "element":
+                if part[1] in elements:
+                    out.append(elements[part[1]])
+                else:
+                    self._render_parts(part[2], values, out)
+            else:
+                out.append(values.get(part[1], part[2]))
+        return "".join(out)
+
+# Loads and compiles the SVG templates once, optionally watching the files and recompiling them on change.
+# optimize, if given, is applied to the source of each template before it is compiled (see svg_optimizer).
+class TemplateRegistry:
+    def __init__(self, directory=".", names=(), hot_reload=False, interval=2.0, optimize=None):
+        self.directory = directory
+        self.interval = interval
+        self.optimize = optimize
+        self._templates = {}
+        self._mtimes = {}
+        self._lock = threading.Lock()
+        for name in names:
+            self.load(name)
+        if hot_reload:
+            threading.Thread(target=self._watch, name="template-watcher", daemon=True).start()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Reads and compiles a template file, replacing any previously compiled version.
+    def load(self, name):
+        path = self._path(name)
+        with open(path, "r", encoding="utf-8") as file:
+            source = file.read()
+        if self.optimize is not None:
+            source = self.optimize(source)
+        template = CompiledTemplate(name, source)
+        with self._lock:
+            self._templates[name] = template
+            self._mtimes[name] = os.path.getmtime(path)
+        logging.info(f"Loaded template {name} with slots: {sorted(template.slots)}")
+        return template
+
+    # Returns the compiled template, loading it on first use if it wasn't preloaded.
+    def get(self, name):
+        template = self._templates.get(name)
+        if template is None:
+            template = self.load(name)
+        return template
+
+    # Polls the template files and recompiles the ones that changed.
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            for name, mtime in list(self._mtimes.items()):
+                try:
+                    if os.path.getmtime(self._path(name)) != mtime:
+                        self.load(name)
+                except Exception as e:
+                    logging.error(f"Error reloading template {name}: {e}")
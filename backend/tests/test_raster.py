@@ -0,0 +1,72 @@
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from raster import Rasterizer, parse_size, rasterization_available, rasterize
+
+SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100" viewBox="0 0 100 100">'
+    '<rect width="100" height="100" fill="#ff0000"/></svg>'
+)
+
+needs_cairo = pytest.mark.skipif(not rasterization_available(), reason="cairosvg or the cairo library is not installed")
+
+
+def test_parse_size():
+    assert parse_size("square") == (1080, 1080)
+    assert parse_size("640x480") == (640, 480)
+    assert parse_size("8x8") is None
+    assert parse_size("5000x100") is None
+    assert parse_size(None) is None
+
+
+def test_render_builds_the_svg_outside_the_lock():
+    rasterizer = Rasterizer(workers=1)
+
+    def get_svg():
+        # Another thread can look up an output while this SVG is being built
+        looked_up = threading.Event()
+        thread = threading.Thread(target=lambda: (rasterizer._lookup(("other",)), looked_up.set()))
+        thread.start()
+        thread.join(timeout=5)
+        assert looked_up.is_set()
+        raise RuntimeError("stop before rasterizing")
+
+    with pytest.raises(RuntimeError):
+        rasterizer.render(("job", "he", (100, 100), "png"), get_svg, 100, 100, "png")
+    assert rasterizer._pending == {}
+
+
+@needs_cairo
+@pytest.mark.parametrize("image_format", ["png", "jpeg", "webp"])
+def test_rasterize(image_format):
+    from PIL import Image
+
+    data = rasterize(SVG, 200, 100, image_format)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (200, 100)
+        assert image.format == image_format.upper()
+        # The square SVG is centered on the background color
+        assert image.convert("RGB").getpixel((100, 50))[0] > 200
+        assert image.convert("RGB").getpixel((5, 50))[2] > 80
+
+
+@needs_cairo
+def test_render_caches_and_shares_renders():
+    rasterizer = Rasterizer(workers=1)
+    calls = []
+
+    def get_svg():
+        calls.append(1)
+        return SVG
+
+    key = ("job", "he", (100, 100), "png")
+    first = rasterizer.render(key, get_svg, 100, 100, "png", timeout=60)
+    second = rasterizer.render(key, get_svg, 100, 100, "png", timeout=60)
+    assert first == second
+    assert len(calls) == 1
@@ -0,0 +1,150 @@
+# Lays out the infographic texts by their width in pixels instead of their character count.
+# Widths come from per-character advance tables of the Rubik font (in 1/1000 em) for Latin, Hebrew, Arabic and
+# Cyrillic, generated from the font files with fontTools:
+#   python text_layout.py generate Rubik-Regular.ttf Rubik-Bold.ttf [--output rubik_metrics.json]
+# or from the variable font Google Fonts distributes, instanced at the regular and bold weights:
+#   python text_layout.py generate "Rubik[wght].ttf" [--output rubik_metrics.json]
+# Without the generated file (see LAYOUT_METRICS_PATH) there is no layout, and the texts are wrapped by their
+# character count as before.
+import argparse
+import json
+import logging
+import os
+from functools import lru_cache
+
+# Width of characters missing from the tables.
+DEFAULT_WIDTH = 580
+
+# The weights the generator instances a variable font at.
+REGULAR_WEIGHT = 400
+BOLD_WEIGHT = 700
+# The Unicode ranges the generator reads from the fonts.
+GENERATED_RANGES = [(0x20, 0x7E), (0xA0, 0x17F), (0x400, 0x4FF), (0x590, 0x5FF), (0x600, 0x6FF), (0x2010, 0x2027)]
+
+# One laid-out text: its lines, the font size they were laid out at, and whether they fit the box
+# (words_fitted counts the words placed before the text was cut to the box).
+class Layout:
+    def __init__(self, lines, font_size, fits, words_fitted):
+        self.lines = lines
+        self.font_size = font_size
+        self.fits = fits
+        self.words_fitted = words_fitted
+
+# The area of a text slot: its width in pixels, the maximum number of lines, and the font sizes to try, largest first.
+class TextBox:
+    def __init__(self, width, max_lines, font_sizes, bold=False):
+        self.width = width
+        self.max_lines = max_lines
+        self.font_sizes = font_sizes
+        self.bold = bold
+
+class TextLayout:
+    def __init__(self, widths):
+        self.widths = widths
+        self.measure_word = lru_cache(maxsize=4096)(self._measure_word)
+
+    # Loads the generated tables from metrics_path. Returns None if there are none.
+    @classmethod
+    def from_file(cls, metrics_path=None):
+        if not metrics_path or not os.path.exists(metrics_path):
+            logging.warning(f"No glyph metrics at {metrics_path}, wrapping the texts by character count (see text_layout.py generate)")
+            return None
+        try:
+            with open(metrics_path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            return cls({weight: data[weight] for weight in ("regular", "bold")})
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Error loading glyph metrics {metrics_path}, wrapping the texts by character count: {e}")
+            return None
+
+    # Width of a word in 1/1000 em.
+    def _measure_word(self, word, bold):
+        widths = self.widths["bold" if bold else "regular"]
+        return sum(widths.get(character, DEFAULT_WIDTH) for character in word)
+
+    # Width of a text in pixels at a font size.
+    def measure(self, text, font_size, bold=False):
+        return self.measure_word(text, bold) * font_size / 1000
+
+    # Breaks a text into lines no wider than width pixels at a font size (a word wider than a line gets its own line).
+    def wrap(self, text, width, font_size, bold=False):
+        limit = width * 1000 / font_size
+        space = self.measure_word(" ", bold)
+        lines = []
+        current, current_width = [], 0
+        for word in text.split():
+            word_width = self.measure_word(word, bold)
+            if current and current_width + space + word_width > limit:
+                lines.append(" ".join(current))
+                current, current_width = [], 0
+            current_width += (space if current else 0) + word_width
+            current.append(word)
+        if current:
+            lines.append(" ".join(current))
+        return lines
+
+    # Fits a text in a box, stepping down through its font sizes until the lines fit.
+    # If the text doesn't fit even at the smallest size, it is cut to the box at that size.
+    def fit(self, text, box):
+        words = text.split()
+        for font_size in box.font_sizes:
+            lines = self.wrap(text, box.width, font_size, box.bold)
+            if len(lines) <= box.max_lines and all(self.measure(line, font_size, box.bold) <= box.width for line in lines):
+                return Layout(lines, font_size, True, len(words))
+        font_size = box.font_sizes[-1]
+        lines = self.wrap(text, box.width, font_size, box.bold)[:box.max_lines]
+        # Drop the words of the last line that overflow, then the characters of a single word still too wide
+        last = lines[-1].split() if lines else []
+        while len(last) > 1 and self.measure(" ".join(last), font_size, box.bold) > box.width:
+            last.pop()
+        last_line = " ".join(last)
+        while len(last_line) > 1 and self.measure(last_line, font_size, box.bold) > box.width:
+            last_line = last_line[:-1]
+        if lines:
+            lines[-1] = last_line.rstrip()
+        words_fitted = sum(len(line.split()) for line in lines[:-1]) + len(last)
+        return Layout(lines, font_size, False, words_fitted)
+
+    # Returns whether a text fits a box at one of its font sizes.
+    def fits(self, text, box):
+        return self.fit(text, box).fits
+
+# Reads the advance widths of the covered characters from a font file, scaled to 1/1000 em.
+# A variable font is instanced at the given weight first.
+def font_widths(path, weight=None):
+    from fontTools.ttLib import TTFont
+    font = TTFont(path)
+    if "fvar" in font:
+        from fontTools.varLib import instancer
+        if weight is None:
+            raise ValueError(f"{path} is a variable font, a weight is needed")
+        font = instancer.instantiateVariableFont(font, {"wght": weight})
+    cmap = font.getBestCmap()
+    metrics = font["hmtx"]
+    units_per_em = font["head"].unitsPerEm
+    widths = {}
+    for first, last in GENERATED_RANGES:
+        for code_point in range(first, last + 1):
+            glyph = cmap.get(code_point)
+            if glyph is not None:
+                widths[chr(code_point)] = round(metrics[glyph][0] * 1000 / units_per_em)
+    return widths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the glyph width tables of the text layout from the Rubik font files.")
+    parser.add_argument("command", choices=["generate"])
+    parser.add_argument("regular", help="path to Rubik-Regular.ttf, or to the variable Rubik[wght].ttf")
+    parser.add_argument("bold", nargs="?", help="path to Rubik-Bold.ttf (the variable font when omitted)")
+    parser.add_argument("--output", default=os.getenv("LAYOUT_METRICS_PATH", "rubik_metrics.json"))
+    args = parser.parse_args()
+
+    data = {
+        "regular": font_widths(args.regular, REGULAR_WEIGHT),
+        "bold": font_widths(args.bold or args.regular, BOLD_WEIGHT),
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=0)
+    print(f"Saved {len(data['regular'])} regular and {len(data['bold'])} bold glyph widths to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Pre-generated infographics of the common emergency topics, so that the requests editors send all at once when an
+# incident starts are answered right away instead of each running the whole pipeline.
+# Each topic is generated ahead of time in all languages and with both templates, and stored in WARM_POOL_DIR with
+# the fingerprint of the templates, prompts and layout it was generated with (see app.pipeline_fingerprint).
+# Entries whose fingerprint no longer matches or older than WARM_POOL_TTL aren't served, and are regenerated by the
+# next refresh: this CLI (e.g. from cron) or the background refresher of the server (WARM_POOL_INTERVAL).
+#
+# Usage (from the backend folder):
+#   python warm_pool.py refresh [--topics warm_topics.txt] [--force]
+#   python warm_pool.py list
+#   python warm_pool.py invalidate
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from response_cache import make_key, normalize_text
+
+class WarmPool:
+    def __init__(self, directory, ttl=24 * 3600):
+        self.directory = directory
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_input):
+        return os.path.join(self.directory, f"{make_key('warm', user_input)}.json")
+
+    # Returns the stamp of an entry's file, which changes whenever the file is replaced, or None if there's no file.
+    def _stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    # Returns the stored entry of an input, or None. The file is read again when another process (the CLI or another
+    # worker) replaced or deleted it since this one last read or wrote it.
+    def get(self, user_input):
+        user_input = normalize_text(user_input)
+        path = self._path(user_input)
+        stamp = self._stamp(path)
+        with self._lock:
+            cached = self._entries.get(user_input)
+            if stamp is None:
+                self._entries.pop(user_input, None)
+                return None
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading warm pool entry for {user_input!r}: {e}")
+            return None
+        with self._lock:
+            self._entries[user_input] = (stamp, entry)
+        return entry
+
+    # Stores the entry of an input: {"template": the template the pipeline chooses, "results": {template: {"svgs":
+    # SVGs by language, "sources": what they were rendered from}}, "fingerprint": ...}.
+    def put(self, user_input, entry):
+        user_input = normalize_text(user_input)
+        entry = {**entry, "input": user_input, "created_at": time.time()}
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        path = self._path(user_input)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._entries[user_input] = (self._stamp(path), entry)
+        return entry
+
+    # Returns whether an entry can be served: generated with the current fingerprint and within the TTL.
+    def is_fresh(self, entry, fingerprint):
+        return entry is not None and entry.get("fingerprint") == fingerprint and time.time() - entry["created_at"] < self.ttl
+
+    # Returns every stored entry.
+    def entries(self):
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as file:
+                    entries.append(json.load(file))
+            except (OSError, ValueError) as e:
+                logging.error(f"Error loading warm pool entry {name}: {e}")
+        return entries
+
+    # Deletes the entries not generated with fingerprint and returns how many were deleted.
+    def invalidate(self, fingerprint):
+        deleted = 0
+        for entry in self.entries():
+            if entry.get("fingerprint") != fingerprint:
+                try:
+                    os.remove(self._path(entry["input"]))
+                    deleted += 1
+                except OSError as e:
+                    logging.error(f"Error deleting warm pool entry for {entry['input']!r}: {e}")
+        with self._lock:
+            self._entries = {key: cached for key, cached in self._entries.items() if cached[1].get("fingerprint") == fingerprint}
+        return deleted
+
+# Reads the curated topics: one Hebrew input per line (see batch.parse_inputs).
+def read_topics(path):
+    from batch import parse_inputs
+    with open(path, "r", encoding="utf-8") as file:
+        return parse_inputs(file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate the infographics of the common emergency topics.")
+    parser.add_argument("command", choices=["refresh", "list", "invalidate"])
+    parser.add_argument("--topics", default=os.getenv("WARM_POOL_TOPICS", "warm_topics.txt"))
+    parser.add_argument("--force", action="store_true", help="regenerate the topics even if their entries are fresh")
+    args = parser.parse_args()
+
+    import app
+    if app.warm_pool is None:
+        raise SystemExit("The warm pool is disabled (WARM_POOL=False)")
+    fingerprint = app.pipeline_fingerprint()
+    if args.command == "refresh":
+        started = time.perf_counter()
+        results = app.refresh_warm_pool(read_topics(args.topics), force=args.force)
+        for topic, outcome in results.items():
+            print(f"{outcome:9} {topic}")
+        print(f"Refreshed in {time.perf_counter() - started:.1f}s")
+    elif args.command == "list":
+        for entry in app.warm_pool.entries():
+            state = "fresh" if app.warm_pool.is_fresh(entry, fingerprint) else "stale"
+            age = (time.time() - entry["created_at"]) / 3600
+            print(f"{state:5} {age:6.1f}h  template {entry['template']}  {entry['input']}")
+    else:
+        print(f"Deleted {app.warm_pool.invalidate(fingerprint)} stale entries")
+
+if __name__ == "__main__":
+    main()
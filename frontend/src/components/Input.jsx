@@ -8,19 +8,31 @@ function Input() {
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState(null);
     const [svgData, setSvgData] = useState(null);
+    const [jobId, setJobId] = useState(null);
     const previewRef = useRef(null);
     const [isLanguagePopupOpen, setIsLanguagePopupOpen] = useState(false);
     const [selectedLanguage, setSelectedLanguage] = useState('he');
     const [svgLoaded, setSvgLoaded] = useState(false);
 
+    const [progress, setProgress] = useState(null);
+    const [readyLanguages, setReadyLanguages] = useState([]);
+    const [exportFormat, setExportFormat] = useState('svg');
+    const eventSourceRef = useRef(null);
+
     const handleClick = async () => {
         console.log("handleClick called");
         console.log("Input value:", infographicData.current.value);
         setError(null);
         setLoading(true);
+        setProgress(null);
+        setReadyLanguages([]);
+        setSvgLoaded(false);
+        if (eventSourceRef.current) {
+            eventSourceRef.current.close();
+        }
         try {
             console.log("Sending request with data:", infographicData.current.value);
-            const response = await fetch(`${serverUrl}/infographic`, {
+            const response = await fetch(`${serverUrl}/jobs`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 credentials: 'include',
@@ -33,22 +45,80 @@ function Input() {
                 throw new Error(`Server responded with status: ${response.status}`);
             }
             const data = await response.json();
-            console.log("Data received:", data);
-            setSvgData(data.updated_svg);
-            setSvgLoaded(true);
+            console.log("Job started:", data);
+            setJobId(data.job_id);
+            setSelectedLanguage('he');
+            setTempSelectedLanguage('he');
+
+            // Follow the job's progress, the Hebrew infographic is shown as soon as it's ready
+            const events = new EventSource(`${serverUrl}/jobs/${data.job_id}/events`);
+            eventSourceRef.current = events;
+            events.addEventListener('stage', (event) => {
+                const stage = JSON.parse(event.data);
+                setProgress(`${stage.completed}/${stage.total}`);
+            });
+            // Until the Hebrew infographic is ready, previews show the texts generated so far with a placeholder image
+            let hebrewReady = false;
+            events.addEventListener('preview', (event) => {
+                const preview = JSON.parse(event.data);
+                if (!hebrewReady) {
+                    setSvgData(preview.svg);
+                }
+            });
+            events.addEventListener('svg', async (event) => {
+                // The event carries the URL of the SVG, which is fetched (compressed and cached) only when shown
+                const result = JSON.parse(event.data);
+                setReadyLanguages((languages) => [...languages, result.language]);
+                if (result.language === 'he') {
+                    hebrewReady = true;
+                    const svgResponse = await fetch(result.url, { credentials: 'include' });
+                    setSvgData(await svgResponse.text());
+                    setSvgLoaded(true);
+                    setLoading(false);
+                }
+            });
+            events.addEventListener('done', (event) => {
+                // Languages rendered on demand (lazy mode) are available without having been sent yet
+                const result = JSON.parse(event.data);
+                if (result.available) {
+                    setReadyLanguages(result.available);
+                }
+                events.close();
+                setLoading(false);
+                setProgress(null);
+            });
+            events.addEventListener('error', (event) => {
+                // Errors sent by the server carry data, connection errors don't
+                events.close();
+                setLoading(false);
+                setProgress(null);
+                const message = event.data ? JSON.parse(event.data).error : 'Lost connection to the server';
+                setError(`Error: ${message}`);
+            });
         } catch (error) {
             console.error('Error:', error);
             setError(`Error: ${error.message}`);
-        } finally {
             setLoading(false);
         }
     };
 
+    useEffect(() => {
+        return () => {
+            if (eventSourceRef.current) {
+                eventSourceRef.current.close();
+            }
+        };
+    }, []);
+
     const downloadSvg = () => {
         if (!svgData) return;
+        // The server returns a self-contained SVG (the image may only be linked in the preview)
         const element = document.createElement("a");
-        element.href = URL.createObjectURL(new Blob([svgData], { type: 'image/svg+xml' }));
-        element.download = `infographic_${selectedLanguage}.svg`; // Use selectedLanguage here
+        // The other formats are rendered by the server at the chosen size, e.g. 'png:story'
+        const [format, size] = exportFormat.split(':');
+        const query = size ? `&format=${format}&size=${size}` : '';
+        element.href = `${serverUrl}/export?job_id=${jobId}&language=${selectedLanguage}${query}`;
+        element.download = size ? `infographic_${selectedLanguage}_${size}.${format}` : `infographic_${selectedLanguage}.svg`;
         document.body.appendChild(element);
         element.click();
         document.body.removeChild(element);
@@ -85,16 +155,12 @@ function Input() {
         setIsLanguagePopupOpen(false);
         setLoading(true);
         try {
-            const response = await fetch(`${serverUrl}/change_language`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ language: tempSelectedLanguage }),
-            });
+            // A language seen before comes from the browser cache (or a 304) instead of being downloaded again
+            const response = await fetch(`${serverUrl}/jobs/${jobId}/svg/${tempSelectedLanguage}`, { credentials: 'include' });
             if (!response.ok) {
                 throw new Error(`Server responded with status: ${response.status}`);
             }
-            const data = await response.json();
-            setSvgData(data.updated_svg);
+            setSvgData(await response.text());
         } catch (error) {
             console.error('Error:', error);
             setError(`Error: ${error.message}`);
@@ -114,7 +180,7 @@ function Input() {
                         </div>
                     </div>
                     <button className="generate-button" onClick={handleClick} disabled={loading} >
-                        {loading ? (<><Loader size={18} className="spinner" /><span>מעבד...</span></>) : (<span>צור אינפוגרפיקה</span>)}
+                        {loading ? (<><Loader size={18} className="spinner" /><span>מעבד... {progress}</span></>) : (<span>צור אינפוגרפיקה</span>)}
                     </button>
                 </div>
             </div>
@@ -122,7 +188,16 @@ function Input() {
             <div className="preview-section">
                 <h2 className="preview-title">תוצר סופי</h2>
                 <div className="template-preview" ref={previewRef} onClick={svgLoaded ? changeLanguage : null} />
-                {svgData && (<button className="download-button" onClick={downloadSvg}><Download size={18} /><span>הורד SVG</span></button>)}
+                {svgLoaded && svgData && (
+                <div className="download-row">
+                    <select value={exportFormat} className="export-select" onChange={(e) => setExportFormat(e.target.value)}>
+                        <option value="svg">SVG</option>
+                        <option value="png:square">PNG ריבוע 1080x1080</option>
+                        <option value="png:story">PNG סטורי 1080x1920</option>
+                        <option value="jpeg:banner">JPEG באנר 1200x628</option>
+                    </select>
+                    <button className="download-button" onClick={downloadSvg}><Download size={18} /><span>הורד</span></button>
+                </div>)}
             </div>
             {isLanguagePopupOpen && (
             <div className="background-dim">
@@ -130,9 +205,9 @@ function Input() {
                     <h2 className="popup-title">בחירת שפה</h2>
                     <select value={tempSelectedLanguage} className="language-select" onChange={(e) => handleLanguageSelection(e.target.value)}>
                         <option value="he">עברית</option>
-                        <option value="ar">ערבית</option>
-                        <option value="en">אנגלית</option>
-                        <option value="ru">רוסית</option>
+                        <option value="ar" disabled={!readyLanguages.includes('ar')}>ערבית</option>
+                        <option value="en" disabled={!readyLanguages.includes('en')}>אנגלית</option>
+                        <option value="ru" disabled={!readyLanguages.includes('ru')}>רוסית</option>
                     </select>
                     <div className="button-container">
                         <button className="cancel-button" onClick={() => setIsLanguagePopupOpen(false)}>ביטול</button>